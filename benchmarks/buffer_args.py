@@ -0,0 +1,37 @@
+# per-call cost of passing buffers to pointer parameters, compared with the
+# previous path (dtype check + np.ctypeslib.as_ctypes + POINTER argtypes)
+# build testing/global_functions.cpp to global_functions.so first
+import ctypes
+import array
+import timeit
+import numpy as np
+import pyffi
+
+lib = pyffi.Lib("./global_functions.so")
+count_zeros = lib.FFIGlobalFunc("count_zeros")
+byte_sum = lib.FFIGlobalFunc("byte_sum")
+
+entry = lib.ffi_find_access_entry(pyffi.FFIAccessEntryType.kGlobalFunc,"count_zeros")
+ndarray_count_zeros = ctypes.CFUNCTYPE(ctypes.c_uint64,ctypes.POINTER(ctypes.c_uint32),ctypes.c_uint64)(entry.ptr)
+def as_ctypes_count_zeros(arg,n):
+    assert isinstance(arg,np.ndarray)
+    assert arg.dtype == np.uint32
+    return ndarray_count_zeros(np.ctypeslib.as_ctypes(arg),n)
+
+nd = np.zeros(64,dtype=np.uint32)
+arr = array.array("I",bytes(256))
+data = bytes(256)
+buf = bytearray(256)
+
+N = 200000
+cases = [
+    ("ndarray (as_ctypes)", lambda: as_ctypes_count_zeros(nd,64)),
+    ("ndarray", lambda: count_zeros(nd,64)),
+    ("array.array", lambda: count_zeros(arr,64)),
+    ("bytes (const)", lambda: byte_sum(data,256)),
+    ("bytearray (const)", lambda: byte_sum(buf,256)),
+    ("memoryview (const)", lambda: byte_sum(memoryview(buf),256)),
+]
+for name, f in cases:
+    t = min(timeit.repeat(f,number=N,repeat=5)) / N * 1e9
+    print("{:<24} {:8.1f} ns/call".format(name,t))
@@ -0,0 +1,38 @@
+# per-call overhead of pyffi callables compared with raw ctypes.CFUNCTYPE calls
+# build testing/global_functions.cpp to global_functions.so first
+import ctypes
+import timeit
+import numpy as np
+import pyffi
+
+lib = pyffi.Lib("./global_functions.so")
+
+class Mult(lib.FFIGlobalFunc):
+    def __init__(self) -> None:
+        super().__init__("mult")
+
+class Count_Zeros(lib.FFIGlobalFunc):
+    def __init__(self) -> None:
+        super().__init__("count_zeros")
+
+mult = Mult()
+count_zeros = Count_Zeros()
+
+entry = lib.ffi_find_access_entry(pyffi.FFIAccessEntryType.kGlobalFunc,"mult")
+raw_mult = ctypes.CFUNCTYPE(ctypes.c_double,ctypes.c_double,ctypes.c_double)(entry.ptr)
+entry = lib.ffi_find_access_entry(pyffi.FFIAccessEntryType.kGlobalFunc,"count_zeros")
+raw_count_zeros = ctypes.CFUNCTYPE(ctypes.c_uint64,ctypes.POINTER(ctypes.c_uint32),ctypes.c_uint64)(entry.ptr)
+
+array = np.array([1,2,3,4,5,0,0,0],dtype = np.uint32)
+array_ptr = np.ctypeslib.as_ctypes(array)
+
+N = 200000
+cases = [
+    ("mult(5.0,6.0)", lambda: mult(5.0,6.0), lambda: raw_mult(5.0,6.0)),
+    ("count_zeros(array,8)", lambda: count_zeros(array,8), lambda: raw_count_zeros(array_ptr,8)),
+]
+for name, f_pyffi, f_raw in cases:
+    t_pyffi = min(timeit.repeat(f_pyffi,number=N,repeat=5)) / N * 1e9
+    t_raw = min(timeit.repeat(f_raw,number=N,repeat=5)) / N * 1e9
+    print("{:<24} pyffi: {:8.1f} ns/call  raw CFUNCTYPE: {:8.1f} ns/call  overhead: {:8.1f} ns/call".format(
+        name,t_pyffi,t_raw,t_pyffi-t_raw))
@@ -0,0 +1,40 @@
+# construction rate and per-instance memory of FFIClassBase handles
+# build testing/class_1.cpp to class_1.so first
+import sys
+import timeit
+import tracemalloc
+import pyffi
+
+lib_path = sys.argv[1] if len(sys.argv) > 1 else "./class_1.so"
+# a registered class could only be bound once per Lib
+lib = pyffi.Lib(lib_path)
+compact_lib = pyffi.Lib(lib_path)
+
+class FooClass(lib.FFIClassBase):
+    cffi_registered_name = "fooclass"
+
+class CompactFooClass(compact_lib.FFIClassBase):
+    # no per-instance __dict__
+    __slots__ = ()
+    cffi_registered_name = "fooclass"
+
+def wrap(cls,n):
+    # the same path that wraps pointers returned from cpp
+    objs = []
+    for i in range(n):
+        obj = cls.create()
+        obj._ptr = i*64+64
+        objs.append(obj)
+    return objs
+
+N = 100000
+for cls in (FooClass,CompactFooClass):
+    t = min(timeit.repeat(lambda: wrap(cls,N),number=1,repeat=5)) / N * 1e9
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = wrap(cls,N)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the handles do not own the (fake) addresses, nothing is destroyed
+    del objs
+    print("{:<16} {:8.1f} ns/instance  {:6.1f} bytes/instance".format(cls.__name__,t,(after-before)/N))
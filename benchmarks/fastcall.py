@@ -0,0 +1,30 @@
+# per-call time of the same lib through the METH_FASTCALL backend and through ctypes
+# build testing/global_functions.cpp with the backend to global_functions.so first:
+#   g++ -std=c++20 -shared -fPIC -O2 -I cpp -I <python include dir> -include ffi_fastcall.hpp \
+#       -o global_functions.so testing/global_functions.cpp cpp/ffi_man.cpp
+import timeit
+import numpy as np
+import pyffi
+
+lib_fastcall = pyffi.Lib("./global_functions.so")
+lib_ctypes = pyffi.Lib("./global_functions.so",fastcall=False)
+assert lib_fastcall.fastcall is not None, "global_functions.so was built without ffi_fastcall.hpp"
+
+array = np.array([1,2,3,4,5,0,0,0],dtype = np.uint32)
+
+N = 200000
+for lib_name, lib in [("ctypes",lib_ctypes),("fastcall",lib_fastcall)]:
+    mult = lib.FFIGlobalFunc("mult")
+    count_zeros = lib.FFIGlobalFunc("count_zeros")
+    cstrtester = lib.FFIGlobalFunc("cstrtester")
+    mult_gil = lib.FFIGlobalFunc("mult")
+    mult_gil.ffi_set_release_gil(False)
+    cases = [
+        ("mult(5.0,6.0)", lambda: mult(5.0,6.0)),
+        ("mult(5.0,6.0) holding gil", lambda: mult_gil(5.0,6.0)),
+        ("count_zeros(array,8)", lambda: count_zeros(array,8)),
+        ("cstrtester()", lambda: cstrtester()),
+    ]
+    for name, f in cases:
+        t = min(timeit.repeat(f,number=N,repeat=5)) / N * 1e9
+        print("{:<8} {:<28} {:8.1f} ns/call".format(lib_name,name,t))
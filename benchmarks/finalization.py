@@ -0,0 +1,46 @@
+# cost of dropping owning handles with destructors called in __del__ and with deferred destructors:
+# time spent in every single refcount drop (p50/p99/max), and total time including the flushes.
+# every dropped object is replaced by a new one, the thresholds are checked on construction
+# build benchmarks/fixtures/stress.cpp to stress.so first
+import sys
+import time
+import numpy as np
+import pyffi
+
+lib_path = sys.argv[1] if len(sys.argv) > 1 else "./stress.so"
+N = 100000
+
+def run(flush_threshold=None,deferred=True):
+    # a registered class could only be bound once per Lib
+    lib = pyffi.Lib(lib_path)
+    class Node(lib.FFIClassBase):
+        __slots__ = ()
+        cffi_registered_name = "node"
+    if deferred:
+        lib.ffi_enable_deferred_destructors(flush_threshold)
+    objs = [Node(1.0,1) for _ in range(N)]
+    drops = np.empty(N,dtype=np.int64)
+    clock = time.perf_counter_ns
+    t = clock()
+    for i in range(N):
+        t0 = clock()
+        objs[i] = None
+        drops[i] = clock()-t0
+        objs[i] = Node(1.0,1)
+    flush_t0 = clock()
+    lib.flush_destructors()
+    flush = clock()-flush_t0
+    total = clock()-t
+    p50, p99 = np.percentile(drops,[50,99])
+    return p50, p99, drops.max(), flush, total
+
+cases = {
+    "__del__": dict(deferred=False),
+    "deferred, flush at end": dict(flush_threshold=None),
+    "deferred, threshold 1024": dict(flush_threshold=1024),
+}
+print("{} objects".format(N))
+for name, kw in cases.items():
+    p50, p99, worst, flush, total = run(**kw)
+    print("{:<26} drop p50 {:6.0f} ns  p99 {:7.0f} ns  max {:9.0f} ns  final flush {:7.2f} ms  total {:7.2f} ms".format(
+        name,p50,p99,worst,flush/1e6,total/1e6))
@@ -0,0 +1,83 @@
+#include "ffi_man.hpp"
+#include <cstdint>
+
+// one function per signature shape, and a class without side effects in its
+// constructor/destructor, so the benchmarks measure pyffi rather than the functions
+
+double add_f64(double x, double y){
+    return x+y;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(add_f64, "add_f64");
+
+int32_t add_i32(int32_t x, int32_t y){
+    return x+y;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(add_i32, "add_i32");
+
+void noop(){
+}
+FFI_REGISTER_GLOBAL_FUNCTION(noop, "noop");
+
+const char* name_cstr(){
+    static const char* str = "stress";
+    return str;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(name_cstr, "name_cstr");
+
+uint64_t cstr_len(const char* str){
+    uint64_t n = 0;
+    while (str[n] != 0) n++;
+    return n;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(cstr_len, "cstr_len");
+
+uint64_t sum_u32(uint32_t* array, uint64_t n){
+    uint64_t sum = 0;
+    for (uint64_t i=0;i<n;i++){
+        sum += array[i];
+    }
+    return sum;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(sum_u32, "sum_u32");
+
+
+class node{
+public:
+    node(float value, int32_t count):value(value),count(count),next(nullptr){}
+    float get_value(){
+        return value;
+    }
+    void scale(float factor){
+        value = value*factor;
+    }
+    node* get_next(){
+        return next;
+    }
+    float value;
+    int32_t count;
+    node* next;
+};
+
+node* create_node(float value, int32_t count){
+    auto n = new node(value,count);
+    n->next = n;
+    return n;
+}
+
+void destroy_node(node* n){
+    delete n;
+}
+
+FFI_REGISTER_CLASS(node, "node", create_node, destroy_node);
+FFI_REGISTER_CLASS_DESTROY_MANY(node, "node", destroy_node);
+FFI_REGISTER_CLASS_FIELD(node, value, node::value, "node.value");
+FFI_REGISTER_CLASS_FIELD(node, count, node::count, "node.count");
+FFI_REGISTER_CLASS_FIELD(node, next, node::next, "node.next");
+FFI_REGISTER_CLASS_METHOD(&node::get_value, "node.get_value");
+FFI_REGISTER_CLASS_METHOD(&node::scale, "node.scale");
+FFI_REGISTER_CLASS_METHOD(&node::get_next, "node.get_next");
+
+float node_value(node* n){
+    return n->value;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(node_value, "node_value");
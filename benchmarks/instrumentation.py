@@ -0,0 +1,27 @@
+# per-call cost of instrumentation: never enabled, enabled, and disabled again
+# build testing/global_functions.cpp to global_functions.so first
+import timeit
+import numpy as np
+import pyffi
+
+lib = pyffi.Lib("./global_functions.so")
+mult = lib.FFIGlobalFunc("mult")
+count_zeros = lib.FFIGlobalFunc("count_zeros")
+array = np.zeros(8,dtype=np.uint32)
+
+N = 200000
+cases = [
+    ("mult(5.0,6.0)", lambda: mult(5.0,6.0)),
+    ("count_zeros(array,8)", lambda: count_zeros(array,8)),
+]
+def measure():
+    return [min(timeit.repeat(f,number=N,repeat=5)) / N * 1e9 for _, f in cases]
+
+t_off = measure()
+lib.ffi_enable_instrumentation()
+t_on = measure()
+lib.ffi_disable_instrumentation()
+t_disabled = measure()
+for (name, _), off, on, disabled in zip(cases,t_off,t_on,t_disabled):
+    print("{:<24} never enabled: {:8.1f} ns/call  enabled: {:8.1f} ns/call  disabled again: {:8.1f} ns/call".format(
+        name,off,on,disabled))
@@ -0,0 +1,24 @@
+# Lib construction time without and with the on-disk registry cache
+# build testing/class_2.cpp to class_2.so first
+import sys
+import shutil
+import tempfile
+import timeit
+import pyffi
+
+lib_path = sys.argv[1] if len(sys.argv) > 1 else "./class_2.so"
+cache_dir = tempfile.mkdtemp()
+
+def cold():
+    return pyffi.Lib(lib_path)
+
+def cached():
+    return pyffi.Lib(lib_path,cache_dir=cache_dir)
+
+# first cached construction writes the cache
+cached()
+N = 200
+t_cold = min(timeit.repeat(cold,number=N,repeat=5)) / N * 1e6
+t_cached = min(timeit.repeat(cached,number=N,repeat=5)) / N * 1e6
+print("{}: cold Lib: {:10.1f} us  cached Lib: {:10.1f} us".format(lib_path,t_cold,t_cached))
+shutil.rmtree(cache_dir)
@@ -0,0 +1,23 @@
+# batch vs parallel_map throughput, and per-call cost of holding vs releasing the GIL
+# build testing/global_functions.cpp to global_functions.so first
+import timeit
+import numpy as np
+import pyffi
+
+lib = pyffi.Lib("./global_functions.so")
+mult = lib.FFIGlobalFunc("mult")
+print("workers: {}".format(lib.max_workers))
+
+x = np.random.rand(1<<23)
+y = np.random.rand(1<<23)
+out = np.empty_like(x)
+t_batch = min(timeit.repeat(lambda: mult.batch(x,y,out=out),number=5,repeat=3)) / 5
+t_parallel = min(timeit.repeat(lambda: mult.parallel_map(x,y,out=out),number=5,repeat=3)) / 5
+print("batch:        {:8.2f} ms".format(t_batch*1e3))
+print("parallel_map: {:8.2f} ms  speedup: {:5.2f}x".format(t_parallel*1e3,t_batch/t_parallel))
+
+N = 200000
+t_release = min(timeit.repeat(lambda: mult(5.0,6.0),number=N,repeat=5)) / N * 1e9
+mult.ffi_set_release_gil(False)
+t_hold = min(timeit.repeat(lambda: mult(5.0,6.0),number=N,repeat=5)) / N * 1e9
+print("mult(5.0,6.0) release gil: {:8.1f} ns/call  hold gil: {:8.1f} ns/call".format(t_release,t_hold))
@@ -0,0 +1,42 @@
+# cost of getting a returned buffer of n doubles into numpy: copying it through the ctypes pointer
+# (element by element or with np.ctypeslib) and freeing it, against the zero-copy view of a
+# return buffer declared with FFI_REGISTER_OWNED_RETURN_BUFFER, freed when the view is dropped.
+# the native fill is the same in every case
+# build testing/global_functions.cpp to global_functions.so first
+import sys
+import ctypes
+import timeit
+import numpy as np
+import pyffi
+
+lib_path = sys.argv[1] if len(sys.argv) > 1 else "./global_functions.so"
+lib = pyffi.Lib(lib_path)
+linspace = lib.FFIGlobalFunc("linspace")
+# the plan without the view, giving the address
+raw_linspace = linspace._raw_call_plan
+libc_free = ctypes.CDLL(None).free
+libc_free.argtypes = [ctypes.c_void_p]
+double_ptr = ctypes.POINTER(ctypes.c_double)
+
+def slice_copy(n):
+    addr = raw_linspace(0.0,1.0,n)
+    a = np.array(ctypes.cast(addr,double_ptr)[:n])
+    libc_free(addr)
+    return a
+
+def as_array_copy(n):
+    addr = raw_linspace(0.0,1.0,n)
+    a = np.ctypeslib.as_array(ctypes.cast(addr,double_ptr),(n,)).copy()
+    libc_free(addr)
+    return a
+
+def view(n):
+    return linspace(0.0,1.0,n)
+
+cases = {"pointer, slice copy":slice_copy,"pointer, as_array copy":as_array_copy,"return buffer view":view}
+for n in (16,1024,1<<16,1<<20):
+    assert all(np.array_equal(f(n),view(n)) for f in cases.values())
+    number = max(10,(1<<20)//n)
+    for name, f in cases.items():
+        t = min(timeit.repeat(lambda: f(n),number=number,repeat=3))/number
+        print("n={:<8d} {:<24} {:10.2f} us".format(n,name,t*1e6))
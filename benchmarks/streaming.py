@@ -0,0 +1,42 @@
+# time and peak memory of counting the zeros of a large file: loading it whole with np.fromfile,
+# streaming the memory mapped file, and streaming a generator of read() blocks.
+# every case runs in a fresh process, so peak rss is measured separately
+# (children start with the peak rss of this process, which is kept small)
+# build testing/global_functions.cpp to global_functions.so first
+import os
+import sys
+import subprocess
+import tempfile
+import numpy as np
+
+cases = {
+    "whole file": "r = count_zeros(np.fromfile(path,dtype=np.uint32),size)",
+    "stream (mmap)": "r = count_zeros.stream(path,dtype=np.uint32,reducer=operator.add)",
+    "stream (read blocks)": "r = count_zeros.stream(iter(lambda: f.read(1<<22),b''),dtype=np.uint32,reducer=operator.add)",
+}
+
+runner = """
+import sys, time, resource, operator
+import numpy as np
+import pyffi
+path, size = sys.argv[1], int(sys.argv[2])
+count_zeros = pyffi.Lib("./global_functions.so").FFIGlobalFunc("count_zeros")
+f = open(path,"rb")
+t = time.perf_counter()
+{}
+t = time.perf_counter()-t
+print(r, t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1<<27
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d,"data.u32")
+        with open(path,"wb") as f:
+            for start in range(0,n,1<<20):
+                (np.arange(start,min(start+(1<<20),n),dtype=np.uint32) % 7).tofile(f)
+        print("{} MB of uint32".format(n*4>>20))
+        for name, code in cases.items():
+            out = subprocess.run([sys.executable,"-c",runner.format(code),path,str(n)],capture_output=True,text=True,check=True)
+            r, t, rss = out.stdout.split()
+            print("{:<24} {:8.3f} s  peak rss {:6d} MB  ({} zeros)".format(name,float(t),int(rss)>>10,r))
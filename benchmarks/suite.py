@@ -0,0 +1,237 @@
+# reproducible benchmark suite: compiles the testing and stress fixtures with the system
+# c++ compiler, measures pyffi's overheads and compares them against a saved baseline.
+#
+#   python benchmarks/suite.py --output results.json
+#   python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+#   python benchmarks/suite.py --baseline benchmarks/baseline.json --tolerance 0.25
+#
+# all results are in ns per operation, lower is better. with --baseline, the exit code is 1
+# if any result is more than tolerance slower than its baseline
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import subprocess
+import sysconfig
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CPP_DIR = os.path.join(ROOT,"cpp")
+TESTING_DIR = os.path.join(ROOT,"testing")
+FIXTURES_DIR = os.path.join(ROOT,"benchmarks","fixtures")
+sys.path.insert(0,ROOT)
+import pyffi
+
+TESTING_FIXTURES = ["global_functions","class_1","class_2"]
+REGISTRY_SIZES = [10,100,1000,10000]
+
+
+def cpp_mtime():
+    # fixtures are rebuilt whenever ffi_man changes
+    return max(
+        os.path.getmtime(os.path.join(d,f))
+        for d,_,files in os.walk(CPP_DIR) for f in files
+    )
+
+
+def build(cxx:str,src:str,out:str,opt:str="-O2",flags=()):
+    if os.path.exists(out) and os.path.getmtime(out) > max(os.path.getmtime(src),cpp_mtime()):
+        return
+    print("building {}".format(os.path.basename(out)))
+    subprocess.run(
+        [cxx,"-std=c++20","-shared","-fPIC",opt,"-w","-I",CPP_DIR,*flags,"-o",out,src,os.path.join(CPP_DIR,"ffi_man.cpp")],
+        check=True
+    )
+
+
+def write_registry_fixture(path:str,n:int):
+    # n global functions, only written if missing so the build is not redone
+    if os.path.exists(path):
+        return
+    with open(path,"w") as f:
+        f.write('#include "ffi_man.hpp"\n#include <cstdint>\n\n')
+        for i in range(n):
+            f.write("int64_t f_{0}(int64_t x){{ return x+{0}; }}\n".format(i))
+            f.write('FFI_REGISTER_GLOBAL_FUNCTION(f_{0}, "f_{0}");\n'.format(i))
+
+
+def build_fixtures(cxx:str,build_dir:str)->dict:
+    os.makedirs(build_dir,exist_ok=True)
+    libs = {}
+    for name in TESTING_FIXTURES:
+        libs[name] = os.path.join(build_dir,name+".so")
+        build(cxx,os.path.join(TESTING_DIR,name+".cpp"),libs[name])
+    libs["stress"] = os.path.join(build_dir,"stress.so")
+    build(cxx,os.path.join(FIXTURES_DIR,"stress.cpp"),libs["stress"])
+    # the same fixture with the METH_FASTCALL backend
+    libs["stress_fastcall"] = os.path.join(build_dir,"stress_fastcall.so")
+    build(cxx,os.path.join(FIXTURES_DIR,"stress.cpp"),libs["stress_fastcall"],
+          flags=("-I",sysconfig.get_paths()["include"],"-include","ffi_fastcall.hpp"))
+    for n in REGISTRY_SIZES:
+        src = os.path.join(build_dir,"registry_{}.cpp".format(n))
+        write_registry_fixture(src,n)
+        libs["registry_{}".format(n)] = os.path.join(build_dir,"registry_{}.so".format(n))
+        # the registry fixtures only exercise registry loading, -O0 keeps their build time down
+        build(cxx,src,libs["registry_{}".format(n)],"-O0")
+    return libs
+
+
+def per_op(f,number:int,repeat:int=5)->float:
+    return min(timeit.repeat(f,number=number,repeat=repeat)) / number * 1e9
+
+
+def bind_stress_classes(lib):
+    class Node(lib.FFIClassBase):
+        cffi_registered_name = "node"
+    return Node
+
+
+def bench_calls(libs:dict,n:int,lib_name:str="stress",prefix:str="")->dict:
+    # with prefix, the results are reported as prefix+name
+    lib = pyffi.Lib(libs[lib_name])
+    Node = bind_stress_classes(lib)
+    f = {name:lib.FFIGlobalFunc(name) for name in ["noop","add_f64","add_i32","name_cstr","cstr_len","sum_u32","node_value"]}
+    array = np.arange(64,dtype=np.uint32)
+    node = Node(1.0,2)
+    results = {
+        "call.noop":per_op(lambda: f["noop"](),n),
+        "call.f64_f64_to_f64":per_op(lambda: f["add_f64"](1.0,2.0),n),
+        "call.i32_i32_to_i32":per_op(lambda: f["add_i32"](1,2),n),
+        "call.to_cstr":per_op(lambda: f["name_cstr"](),n),
+        "call.cstr_to_u64":per_op(lambda: f["cstr_len"]("stress"),n),
+        "call.ndarray_to_u64":per_op(lambda: f["sum_u32"](array,64),n),
+        "call.class_ptr_to_f32":per_op(lambda: f["node_value"](node),n),
+        "method.to_f32":per_op(lambda: node.get_value(),n),
+        "method.f32_to_void":per_op(lambda: node.scale(1.0),n),
+        "method.to_class_ptr":per_op(lambda: node.get_next(),n),
+    }
+    return {prefix+name:value for name,value in results.items()}
+
+
+def bench_batch(libs:dict,n:int)->dict:
+    lib = pyffi.Lib(libs["global_functions"])
+    mult = lib.FFIGlobalFunc("mult")
+    x = np.random.rand(1<<20)
+    out = np.empty_like(x)
+    return {"batch.f64_f64_to_f64_per_element":per_op(lambda: mult.batch(x,x,out=out),max(n//10000,1)) / x.size}
+
+
+def bench_objects(libs:dict,n:int,lib_name:str="stress",prefix:str="")->dict:
+    lib = pyffi.Lib(libs[lib_name])
+    Node = bind_stress_classes(lib)
+    node = Node(1.0,2)
+    def construct_destruct():
+        Node(1.0,2)
+    def field_set():
+        node.value = 2.0
+    results = {
+        "object.construct_destruct":per_op(construct_destruct,n//4),
+        "field.get_f32":per_op(lambda: node.value,n),
+        "field.set_f32":per_op(field_set,n),
+        "field.get_i32":per_op(lambda: node.count,n),
+        "field.get_class_ptr":per_op(lambda: node.next,n),
+    }
+    return {prefix+name:value for name,value in results.items()}
+
+
+def bench_binding(libs:dict,repeat:int)->dict:
+    # __init_subclass__ of a class with 3 fields and 3 methods, a class could only be bound once per Lib
+    best = float("inf")
+    for _ in range(repeat):
+        lib = pyffi.Lib(libs["stress"])
+        t0 = time.perf_counter_ns()
+        bind_stress_classes(lib)
+        best = min(best,time.perf_counter_ns()-t0)
+    return {"class.bind":float(best)}
+
+
+def bench_lib_load(libs:dict,repeat:int)->dict:
+    results = {}
+    for size in REGISTRY_SIZES:
+        path = libs["registry_{}".format(size)]
+        pyffi.Lib(path)
+        results["lib.load_{}_entries".format(size)] = per_op(lambda: pyffi.Lib(path),max(repeat*10//size,1),repeat)
+    return results
+
+
+def run(libs:dict,quick:bool)->dict:
+    n = 20000 if quick else 200000
+    results = {}
+    results.update(bench_calls(libs,n))
+    results.update(bench_batch(libs,n))
+    results.update(bench_objects(libs,n))
+    results.update(bench_calls(libs,n,"stress_fastcall","fastcall."))
+    results.update(bench_objects(libs,n,"stress_fastcall","fastcall."))
+    results.update(bench_binding(libs,20 if quick else 100))
+    results.update(bench_lib_load(libs,5 if quick else 20))
+    return results
+
+
+def compare(results:dict,baseline:dict,tolerance:float)->bool:
+    ok = True
+    print("{:<36} {:>14} {:>14} {:>8}".format("benchmark","baseline ns","current ns","ratio"))
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("{:<36} {:>14} {:>14.1f} {:>8}".format(name,"-",value,"new"))
+            continue
+        ratio = value/base if base != 0 else float("inf")
+        regressed = ratio > 1+tolerance
+        ok = ok and not regressed
+        print("{:<36} {:>14.1f} {:>14.1f} {:>8.2f}{}".format(name,base,value,ratio,"  REGRESSION" if regressed else ""))
+    for name in baseline:
+        if name not in results:
+            print("{:<36} missing from the current results".format(name))
+    return ok
+
+
+def compiler_version(cxx:str)->str:
+    try:
+        return subprocess.run([cxx,"--version"],capture_output=True,text=True).stdout.splitlines()[0]
+    except (OSError,IndexError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pyffi benchmark suite")
+    parser.add_argument("--cxx",default=os.environ.get("CXX","c++"),help="c++20 compiler used to build the fixtures")
+    parser.add_argument("--build-dir",default=os.path.join(ROOT,"benchmarks","build"))
+    parser.add_argument("--output",help="write the results as json")
+    parser.add_argument("--baseline",help="compare against a json written by --save-baseline or --output")
+    parser.add_argument("--save-baseline",help="write the results as the new baseline")
+    parser.add_argument("--tolerance",type=float,default=0.25,help="allowed slowdown against the baseline")
+    parser.add_argument("--quick",action="store_true",help="fewer iterations, noisier results")
+    args = parser.parse_args()
+
+    libs = build_fixtures(args.cxx,args.build_dir)
+    report = {
+        "meta":{
+            "python":platform.python_version(),
+            "numpy":np.__version__,
+            "platform":platform.platform(),
+            "compiler":compiler_version(args.cxx),
+            "time":time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "results":run(libs,args.quick)
+    }
+    for path in (args.output,args.save_baseline):
+        if path is not None:
+            with open(path,"w") as f:
+                json.dump(report,f,indent=2)
+    if args.baseline is None:
+        for name, value in report["results"].items():
+            print("{:<36} {:>14.1f} ns".format(name,value))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    if not compare(report["results"],baseline,args.tolerance):
+        print("performance regressions against {}".format(args.baseline))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#pragma once
+#include "ffi_man.hpp"
+#include "siggen/fastcall_helper.hpp"
+
+/*
+optional cpython fast call backend
+including this header (instead of or after ffi_man.hpp, before the registration macros are used)
+makes FFI_REGISTER_GLOBAL_FUNCTION, FFI_REGISTER_CLASS_METHOD and FFI_REGISTER_CLASS_FIELD
+also register METH_FASTCALL wrappers of the registered functions, methods and basic type field accessors.
+pyffi calls them instead of going through ctypes when the lib has them.
+the lib needs the python headers to build (-I <python include dir>), but is not linked against libpython:
+the python symbols are resolved from the interpreter loading it
+*/
+
+template <auto func>
+FFIAccessEntry ffi_register_fastcall_global_function(const char* register_name, const char* func_sig_str){
+    return FFIManager::getInstance()->add_access_entry(
+        FFIAccessEntry::make_fastcall_entry(
+            FFIAccessEntryType::kGlobalFuncFastcall,
+            reinterpret_cast<void*>(&fastcall_wrapper<func>::wrapper_function), register_name, func_sig_str, 0, 0));
+}
+
+template <auto memfunc>
+FFIAccessEntry ffi_register_fastcall_class_method(const char* register_name, const char* method_sig_str){
+    return FFIManager::getInstance()->add_access_entry(
+        FFIAccessEntry::make_fastcall_entry(
+            FFIAccessEntryType::kClassMethodFastcall,
+            reinterpret_cast<void*>(&fastcall_method<memfunc>::wrapper::wrapper_function), register_name, method_sig_str, 0, 0));
+}
+
+// only basic type fields get accessors, pyffi handles the other ones itself
+template <typename T, size_t offset>
+bool ffi_register_fastcall_class_field(const char* register_name, const char* field_sig_str){
+    if constexpr (std::is_arithmetic_v<T>){
+        auto manager = FFIManager::getInstance();
+        manager->add_access_entry(
+            FFIAccessEntry::make_fastcall_entry(
+                FFIAccessEntryType::kClassFieldGetFastcall,
+                reinterpret_cast<void*>(&fastcall_field<T,offset>::get_function), register_name, field_sig_str, offset, sizeof(T)));
+        manager->add_access_entry(
+            FFIAccessEntry::make_fastcall_entry(
+                FFIAccessEntryType::kClassFieldSetFastcall,
+                reinterpret_cast<void*>(&fastcall_field<T,offset>::set_function), register_name, field_sig_str, offset, sizeof(T)));
+        return true;
+    }
+    return false;
+}
+
+#undef FFI_BACKEND_REGISTER_GLOBAL_FUNCTION
+#define FFI_BACKEND_REGISTER_GLOBAL_FUNCTION(func,register_name) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=ffi_register_fastcall_global_function<&func>(register_name,signature<decltype(func)>::sig.c_str());
+
+#undef FFI_BACKEND_REGISTER_CLASS_METHOD
+#define FFI_BACKEND_REGISTER_CLASS_METHOD(func,register_name) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=ffi_register_fastcall_class_method<func>(register_name,signature<wrapped_memf_type<decltype(func)>::type>::sig.c_str());
+
+#undef FFI_BACKEND_REGISTER_CLASS_FIELD
+#define FFI_BACKEND_REGISTER_CLASS_FIELD(cls,field,combine,register_name) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=ffi_register_fastcall_class_field<std::remove_cv_t<decltype(combine)>,offsetof(cls,field)>( \
+register_name, \
+type_str<decltype(combine)>::str.c_str());
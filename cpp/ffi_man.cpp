@@ -25,6 +25,109 @@ FFIAccessEntry FFIAccessEntry::make_class_field_entry(const char* register_name,
     ret.field_size = field_size;
     return ret;
 }
+FFIAccessEntry FFIAccessEntry::make_global_func_batch_entry(void* ptr, const char* func_name, const char* func_sig_str){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kGlobalFuncBatch;
+    ret.ptr = ptr;
+    ret.name = func_name;
+    ret.sig = func_sig_str;
+    return ret;
+}
+FFIAccessEntry FFIAccessEntry::make_class_method_batch_entry(void* ptr, const char* method_name, const char* method_sig_str){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kClassMethodBatch;
+    ret.ptr = ptr;
+    ret.name = method_name;
+    ret.sig = method_sig_str;
+    return ret;
+}
+FFIAccessEntry FFIAccessEntry::make_class_layout_entry(const char* class_namestr, const char* class_type_str, size_t class_align, size_t class_size){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kClassLayout;
+    ret.ptr = nullptr;
+    ret.name = class_namestr;
+    ret.sig = class_type_str;
+    ret.offset = class_align;
+    ret.field_size = class_size;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_class_arena_entry(FFIAccessEntryType type, void* ptr, const char* class_namestr, const char* func_sig_str, size_t class_align, size_t class_size){
+    FFIAccessEntry ret;
+    ret.type = type;
+    ret.ptr = ptr;
+    ret.name = class_namestr;
+    ret.sig = func_sig_str;
+    ret.offset = class_align;
+    ret.field_size = class_size;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_fastcall_entry(FFIAccessEntryType type, void* ptr, const char* register_name, const char* sig_str, size_t offset, size_t field_size){
+    FFIAccessEntry ret;
+    ret.type = type;
+    ret.ptr = ptr;
+    ret.name = register_name;
+    ret.sig = sig_str;
+    ret.offset = offset;
+    ret.field_size = field_size;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_struct_layout_entry(const char* struct_namestr, const char* struct_type_str, size_t struct_align, size_t struct_size){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kStructLayout;
+    ret.ptr = nullptr;
+    ret.name = struct_namestr;
+    ret.sig = struct_type_str;
+    ret.offset = struct_align;
+    ret.field_size = struct_size;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_struct_field_entry(const char* register_name, const char* field_sig_str, size_t offset, size_t field_size){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kStructField;
+    ret.ptr = nullptr;
+    ret.name = register_name;
+    ret.sig = field_sig_str;
+    ret.offset = offset;
+    ret.field_size = field_size;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_class_destroy_many_entry(void* ptr, const char* class_namestr, const char* func_sig_str){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kClassDestroyMany;
+    ret.ptr = ptr;
+    ret.name = class_namestr;
+    ret.sig = func_sig_str;
+    ret.offset = 0;
+    ret.field_size = 0;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_global_func_output_entry(const char* func_name, const char* size_expr, size_t param_index){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kGlobalFuncOutput;
+    ret.ptr = nullptr;
+    ret.name = func_name;
+    ret.sig = size_expr;
+    ret.offset = param_index;
+    ret.field_size = 0;
+    return ret;
+}
+
+FFIAccessEntry FFIAccessEntry::make_return_buffer_entry(void* deallocator, const char* register_name, const char* size_expr){
+    FFIAccessEntry ret;
+    ret.type = FFIAccessEntryType::kReturnBuffer;
+    ret.ptr = deallocator;
+    ret.name = register_name;
+    ret.sig = size_expr;
+    ret.offset = 0;
+    ret.field_size = 0;
+    return ret;
+}
 
 FFIClassEntry FFIClassEntry::make_class_entry(const char* class_namestr,
                                       void* construct_func_ptr,
@@ -51,6 +154,11 @@ int check_classentry(const FFIClassEntry& entry){
     return 0;
 }
 
+FFIManager* FFIManager::getInstance(){
+    static FFIManager instance;
+    return &instance;
+}
+
 
 extern "C"{
     FFIManager* ffi_get_manager_instance(){
@@ -68,6 +176,12 @@ extern "C"{
     FFIAccessEntry* ffi_get_access_entry(uint64_t index){
         return &FFIManager::getInstance()->get_access_entry(index);
     }
+    FFIClassEntry* ffi_get_class_entry_table(uint64_t* num){
+        return FFIManager::getInstance()->class_entry_table(num);
+    }
+    FFIAccessEntry* ffi_get_access_entry_table(uint64_t* num){
+        return FFIManager::getInstance()->access_entry_table(num);
+    }
     void ffi_print_all_entries(){
         FFIManager::getInstance()->_print_access_entries();
         FFIManager::getInstance()->_print_class_entries();
@@ -7,11 +7,27 @@
 #include <mutex>
 #include "siggen/sig_gen.hpp"
 #include "siggen/mf_helper.hpp"
+#include "siggen/batch_helper.hpp"
+#include "siggen/arena_helper.hpp"
 
 enum class FFIAccessEntryType:int32_t{
     kGlobalFunc = 1,
     kClassMethod = 2,
-    kClassField = 3  
+    kClassField = 3,
+    kGlobalFuncBatch = 4,
+    kClassMethodBatch = 5,
+    kClassArenaConstruct = 6,
+    kClassArenaDestroy = 7,
+    kClassLayout = 8,
+    kGlobalFuncFastcall = 9,
+    kClassMethodFastcall = 10,
+    kClassFieldGetFastcall = 11,
+    kClassFieldSetFastcall = 12,
+    kStructLayout = 13,
+    kStructField = 14,
+    kGlobalFuncOutput = 15,
+    kClassDestroyMany = 16,
+    kReturnBuffer = 17
 };
 
 /*
@@ -34,6 +50,72 @@ enum class FFIAccessEntryType:int32_t{
         - sig: generated field type string
         - offset : offset to the class pointer
         - field_size : field size in bytes
+    when type is kGlobalFuncBatch:
+        - ptr: generated batch wrapper function pointer
+        - name: registered name of the wrapped global function
+        - sig: generated batch wrapper signature string
+        - offset : NA
+        - field_size : NA
+    when type is kClassMethodBatch:
+        - ptr: generated method batch wrapper function pointer
+        - name: registered name of the wrapped method
+        - sig: generated method batch wrapper signature string
+        - offset : NA
+        - field_size : NA
+    when type is kClassArenaConstruct/kClassArenaDestroy:
+        - ptr: generated placement construct_n/destroy_n function pointer
+        - name: registered class name
+        - sig: generated function signature string
+        - offset : alignment of the class in bytes
+        - field_size : class size in bytes
+    when type is kClassLayout:
+        - ptr: NA
+        - name: registered class name
+        - sig: generated class type string
+        - offset : alignment of the class in bytes
+        - field_size : class size in bytes
+    when type is kGlobalFuncFastcall/kClassMethodFastcall (registered by ffi_fastcall.hpp):
+        - ptr: generated METH_FASTCALL wrapper function pointer
+        - name: registered name of the wrapped function/method
+        - sig: signature string of the wrapped function/method
+        - offset : NA
+        - field_size : NA
+    when type is kClassFieldGetFastcall/kClassFieldSetFastcall (registered by ffi_fastcall.hpp):
+        - ptr: generated METH_FASTCALL field getter/setter function pointer
+        - name: registered name of the field
+        - sig: generated field type string
+        - offset : offset to the class pointer
+        - field_size : field size in bytes
+    when type is kStructLayout:
+        - ptr: NA
+        - name: registered struct name
+        - sig: generated struct type string
+        - offset : alignment of the struct in bytes
+        - field_size : struct size in bytes
+    when type is kStructField:
+        - ptr: NA
+        - name: register name, must be in format Structname.fieldname
+        - sig: generated type string of the field, of its element type for array fields
+        - offset : offset to the struct pointer
+        - field_size : field size in bytes
+    when type is kClassDestroyMany:
+        - ptr: generated destroy_many function pointer
+        - name: registered class name
+        - sig: generated function signature string
+        - offset : NA
+        - field_size : NA
+    when type is kGlobalFuncOutput:
+        - ptr: NA
+        - name: registered name of the global function
+        - sig: size expression of the output buffer in elements
+        - offset : index of the output parameter
+        - field_size : NA
+    when type is kReturnBuffer:
+        - ptr: deallocator of the returned buffers, nullptr if they are not owned
+        - name: registered name of the global function, class method or class field
+        - sig: size expression of the buffer in elements
+        - offset : NA
+        - field_size : NA
 */
 struct FFIAccessEntry{
     FFIAccessEntryType type;
@@ -47,6 +129,16 @@ struct FFIAccessEntry{
     static FFIAccessEntry make_global_func_entry(void* ptr, const char* func_name, const char* func_sig_str);
     static FFIAccessEntry make_class_method_entry(void* ptr, const char* method_name, const char* method_sig_str);
     static FFIAccessEntry make_class_field_entry(const char* register_name, const char* field_sig_str, size_t offset, size_t field_size);
+    static FFIAccessEntry make_global_func_batch_entry(void* ptr, const char* func_name, const char* func_sig_str);
+    static FFIAccessEntry make_class_method_batch_entry(void* ptr, const char* method_name, const char* method_sig_str);
+    static FFIAccessEntry make_class_layout_entry(const char* class_namestr, const char* class_type_str, size_t class_align, size_t class_size);
+    static FFIAccessEntry make_class_arena_entry(FFIAccessEntryType type, void* ptr, const char* class_namestr, const char* func_sig_str, size_t class_align, size_t class_size);
+    static FFIAccessEntry make_fastcall_entry(FFIAccessEntryType type, void* ptr, const char* register_name, const char* sig_str, size_t offset, size_t field_size);
+    static FFIAccessEntry make_struct_layout_entry(const char* struct_namestr, const char* struct_type_str, size_t struct_align, size_t struct_size);
+    static FFIAccessEntry make_struct_field_entry(const char* register_name, const char* field_sig_str, size_t offset, size_t field_size);
+    static FFIAccessEntry make_class_destroy_many_entry(void* ptr, const char* class_namestr, const char* func_sig_str);
+    static FFIAccessEntry make_global_func_output_entry(const char* func_name, const char* size_expr, size_t param_index);
+    static FFIAccessEntry make_return_buffer_entry(void* deallocator, const char* register_name, const char* size_expr);
 };
 //POD CHECK 
 static_assert(std::is_trivial_v<FFIAccessEntry>,"");
@@ -72,13 +164,19 @@ static_assert(std::is_standard_layout_v<FFIClassEntry>,"");
 
 int check_classsentry(const FFIAccessEntry& entry);
 
+// every lib needs its own manager. an inline getInstance would make the static instance a
+// vague linkage (STB_GNU_UNIQUE) symbol shared by all libs loaded into a process,
+// so it is defined in ffi_man.cpp and kept out of the dynamic symbol table
+#if defined(__GNUC__)
+#define FFI_HIDDEN __attribute__((visibility("hidden")))
+#else
+#define FFI_HIDDEN
+#endif
+
 class FFIManager
 {
 public:
-    static FFIManager* getInstance(){
-        static FFIManager instance;
-        return &instance;
-    }
+    FFI_HIDDEN static FFIManager* getInstance();
     FFIAccessEntry& add_access_entry(FFIAccessEntry new_entry){
         lock.lock();
         access_entries.push_back(new_entry);
@@ -95,6 +193,14 @@ public:
     FFIAccessEntry& get_access_entry(size_t index){
         return access_entries[index];
     }
+    // entries are stored contiguously, so the whole table could be exported at once
+    FFIAccessEntry* access_entry_table(uint64_t* num){
+        lock.lock();
+        *num = access_entries.size();
+        auto ret = access_entries.data();
+        lock.unlock();
+        return ret;
+    }
     FFIClassEntry& add_class_entry(FFIClassEntry new_entry){
         lock.lock();
         class_entries.push_back(new_entry);
@@ -111,6 +217,13 @@ public:
     FFIClassEntry& get_class_entry(size_t index){
         return class_entries[index];
     }
+    FFIClassEntry* class_entry_table(uint64_t* num){
+        lock.lock();
+        *num = class_entries.size();
+        auto ret = class_entries.data();
+        lock.unlock();
+        return ret;
+    }
 
     void _print_access_entries(){
         for (auto& v: access_entries){
@@ -123,6 +236,39 @@ public:
             if (v.type == FFIAccessEntryType::kClassMethod){
                 printf("[CM]%s: addr: %p, sig: <%s>\n",v.name,v.ptr,v.sig);
             }
+            if (v.type == FFIAccessEntryType::kGlobalFuncBatch){
+                printf("[GFB]%s: addr: %p, sig: <%s>\n",v.name,v.ptr,v.sig);
+            }
+            if (v.type == FFIAccessEntryType::kClassMethodBatch){
+                printf("[CMB]%s: addr: %p, sig: <%s>\n",v.name,v.ptr,v.sig);
+            }
+            if (v.type == FFIAccessEntryType::kClassLayout){
+                printf("[CL]%s: size:%ld, align:%ld\n",v.name,v.field_size,v.offset);
+            }
+            if (v.type == FFIAccessEntryType::kClassArenaConstruct || v.type == FFIAccessEntryType::kClassArenaDestroy){
+                printf("[ARN]%s: addr: %p, sig: <%s>, size:%ld, align:%ld\n",v.name,v.ptr,v.sig,v.field_size,v.offset);
+            }
+            if (v.type == FFIAccessEntryType::kGlobalFuncFastcall || v.type == FFIAccessEntryType::kClassMethodFastcall){
+                printf("[FC]%s: addr: %p, sig: <%s>\n",v.name,v.ptr,v.sig);
+            }
+            if (v.type == FFIAccessEntryType::kClassFieldGetFastcall || v.type == FFIAccessEntryType::kClassFieldSetFastcall){
+                printf("[FCF]%s: addr: %p, type: %s, offset:%ld\n",v.name,v.ptr,v.sig,v.offset);
+            }
+            if (v.type == FFIAccessEntryType::kStructLayout){
+                printf("[SL]%s: size:%ld, align:%ld\n",v.name,v.field_size,v.offset);
+            }
+            if (v.type == FFIAccessEntryType::kStructField){
+                printf("[SF]%s: type: %s, offset:%ld, size:%ld\n",v.name,v.sig,v.offset,v.field_size);
+            }
+            if (v.type == FFIAccessEntryType::kClassDestroyMany){
+                printf("[CDM]%s: addr: %p, sig: <%s>\n",v.name,v.ptr,v.sig);
+            }
+            if (v.type == FFIAccessEntryType::kGlobalFuncOutput){
+                printf("[GO]%s: param:%ld, size:%s\n",v.name,v.offset,v.sig);
+            }
+            if (v.type == FFIAccessEntryType::kReturnBuffer){
+                printf("[RB]%s: deallocator: %p, size:%s\n",v.name,v.ptr,v.sig);
+            }
             
         }
     }
@@ -155,14 +301,41 @@ extern "C"{
     uint64_t ffi_get_access_entry_num();
     FFIClassEntry* ffi_get_class_entry(uint64_t index);
     FFIAccessEntry* ffi_get_access_entry(uint64_t index);
+    // bulk export: returns the whole table as a contiguous array and writes its length to num
+    FFIClassEntry* ffi_get_class_entry_table(uint64_t* num);
+    FFIAccessEntry* ffi_get_access_entry_table(uint64_t* num);
     void ffi_print_all_entries();
 }
 
 
 
 
+// registers the member function wrapper W, and its batch wrapper if batched
+// W must be constructed by the caller first, which sets the wrapped member function pointer
+template <bool batched, typename W>
+FFIAccessEntry ffi_register_class_method(const W& wrapper, const char* register_name, const char* method_sig_str){
+    auto manager = FFIManager::getInstance();
+    FFIAccessEntry ret = manager->add_access_entry(
+        FFIAccessEntry::make_class_method_entry(
+            reinterpret_cast<void*>(&W::wrapper_function), register_name, method_sig_str));
+    if constexpr (batched){
+        using B = typename W::batch_helper;
+        manager->add_access_entry(
+            FFIAccessEntry::make_class_method_batch_entry(
+                reinterpret_cast<void*>(&B::batch_wrapper_function), register_name,
+                signature<decltype(B::batch_wrapper_function)>::sig.c_str()));
+    }
+    return ret;
+}
+
 // helper macros
 
+// registration hooks of optional backends, expanded by the registration macros below.
+// they are empty unless a backend header (ffi_fastcall.hpp) redefines them
+#define FFI_BACKEND_REGISTER_GLOBAL_FUNCTION(func,register_name)
+#define FFI_BACKEND_REGISTER_CLASS_METHOD(func,register_name)
+#define FFI_BACKEND_REGISTER_CLASS_FIELD(cls,field,combine,register_name)
+
 #define merge_body(x,y) x ## y
 #define merge(x,y) merge_body(x,y)
 
@@ -171,17 +344,40 @@ auto merge(_ffi_access_entry_, __COUNTER__)   \
 =FFIManager::getInstance()->add_access_entry( \
 FFIAccessEntry::make_global_func_entry( \
 reinterpret_cast<void*>(&func),register_name,signature<decltype(func)>::sig.c_str() \
+)); \
+FFI_BACKEND_REGISTER_GLOBAL_FUNCTION(func,register_name)
+
+// registers func and a generated batch wrapper applying func elementwise over arrays,
+// func must take and return basic types only
+#define FFI_REGISTER_GLOBAL_FUNCTION_BATCHED(func,register_name) \
+FFI_REGISTER_GLOBAL_FUNCTION(func,register_name) \
+auto merge(_ffi_access_entry_, __COUNTER__)   \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_global_func_batch_entry( \
+reinterpret_cast<void*>(&batch_wrapper<&func>::wrapper_function),register_name, \
+signature<decltype(batch_wrapper<&func>::wrapper_function)>::sig.c_str() \
 ));
 
 // use __COUNTER__ to generate different mf_wrapper type to wrap memberfunctions having same type
 #define FFI_REGISTER_CLASS_METHOD(func,register_name) \
 auto merge(_ffi_access_entry_, __COUNTER__) \
-=FFIManager::getInstance()->add_access_entry(   \
-FFIAccessEntry::make_class_method_entry( \
-reinterpret_cast<void*>(&make_mf_wrapper<__COUNTER__>(func).wrapper_function) ,\
+=ffi_register_class_method<false>( \
+make_mf_wrapper<__COUNTER__>(func) ,\
 register_name ,\
 signature<wrapped_memf_type<decltype(func)>::type>::sig.c_str() \
-));
+); \
+FFI_BACKEND_REGISTER_CLASS_METHOD(func,register_name)
+
+// registers the method and a generated batch wrapper looping it over arrays of objects,
+// the method must take and return basic types only
+#define FFI_REGISTER_CLASS_METHOD_BATCHED(func,register_name) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=ffi_register_class_method<true>( \
+make_mf_wrapper<__COUNTER__>(func) ,\
+register_name ,\
+signature<wrapped_memf_type<decltype(func)>::type>::sig.c_str() \
+); \
+FFI_BACKEND_REGISTER_CLASS_METHOD(func,register_name)
 
 
 #define FFI_REGISTER_CLASS_FIELD(cls,field,combine,register_name) \
@@ -191,7 +387,8 @@ FFIAccessEntry::make_class_field_entry( \
 register_name, \
 type_str<decltype(combine)>::str.c_str(), \
 offsetof(cls,field), \
-sizeof(combine)));
+sizeof(combine))); \
+FFI_BACKEND_REGISTER_CLASS_FIELD(cls,field,combine,register_name)
 
 #define FFI_REGISTER_CLASS(class,registername,construct_func,destroy_func) \
 TYPE_ATTR_DEFINE_CLASS_NAMESTR(class, registername); \
@@ -203,4 +400,114 @@ reinterpret_cast<void*>(construct_func),  \
 signature<decltype(construct_func)>::sig.c_str(), \
 reinterpret_cast<void*>(destroy_func), \
 signature<decltype(destroy_func)>::sig.c_str() \
-));  
\ No newline at end of file
+)); \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_class_layout_entry( \
+registername, \
+type_str<class>::str.c_str(), \
+alignof(class), \
+sizeof(class) \
+));
+
+// optional: registers a destroy_many wrapper destroying arrays of objects of a registered class with
+// destroy_func in one call, see batch_helper.hpp. deferred destructors use it to drain their queue,
+// without it they destroy the objects one by one. destroy_func must be a constant expression
+#define FFI_REGISTER_CLASS_DESTROY_MANY(class,registername,destroy_func) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_class_destroy_many_entry( \
+reinterpret_cast<void*>(&destroy_many_wrapper<destroy_func>::destroy_many), \
+registername, \
+signature<decltype(destroy_many_wrapper<destroy_func>::destroy_many)>::sig.c_str() \
+));
+
+// optional: registers placement construct/destroy functions of a registered class,
+// which allow pyffi to construct and destroy many objects contiguously with single native calls.
+// the trailing arguments are the types of the class constructor parameters, which must be basic types
+#define FFI_REGISTER_CLASS_ARENA(class,registername,...) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_class_arena_entry( \
+FFIAccessEntryType::kClassArenaConstruct, \
+reinterpret_cast<void*>(&arena_helper<class __VA_OPT__(,) __VA_ARGS__>::construct_n), \
+registername, \
+signature<decltype(arena_helper<class __VA_OPT__(,) __VA_ARGS__>::construct_n)>::sig.c_str(), \
+alignof(class), \
+sizeof(class) \
+)); \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_class_arena_entry( \
+FFIAccessEntryType::kClassArenaDestroy, \
+reinterpret_cast<void*>(&arena_helper<class __VA_OPT__(,) __VA_ARGS__>::destroy_n), \
+registername, \
+signature<decltype(arena_helper<class __VA_OPT__(,) __VA_ARGS__>::destroy_n)>::sig.c_str(), \
+alignof(class), \
+sizeof(class) \
+));
+
+// registers a trivially copyable struct, which is passed to and returned from functions by pointer.
+// pyffi maps it to a numpy structured dtype, so arrays of it are passed and returned without copies.
+// it must be registered before the functions and fields using it
+#define FFI_REGISTER_STRUCT(type,registername) \
+static_assert(std::is_trivially_copyable_v<type> && std::is_standard_layout_v<type>, \
+"registered structs must be trivially copyable standard layout types"); \
+TYPE_ATTR_DEFINE_STRUCT_NAMESTR(type, registername); \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_struct_layout_entry( \
+registername, \
+type_str<type>::str.c_str(), \
+alignof(type), \
+sizeof(type) \
+));
+
+// fields make up the dtype of the struct, unregistered fields are left as padding.
+// fields must be basic types, pointers, registered structs or fixed size arrays of them
+#define FFI_REGISTER_STRUCT_FIELD(type,field,register_name) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_struct_field_entry( \
+register_name, \
+type_str<std::remove_all_extents_t<decltype(type::field)>>::str.c_str(), \
+offsetof(type,field), \
+sizeof(type::field)));
+
+// declares the pointer parameter param_index (0 based) of the global function registered as
+// register_name as an output: pyffi allocates it from the lib's buffer pool (or takes out=)
+// and returns it, so callers leave it out. size is the number of elements written, an expression
+// of constants and the other parameters aN: sums of products like "a1", "3*a1*a2" or "a1+1".
+// every overload registered under the name has the same outputs
+#define FFI_REGISTER_OUTPUT_PARAM(register_name,param_index,size) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_global_func_output_entry( \
+register_name, \
+size, \
+param_index));
+
+// declares the basic type (or registered struct) pointer returned by the global function or class method
+// registered as register_name as a buffer of size elements, pyffi returns it as an ndarray over the native
+// memory without a copy (None for nullptr). size is an expression like FFI_REGISTER_OUTPUT_PARAM's of constants,
+// parameters aN and values *aN written to the first element of pointer parameters, e.g. "16", "a1" or "*a0".
+// arrays returned by methods keep their object alive.
+// for a pointer field registered as register_name, size may use the other integer fields of the class by name
+#define FFI_REGISTER_RETURN_BUFFER(register_name,size) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_return_buffer_entry( \
+nullptr, \
+register_name, \
+size));
+
+// like FFI_REGISTER_RETURN_BUFFER for functions and methods handing out ownership of the buffer:
+// it is freed with deallocator once the returned array (and every view of it) is garbage collected.
+// deallocator takes the buffer pointer, e.g. std::free or an instance of a function template
+#define FFI_REGISTER_OWNED_RETURN_BUFFER(register_name,size,deallocator) \
+auto merge(_ffi_access_entry_, __COUNTER__) \
+=FFIManager::getInstance()->add_access_entry( \
+FFIAccessEntry::make_return_buffer_entry( \
+reinterpret_cast<void*>(&deallocator_wrapper<deallocator>::deallocate), \
+register_name, \
+size));
@@ -0,0 +1,32 @@
+#pragma once
+#include <cstddef>
+#include <cstdint>
+#include <new>
+#include <type_traits>
+
+/*
+arena helper template
+for a class Cl constructible from (A,B), registered with FFI_REGISTER_CLASS_ARENA(Cl, "name", A, B)
+it generates
+    void construct_n(void* mem, const A* a, const B* b, uint64_t n)
+    void destroy_n(void* mem, uint64_t n)
+which placement construct/destroy n objects laid out contiguously at mem.
+the memory itself is provided and released by the caller
+*/
+
+template <typename Cl, typename... Args>
+struct arena_helper{
+    static_assert((std::is_arithmetic_v<Args> && ...), "arena constructors only accept basic type arguments");
+    static void construct_n(void* mem, const Args*... args, uint64_t n){
+        Cl* objs = static_cast<Cl*>(mem);
+        for (uint64_t i=0; i<n; i++){
+            new (objs+i) Cl(args[i]...);
+        }
+    }
+    static void destroy_n(void* mem, uint64_t n){
+        Cl* objs = static_cast<Cl*>(mem);
+        for (uint64_t i=0; i<n; i++){
+            objs[i].~Cl();
+        }
+    }
+};
@@ -0,0 +1,69 @@
+#pragma once
+#include <cstddef>
+#include <cstdint>
+#include <type_traits>
+
+/*
+batch wrapper generator template
+for a function R func(A,B) registered with FFI_REGISTER_GLOBAL_FUNCTION_BATCHED
+it generates a wrapper function 
+    void wrapper_function(const A* a, const B* b, R* out, uint64_t n)
+that applies func elementwise over n elements
+*/
+
+template <auto func, typename T = decltype(func)>
+struct batch_wrapper;
+
+template <auto func, typename R, typename... Args>
+struct batch_wrapper<func, R(*)(Args...)>{
+    static_assert(!std::is_void_v<R>, "batched functions must return a value");
+    static_assert((std::is_arithmetic_v<Args> && ...), "batched functions only accept basic type arguments");
+    static void wrapper_function(const Args*... args, R* out, uint64_t n){
+        for (uint64_t i=0; i<n; i++){
+            out[i] = func(args[i]...);
+        }
+    }
+};
+
+/*
+for the destroy function void destroy(Cl* obj) registered with FFI_REGISTER_CLASS_DESTROY_MANY
+it generates
+    void destroy_many(const uint64_t* objs, uint64_t n)
+which destroys the n objects at the addresses objs
+*/
+
+template <auto func, typename T = decltype(func)>
+struct destroy_many_wrapper;
+
+template <auto func, typename R, typename Obj>
+struct destroy_many_wrapper<func, R(*)(Obj)>{
+    static_assert(std::is_pointer_v<Obj>, "destroy functions must take the object pointer");
+    static void destroy_many(const uint64_t* objs, uint64_t n){
+        for (uint64_t i=0; i<n; i++){
+            func(reinterpret_cast<Obj>(objs[i]));
+        }
+    }
+};
+
+/*
+for the deallocator void dealloc(T* p) registered with FFI_REGISTER_OWNED_RETURN_BUFFER
+it generates
+    void deallocate(void* p)
+inside the registering lib, so its address is relative to the lib like every other registered
+pointer (deallocators like std::free live in other libs)
+*/
+
+template <auto func, typename T = decltype(func)>
+struct deallocator_wrapper;
+
+template <auto func, typename R, typename P>
+struct deallocator_wrapper<func, R(*)(P)>{
+    static_assert(std::is_pointer_v<P>, "deallocators must take the buffer pointer");
+    static void deallocate(void* p){
+        func(static_cast<P>(p));
+    }
+};
+
+// e.g. std::free is noexcept
+template <auto func, typename R, typename P>
+struct deallocator_wrapper<func, R(*)(P) noexcept> : deallocator_wrapper<func, R(*)(P)>{};
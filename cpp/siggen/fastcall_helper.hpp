@@ -0,0 +1,222 @@
+#pragma once
+#include <cstddef>
+#include <cstdint>
+#include <tuple>
+#include <utility>
+#include <type_traits>
+#include <Python.h>
+
+/*
+cpython fast call wrapper generator template
+for a function R func(A,B) it generates
+    PyObject* wrapper_function(PyObject* self, PyObject* const* args, Py_ssize_t nargs)
+a METH_FASTCALL function converting the python arguments, calling func and converting its result.
+conversions follow ctypes, so pyffi gets the same results with or without the wrapper:
+    - integers take ints and __index__ objects (not floats) and truncate them
+    - floating point types take anything PyFloat_AsDouble takes
+    - const char* takes bytes or None and returns bytes or None
+    - other pointers take ints, bytes or None and return ints or None
+self is the tuple (error type, release gil) given by pyffi: conversion errors raise
+"argument N: TypeError: wrong type" of the error type (ctypes.ArgumentError)
+and the gil is released around func if release gil is True
+*/
+
+template <typename T, typename Enable = void>
+struct fastcall_type;
+
+template <typename T>
+struct fastcall_type<T, std::enable_if_t<std::is_integral_v<T>>>{
+    static bool from_python(PyObject* o, T* out){
+        // floats have no __index__ and are rejected
+        unsigned long long v = PyLong_AsUnsignedLongLongMask(o);
+        if (v == static_cast<unsigned long long>(-1) && PyErr_Occurred()){
+            return false;
+        }
+        *out = static_cast<T>(v);
+        return true;
+    }
+    static PyObject* to_python(T v){
+        if constexpr (std::is_signed_v<T>){
+            return PyLong_FromLongLong(v);
+        }else{
+            return PyLong_FromUnsignedLongLong(v);
+        }
+    }
+};
+
+template <typename T>
+struct fastcall_type<T, std::enable_if_t<std::is_floating_point_v<T>>>{
+    static bool from_python(PyObject* o, T* out){
+        double v = PyFloat_AsDouble(o);
+        if (v == -1.0 && PyErr_Occurred()){
+            return false;
+        }
+        *out = static_cast<T>(v);
+        return true;
+    }
+    static PyObject* to_python(T v){
+        return PyFloat_FromDouble(v);
+    }
+};
+
+template <>
+struct fastcall_type<const char*>{
+    static bool from_python(PyObject* o, const char** out){
+        if (o == Py_None){
+            *out = nullptr;
+            return true;
+        }
+        if (PyBytes_Check(o)){
+            *out = PyBytes_AS_STRING(o);
+            return true;
+        }
+        return false;
+    }
+    static PyObject* to_python(const char* v){
+        if (v == nullptr){
+            Py_RETURN_NONE;
+        }
+        return PyBytes_FromString(v);
+    }
+};
+
+template <typename T>
+struct fastcall_type<T, std::enable_if_t<std::is_pointer_v<T> && !std::is_same_v<T,const char*>>>{
+    static bool from_python(PyObject* o, T* out){
+        if (o == Py_None){
+            *out = nullptr;
+            return true;
+        }
+        if (PyLong_Check(o)){
+            void* v = PyLong_AsVoidPtr(o);
+            if (v == nullptr && PyErr_Occurred()){
+                return false;
+            }
+            *out = static_cast<T>(v);
+            return true;
+        }
+        if (PyBytes_Check(o)){
+            *out = reinterpret_cast<T>(PyBytes_AS_STRING(o));
+            return true;
+        }
+        return false;
+    }
+    static PyObject* to_python(T v){
+        if (v == nullptr){
+            Py_RETURN_NONE;
+        }
+        return PyLong_FromVoidPtr(const_cast<void*>(reinterpret_cast<const void*>(v)));
+    }
+};
+
+inline PyObject* fastcall_arg_num_error(size_t expected, Py_ssize_t given){
+    PyErr_Format(PyExc_TypeError, "this function takes %zu arguments (%zd given)", expected, given);
+    return nullptr;
+}
+
+inline PyObject* fastcall_arg_error(PyObject* self, size_t index){
+    PyErr_Clear();
+    PyErr_Format(PyTuple_GET_ITEM(self,0), "argument %zu: TypeError: wrong type", index+1);
+    return nullptr;
+}
+
+template <auto func, typename T = decltype(func)>
+struct fastcall_wrapper;
+
+template <auto func, typename R, typename... Args>
+struct fastcall_wrapper<func, R(*)(Args...)>{
+    static PyObject* wrapper_function(PyObject* self, PyObject* const* args, Py_ssize_t nargs){
+        if (nargs != static_cast<Py_ssize_t>(sizeof...(Args))){
+            return fastcall_arg_num_error(sizeof...(Args), nargs);
+        }
+        return call(self, args, std::index_sequence_for<Args...>{});
+    }
+    template <size_t... I>
+    static PyObject* call(PyObject* self, PyObject* const* args, std::index_sequence<I...>){
+        std::tuple<std::remove_cv_t<Args>...> values;
+        size_t failed = 0;
+        bool converted = ((fastcall_type<std::remove_cv_t<Args>>::from_python(args[I], &std::get<I>(values)) || (failed = I, false)) && ...);
+        if (!converted){
+            return fastcall_arg_error(self, failed);
+        }
+        bool release_gil = PyTuple_GET_ITEM(self,1) == Py_True;
+        if constexpr (std::is_void_v<R>){
+            if (release_gil){
+                Py_BEGIN_ALLOW_THREADS
+                func(std::get<I>(values)...);
+                Py_END_ALLOW_THREADS
+            }else{
+                func(std::get<I>(values)...);
+            }
+            Py_RETURN_NONE;
+        }else{
+            std::remove_cv_t<R> r;
+            if (release_gil){
+                Py_BEGIN_ALLOW_THREADS
+                r = func(std::get<I>(values)...);
+                Py_END_ALLOW_THREADS
+            }else{
+                r = func(std::get<I>(values)...);
+            }
+            return fastcall_type<std::remove_cv_t<R>>::to_python(r);
+        }
+    }
+};
+
+// member functions are called through a thunk taking the object pointer first,
+// like the mf_wrapper functions registered for them
+template <auto memfunc, typename T = decltype(memfunc)>
+struct fastcall_method;
+
+template <auto memfunc, typename Cl, typename R, typename... Args>
+struct fastcall_method<memfunc, R(Cl::*)(Args...)>{
+    static R thunk(Cl* cl, Args... args){
+        return (cl->*memfunc)(args...);
+    }
+    using wrapper = fastcall_wrapper<&thunk>;
+};
+
+// field accessors: get(obj) and set(obj, value) of a basic type field at offset.
+// self is unused, errors are raised like ctypes raises them for field access
+template <typename T, size_t offset>
+struct fastcall_field{
+    static_assert(std::is_arithmetic_v<T>, "fast call field accessors only support basic type fields");
+    static T* field_ptr(PyObject* o){
+        char* obj = nullptr;
+        if (!fastcall_type<char*>::from_python(o, &obj) || obj == nullptr){
+            if (!PyErr_Occurred()){
+                PyErr_SetString(PyExc_TypeError, "wrong type");
+            }
+            return nullptr;
+        }
+        return reinterpret_cast<T*>(obj+offset);
+    }
+    static PyObject* get_function(PyObject* self, PyObject* const* args, Py_ssize_t nargs){
+        if (nargs != 1){
+            return fastcall_arg_num_error(1, nargs);
+        }
+        T* p = field_ptr(args[0]);
+        if (p == nullptr){
+            return nullptr;
+        }
+        return fastcall_type<T>::to_python(*p);
+    }
+    static PyObject* set_function(PyObject* self, PyObject* const* args, Py_ssize_t nargs){
+        if (nargs != 2){
+            return fastcall_arg_num_error(2, nargs);
+        }
+        T* p = field_ptr(args[0]);
+        if (p == nullptr){
+            return nullptr;
+        }
+        T v;
+        if (!fastcall_type<T>::from_python(args[1], &v)){
+            if (!PyErr_Occurred()){
+                PyErr_SetString(PyExc_TypeError, "wrong type");
+            }
+            return nullptr;
+        }
+        *p = v;
+        Py_RETURN_NONE;
+    }
+};
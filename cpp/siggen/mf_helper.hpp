@@ -1,10 +1,37 @@
+#pragma once
+#include <cstdint>
 #include <functional>
+#include <type_traits>
 
 /*
 we now use this member function wrapper generator template
 */
 
 
+// batch wrapper: invokes Helper::wrapper_function on n objects passed by their addresses,
+// the i-th call takes the i-th element of every argument array.
+// only instantiated for methods registered with FFI_REGISTER_CLASS_METHOD_BATCHED
+template <typename Helper, typename Cl, typename R, typename... Args>
+struct _mf_batch_helper{
+    static_assert((std::is_arithmetic_v<Args> && ...) && std::is_arithmetic_v<R>, "batched methods only take and return basic types");
+    static void batch_wrapper_function(const uint64_t* objs, const Args*... args, R* out, uint64_t n){
+        for (uint64_t i=0; i<n; i++){
+            out[i] = Helper::wrapper_function(reinterpret_cast<Cl*>(objs[i]), args[i]...);
+        }
+    }
+};
+
+// void member functions have no output array
+template <typename Helper, typename Cl, typename... Args>
+struct _mf_batch_helper<Helper,Cl,void,Args...>{
+    static_assert((std::is_arithmetic_v<Args> && ...), "batched methods only take basic types");
+    static void batch_wrapper_function(const uint64_t* objs, const Args*... args, uint64_t n){
+        for (uint64_t i=0; i<n; i++){
+            Helper::wrapper_function(reinterpret_cast<Cl*>(objs[i]), args[i]...);
+        }
+    }
+};
+
 template <size_t N ,typename Cl, typename Func>
 struct _mf_helper;
 
@@ -12,8 +39,10 @@ template <size_t N ,typename Cl, typename R,typename... Args>
 struct _mf_helper<N,Cl,R(Args...)>{
     // type define R(Cl::*)(Args...) to Clmemfunctionptr
     typedef R (Cl::*Clmemfunctionptr)(Args...);
+    // naming the batch helper does not instantiate it
+    typedef _mf_batch_helper<_mf_helper<N,Cl,R(Args...)>,Cl,R,Args...> batch_helper;
     // constructor: set _funcptr to given member function pointer
-    _mf_helper<Cl, R(Args...)>(Clmemfunctionptr func){
+    _mf_helper(Clmemfunctionptr func){
         _funcptr = func;
     }
     static inline Clmemfunctionptr _funcptr;
@@ -36,7 +65,7 @@ struct mf_wrapper;
 template <size_t N, typename Cl, typename Func>
 struct mf_wrapper<N,Func(Cl::*)>:_mf_helper<N,Cl, Func>{
     typedef Func(Cl::*_memfp_type);
-    mf_wrapper<N,Func(Cl::*)>(_memfp_type ptr):_mf_helper<N,Cl, Func>(ptr){}
+    mf_wrapper(_memfp_type ptr):_mf_helper<N,Cl, Func>(ptr){}
 };
 
 template <size_t N, typename Cl, typename Func>
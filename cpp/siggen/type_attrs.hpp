@@ -22,6 +22,16 @@ struct is_special<const char*>{
     static constexpr bool value = true;
 };
 
+// structs registered with FFI_REGISTER_STRUCT
+
+template <typename T>
+struct is_ffi_struct{
+    static constexpr bool value = false;
+};
+
+template <typename T>
+inline constexpr bool is_ffi_struct_v = is_ffi_struct<T>::value;
+
 // type str generation
 
 template<typename T, bool special=is_special_v<T>, typename Enable = void>
@@ -87,11 +97,29 @@ struct type_str<void>{
     static constexpr const_str<4> str = "void";
 };
 
+// const qualified types share the type str of their unqualified type
 template<typename T >
-struct type_str<T, false, std::enable_if_t<std::is_pointer_v<T>> >{
+struct type_str<const T, false, void>{
+    static constexpr auto str = type_str<T>::str;
+};
+
+template<typename T>
+inline constexpr bool is_pointer_to_const_data_v =
+    std::is_pointer_v<T> && std::is_const_v<std::remove_pointer_t<T>> &&
+    (std::is_arithmetic_v<std::remove_pointer_t<T>> || is_ffi_struct_v<std::remove_cv_t<std::remove_pointer_t<T>>>);
+
+template<typename T >
+struct type_str<T, false, std::enable_if_t<std::is_pointer_v<T> && !std::is_const_v<T> && !is_pointer_to_const_data_v<T>> >{
     static constexpr auto str = make_const_str("*")+type_str<std::remove_pointer_t<T>>::str;
 };
 
+// pointers to const basic types and registered structs are marked with a "c" prefix
+// (e.g. "c*u32"), so read-only buffers could be passed to them
+template<typename T >
+struct type_str<T, false, std::enable_if_t<!std::is_const_v<T> && is_pointer_to_const_data_v<T>> >{
+    static constexpr auto str = make_const_str("c*")+type_str<std::remove_const_t<std::remove_pointer_t<T>>>::str;
+};
+
 
 #define TYPE_ATTR_DEFINE_CLASS_NAMESTR(classname,namestr)  \
 template<>                                                 \
@@ -99,3 +127,9 @@ struct type_str<classname> {                               \
     static constexpr auto str = make_const_str(namestr);   \
 };
 
+#define TYPE_ATTR_DEFINE_STRUCT_NAMESTR(structname,namestr)  \
+TYPE_ATTR_DEFINE_CLASS_NAMESTR(structname,namestr)           \
+template<>                                                   \
+struct is_ffi_struct<structname> {                           \
+    static constexpr bool value = true;                      \
+};
@@ -0,0 +1,398 @@
+# ahead of time binding generator: reads the ffi_man registry of a lib once and writes a plain
+# python module (and optionally a .pyi stub) binding every global function, class, method and field
+# with hard coded ctypes prototypes, offsets and converters.
+#
+#   python -m pyffi.ffi_aot ./lib.so -o lib_bindings.py --pyi
+#
+# importing the generated module does not walk the registry or parse any signature.
+# batch wrappers, arenas, class structured views and the other runtime features stay in the dynamic api
+import os
+import sys
+import keyword
+import argparse
+from . import ffi_common
+from . import ffi_cache
+from .ffi_core import Lib
+
+
+def _identifier(name:str)->str:
+    name = "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = name+"_"
+    return name
+
+
+# fixed width names, ctypes.c_uint32.__name__ is a platform dependent alias
+_basic_ctypes_names = {
+    "i8":"ctypes.c_int8","u8":"ctypes.c_uint8","i16":"ctypes.c_int16","u16":"ctypes.c_uint16",
+    "i32":"ctypes.c_int32","u32":"ctypes.c_uint32","i64":"ctypes.c_int64","u64":"ctypes.c_uint64",
+    "f32":"ctypes.c_float","f64":"ctypes.c_double","void":"None"
+}
+
+
+def _offset_expr(offset:int)->str:
+    return "_base + {}".format(offset) if offset >= 0 else "_base - {}".format(-offset)
+
+
+class FFIBindingGenerator:
+    def __init__(self,lib_path:str,module_lib_path:str=None) -> None:
+        self._lib = Lib(lib_path)
+        self._typing_manager = self._lib.typing_manager
+        # path of the lib written into the module, relative paths are resolved against the module
+        self.module_lib_path = module_lib_path if module_lib_path is not None else os.path.abspath(lib_path)
+        self._base = self._lib._base_address()
+        self._class_names = {name:_identifier(name) for name in self._lib.ffi_get_class_names()}
+        self._struct_names = {name:_identifier(name) for name in self._lib.ffi_get_struct_names()}
+        self._buffer_converters = {}
+        # (struct name, is const) -> converter name, None for the result converter
+        self._struct_converters = {}
+        self._lines = []
+        self._stub_lines = []
+        # overload dispatchers and struct dtypes need numpy
+        self._uses_numpy = len(self._struct_names) != 0
+
+    def _is_class_ptr(self,sig_element:str)->bool:
+        return sig_element.startswith("*") and sig_element[1:] in self._class_names
+
+    def _struct_ptr_name(self,sig_element:str)->str:
+        # registered name of the struct sig_element points to, or None
+        name = sig_element[sig_element.find("*")+1:]
+        return name if "*" in sig_element and name in self._struct_names else None
+
+    def _struct_converter(self,struct_name:str,is_const)->str:
+        key = (struct_name,is_const)
+        name = self._struct_converters.get(key)
+        if name is None:
+            kind = "ret" if is_const is None else "const" if is_const else "arg"
+            name = self._struct_converters[key] = "_struct_{}_{}".format(kind,self._struct_names[struct_name])
+        return name
+
+    def _ctypes_expr(self,sig_element:str)->str:
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type:
+            return _basic_ctypes_names[sig_element]
+        if sd.is_basic_type_pointer:
+            return "ctypes.POINTER({})".format(_basic_ctypes_names[sd.sig_element_removed_indirection])
+        if sig_element == "*cstr":
+            return "ctypes.c_char_p"
+        return "ctypes.c_void_p"
+
+    def _arg_ctypes(self,sig_element:str)->str:
+        # buffers are passed to pointer parameters as raw addresses, see ffi_typing.ffi_make_buffer_converter
+        if self._typing_manager.ffi_get_sig_element_descriptor(sig_element).is_basic_type_pointer:
+            return "ctypes.c_void_p"
+        return self._ctypes_expr(sig_element)
+
+    def _arg_expr(self,sig_element:str,arg:str):
+        # returns the converted argument expression, arg itself if no conversion is needed
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type:
+            return arg
+        if sd.is_basic_type_pointer:
+            key = (sd.sig_element_removed_indirection,sd.is_const_pointer)
+            name = self._buffer_converters.get(key)
+            if name is None:
+                name = self._buffer_converters[key] = "_buffer_{}{}".format("const_" if sd.is_const_pointer else "",key[0])
+            return "{}({})".format(name,arg)
+        if sig_element == "*cstr":
+            return '{}.encode("utf_8")'.format(arg)
+        struct_name = self._struct_ptr_name(sig_element)
+        if struct_name is not None:
+            return "{}({})".format(self._struct_converter(struct_name,sd.is_const_pointer),arg)
+        assert self._is_class_ptr(sig_element), "unsupported type {}".format(sig_element)
+        return "{}._ptr".format(arg)
+
+    def _ret_expr(self,sig_element:str,expr:str):
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type or sd.is_basic_type_pointer:
+            return expr
+        if sig_element == "*cstr":
+            return '{}.decode("utf_8")'.format(expr)
+        struct_name = self._struct_ptr_name(sig_element)
+        if struct_name is not None:
+            return "{}({})".format(self._struct_converter(struct_name,None),expr)
+        assert self._is_class_ptr(sig_element), "unsupported type {}".format(sig_element)
+        return "{}._from_ptr({})".format(self._class_names[sig_element[1:]],expr)
+
+    def _hint(self,sig_element:str)->str:
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        if sig_element == "void":
+            return "None"
+        if sd.is_basic_type:
+            return self._typing_manager.ffi_xtype_to_mapping_entry(sig_element).python_type.__name__
+        if sd.is_basic_type_pointer:
+            return "_Buffer"
+        if sig_element == "*cstr":
+            return "str"
+        if self._struct_ptr_name(sig_element) is not None:
+            return "Optional[np.ndarray]"
+        return "Optional[{}]".format(self._class_names[sig_element[1:]])
+
+    def _arg_hint(self,sig_element:str)->str:
+        hint = self._hint(sig_element)
+        return hint[len("Optional["):-1] if hint.startswith("Optional[") else hint
+
+    def _ret_hint(self,sig_element:str)->str:
+        # basic type pointers are returned as raw ctypes pointers, like pointer fields
+        if self._typing_manager.ffi_get_sig_element_descriptor(sig_element).is_basic_type_pointer:
+            return "Any"
+        return self._hint(sig_element)
+
+    def _prototype(self,name:str,sig_elements,ptr:int):
+        # module level ctypes function at its offset from the lib's base address
+        ctypes_sig = [self._ctypes_expr(sig_elements[0])] + [self._arg_ctypes(e) for e in sig_elements[1:]]
+        self._lines.append("{} = ctypes.CFUNCTYPE({})({})".format(name,", ".join(ctypes_sig),_offset_expr(ptr-self._base)))
+
+    def _call_body(self,func:str,sig_elements,arg_names,first_arg_expr:str=None):
+        call_args = [self._arg_expr(e,a) for e,a in zip(sig_elements[1+(first_arg_expr is not None):],arg_names)]
+        if first_arg_expr is not None:
+            call_args = [first_arg_expr] + call_args
+        return self._ret_expr(sig_elements[0],"{}({})".format(func,", ".join(call_args)))
+
+    def _spec_expr(self,sig_element:str)->str:
+        # source of the overload match spec of a parameter, see ffi_typing.TypingManager.ffi_match_spec
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type:
+            return "(\"b\", {})".format(_basic_ctypes_names[sig_element])
+        if sd.is_basic_type_pointer:
+            return "(\"p\", {}, {})".format(_basic_ctypes_names[sd.sig_element_removed_indirection],sd.is_const_pointer)
+        if sig_element == "*cstr":
+            return "(\"o\", str)"
+        struct_name = self._struct_ptr_name(sig_element)
+        if struct_name is not None:
+            return "(\"s\", _dtype_{})".format(self._struct_names[struct_name])
+        assert self._is_class_ptr(sig_element), "unsupported type {}".format(sig_element)
+        return "(\"o\", {})".format(self._class_names[sig_element[1:]])
+
+    def _stub_def(self,name:str,sig_elements,arg_names)->str:
+        return "def {}({}) -> {}: ...".format(
+            name,", ".join("{}: {}".format(a,self._arg_hint(e)) for a,e in zip(arg_names,sig_elements[1:])),self._ret_hint(sig_elements[0]))
+
+    def _gen_global_func(self,name:str,func:str,entry):
+        # binds the function of entry as name over the ctypes function func,
+        # returns its sig elements and argument names
+        sig_elements = self._typing_manager.ffi_split_sig_to_element(entry.sig.decode("utf_8"))
+        self._prototype(func,sig_elements,entry.ptr)
+        arg_names = ["a{}".format(i) for i in range(len(sig_elements)-1)]
+        body = self._call_body(func,sig_elements,arg_names)
+        if body == "{}({})".format(func,", ".join(arg_names)):
+            # nothing to convert: the ctypes function is the binding
+            self._lines.append("{} = {}".format(name,func))
+        else:
+            self._lines.append("def {}({}):".format(name,", ".join(arg_names)))
+            self._lines.append("    return {}".format(body))
+        self._lines.append("")
+        return sig_elements, arg_names
+
+    def _gen_global_funcs(self):
+        entry_type = ffi_common.FFIAccessEntryType.kGlobalFunc
+        for registered_name in self._lib._access_entry_index[entry_type.value]:
+            name = _identifier(registered_name)
+            entries = self._lib.ffi_find_access_entries(entry_type,registered_name)
+            if len(entries) == 1:
+                sig_elements, arg_names = self._gen_global_func(name,"_f_"+name,entries[0])
+                self._stub_lines.append(self._stub_def(name,sig_elements,arg_names))
+                continue
+            # every overload is bound on its own, calls are dispatched to one of them by the types
+            # (dtypes for ndarrays) of their arguments like FFIGlobalFunc does
+            overload_names, specs, stubs = [], [], []
+            for i, entry in enumerate(entries):
+                overload_name = "_{}_{}".format(name,i)
+                sig_elements, arg_names = self._gen_global_func(overload_name,"_f_{}_{}".format(name,i),entry)
+                overload_names.append(overload_name)
+                specs.append("({})".format("".join(self._spec_expr(e)+", " for e in sig_elements[1:])))
+                stub = self._stub_def(name,sig_elements,arg_names)
+                if stub not in stubs:
+                    stubs.append(stub)
+            self._uses_numpy = True
+            self._lines += [
+                "_{}_overloads = ({})".format(name,"".join(n+", " for n in overload_names)),
+                "_{}_specs = ({})".format(name,"".join(spec+", " for spec in specs)),
+                "_{}_cache = {{}}".format(name),
+                "def {}(*args):".format(name),
+                "    f = _{}_cache.get(tuple([a.dtype if type(a) is _ndarray else type(a) for a in args]))".format(name),
+                "    if f is None:",
+                "        f = ffi_typing.ffi_resolve_overload(_{0}_cache, _{0}_overloads, _{0}_specs, {1!r}, args)".format(name,registered_name),
+                "    return f(*args)",
+                "",
+            ]
+            if len(stubs) == 1:
+                self._stub_lines += stubs
+            else:
+                self._stub_lines += ["@overload\n"+stub for stub in stubs]
+
+    def _gen_class(self,registered_name:str):
+        cls = self._class_names[registered_name]
+        class_entry = self._lib.ffi_find_class_entry(registered_name)
+        construct_sig = self._typing_manager.ffi_split_sig_to_element(class_entry.construct_func_sig.decode("utf_8"))
+        destroy_sig = self._typing_manager.ffi_split_sig_to_element(class_entry.destroy_func_sig.decode("utf_8"))
+        self._prototype("_{}_construct".format(cls),construct_sig,class_entry.construct_func_ptr)
+        self._prototype("_{}_destroy".format(cls),destroy_sig,class_entry.destroy_func_ptr)
+        members = self._lib.ffi_find_class_member_entries(registered_name)
+        methods = []
+        for entry in members:
+            if entry.access_type() is ffi_common.FFIAccessEntryType.kClassMethod:
+                sig_elements = self._typing_manager.ffi_split_sig_to_element(entry.sig.decode("utf_8"))
+                func = "_{}_{}".format(cls,_identifier(entry.name.decode("utf_8").split(".")[-1]))
+                self._prototype(func,sig_elements,entry.ptr)
+                methods.append((entry,func,sig_elements))
+        self._lines.append("")
+        construct_args = ["a{}".format(i) for i in range(len(construct_sig)-1)]
+        construct_hints = ", ".join("{}: {}".format(a,self._arg_hint(e)) for a,e in zip(construct_args,construct_sig[1:]))
+        self._lines += [
+            "class {}:".format(cls),
+            "    __slots__ = (\"_ptr\", \"_own\", \"__weakref__\")",
+            "    cffi_registered_name = {!r}".format(registered_name),
+            "",
+            "    def __init__(self{}):".format("".join(", "+a for a in construct_args)),
+            "        self._ptr = {}".format(self._call_body("_{}_construct".format(cls),["void"] + construct_sig[1:],construct_args)),
+            "        self._own = True",
+            "",
+            "    def __del__(self):",
+            "        if getattr(self, \"_own\", False) and self._ptr is not None:",
+            "            _{}_destroy(self._ptr)".format(cls),
+            "            self._ptr = None",
+            "",
+            "    @classmethod",
+            "    def _from_ptr(cls, ptr):",
+            "        # wraps a pointer returned from cpp, the wrapper does not own the object",
+            "        if ptr is None:",
+            "            return None",
+            "        obj = cls.__new__(cls)",
+            "        obj._ptr = ptr",
+            "        obj._own = False",
+            "        return obj",
+        ]
+        self._stub_lines += [
+            "",
+            "class {}:".format(cls),
+            "    cffi_registered_name: str",
+            "    def __init__(self{}) -> None: ...".format(", "+construct_hints if construct_hints else ""),
+        ]
+        taken = set(["cffi_registered_name"])
+        for entry in members:
+            member_name = _identifier(entry.name.decode("utf_8").split(".")[-1])
+            # same rule as the dynamic binding: a name that is already taken gets a prefix
+            bind_name = "_"+member_name if member_name in taken else member_name
+            taken.add(bind_name)
+            if entry.access_type() is ffi_common.FFIAccessEntryType.kClassMethod:
+                _, func, sig_elements = next(m for m in methods if m[0] is entry)
+                arg_names = ["a{}".format(i) for i in range(len(sig_elements)-2)]
+                self._lines += [
+                    "",
+                    "    def {}(self{}):".format(bind_name,"".join(", "+a for a in arg_names)),
+                    "        return {}".format(self._call_body(func,sig_elements,arg_names,"self._ptr")),
+                ]
+                self._stub_lines.append("    def {}(self{}) -> {}: ...".format(
+                    bind_name,"".join(", {}: {}".format(a,self._arg_hint(e)) for a,e in zip(arg_names,sig_elements[2:])),self._ret_hint(sig_elements[0])))
+            else:
+                self._gen_field(entry,bind_name)
+        self._lines.append("")
+
+    def _gen_field(self,entry,bind_name:str):
+        sig_element = entry.sig.decode("utf_8")
+        address = "self._ptr + {}".format(entry.offset)
+        self._lines.append("")
+        self._lines.append("    @property")
+        self._lines.append("    def {}(self):".format(bind_name))
+        if sig_element in self._struct_names:
+            # 0-d structured view of the field, it keeps the object alive
+            dtype = "_dtype_"+self._struct_names[sig_element]
+            self._lines += [
+                "        return ffi_typing.ffi_ndarray_from_address({}, {}, (), self)".format(address,dtype),
+                "",
+                "    @{}.setter".format(bind_name),
+                "    def {}(self, value):".format(bind_name),
+                "        ffi_typing.ffi_ndarray_from_address({}, {}, ())[()] = value".format(address,dtype),
+            ]
+            self._stub_lines.append("    {}: np.ndarray".format(bind_name))
+            return
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        ctypes_type = self._ctypes_expr(sig_element)
+        if sd.is_basic_type:
+            self._lines.append("        return {}.from_address({}).value".format(ctypes_type,address))
+            self._lines += [
+                "",
+                "    @{}.setter".format(bind_name),
+                "    def {}(self, value):".format(bind_name),
+                "        {}.from_address({}).value = value".format(ctypes_type,address),
+            ]
+            self._stub_lines.append("    {}: {}".format(bind_name,self._hint(sig_element)))
+        elif sd.is_basic_type_pointer:
+            self._lines.append("        return {}.from_address({})".format(ctypes_type,address))
+            self._stub_lines.append("    @property\n    def {}(self) -> Any: ...".format(bind_name))
+        else:
+            self._lines.append("        return {}".format(self._ret_expr(sig_element,"{}.from_address({}).value".format(ctypes_type,address))))
+            self._stub_lines.append("    @property\n    def {}(self) -> {}: ...".format(bind_name,self._hint(sig_element)))
+
+    def ffi_generate(self):
+        # returns the source of the module and of its stub
+        body_start = len(self._lines)
+        for class_name in self._class_names:
+            self._gen_class(class_name)
+        self._lines.append("")
+        self._stub_lines.append("")
+        self._gen_global_funcs()
+        body = self._lines[body_start:]
+        header = [
+            "# generated by pyffi.ffi_aot from {}, do not edit".format(os.path.basename(self.module_lib_path)),
+            "import os",
+            "import ctypes",
+            "from pyffi import ffi_cache",
+            "from pyffi import ffi_typing",
+            "",
+            "_lib_path = {!r}".format(self.module_lib_path),
+            "_lib_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), _lib_path)",
+            "# the offsets below are only valid for the exact lib the bindings were generated from",
+            "if ffi_cache.ffi_file_sha256(_lib_file) != {!r}:".format(ffi_cache.ffi_file_sha256(self._lib.lib_path)),
+            "    raise ImportError(\"{} changed since the bindings were generated, regenerate them with pyffi.ffi_aot\".format(_lib_path))",
+            "_lib = ctypes.CDLL(_lib_file)",
+            "# every function is bound at its offset from this exported symbol",
+            "_base = ctypes.cast(_lib.ffi_get_manager_instance, ctypes.c_void_p).value",
+            "",
+        ]
+        for (type_str,is_const), name in self._buffer_converters.items():
+            header.append("{} = ffi_typing.ffi_make_buffer_converter({}, {})".format(name,_basic_ctypes_names[type_str],is_const))
+        if self._uses_numpy:
+            header.insert(3,"import numpy as np")
+            header.append("_ndarray = np.ndarray")
+        if len(self._struct_names) != 0:
+            # dtypes of the registered structs, numpy reprs evaluate back to equal dtypes
+            for struct_name, identifier in self._struct_names.items():
+                header.append("_dtype_{} = np.{!r}".format(identifier,self._lib.ffi_struct_dtype(struct_name)))
+            for (struct_name,is_const), name in self._struct_converters.items():
+                if is_const is None:
+                    header.append("{} = ffi_typing.ffi_make_struct_ret_converter(_dtype_{})".format(name,self._struct_names[struct_name]))
+                else:
+                    header.append("{} = ffi_typing.ffi_make_struct_converter(_dtype_{}, {})".format(name,self._struct_names[struct_name],is_const))
+        header.append("")
+        source = "\n".join(header+body).rstrip("\n")+"\n"
+        stub = "\n".join([
+            "# generated by pyffi.ffi_aot from {}, do not edit".format(os.path.basename(self.module_lib_path)),
+            "from typing import Any, Optional, Union, overload",
+            "import numpy as np",
+            "",
+            "_Buffer = Union[np.ndarray, bytes, bytearray, memoryview]",
+            "",
+        ] + self._stub_lines).rstrip("\n")+"\n"
+        return source, stub
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyffi.ffi_aot",description="generate a static binding module for a lib")
+    parser.add_argument("lib",help="the shared lib")
+    parser.add_argument("-o","--output",required=True,help="path of the generated module")
+    parser.add_argument("--lib-path",help="lib path written into the module, relative to the module (default: absolute path of lib)")
+    parser.add_argument("--pyi",action="store_true",help="also write a .pyi stub next to the module")
+    args = parser.parse_args(argv)
+    source, stub = FFIBindingGenerator(args.lib,args.lib_path).ffi_generate()
+    with open(args.output,"w") as f:
+        f.write(source)
+    if args.pyi:
+        with open(os.path.splitext(args.output)[0]+".pyi","w") as f:
+            f.write(stub)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import ctypes
+import numpy as np
+from . import ffi_typing
+
+
+class FFIArenaBlock:
+    # contiguous storage for up to capacity objects of one registered class.
+    # objects are placement constructed into it by the functions registered with
+    # FFI_REGISTER_CLASS_ARENA, and all of them are destroyed with a single native call
+    def __init__(self,cls:type,capacity:int) -> None:
+        assert cls._arena_construct is not None, \
+            "{} has no registered arena functions".format(cls.cffi_registered_name)
+        self._cls = cls
+        self.capacity = capacity
+        self.size = 0
+        self._destroyed = False
+        class_size = cls._arena_class_size
+        class_align = cls._arena_class_align
+        # the memory is owned by python, over-allocated to align the first object
+        self._buffer = np.empty(capacity*class_size+class_align,dtype=np.uint8)
+        addr = self._buffer.ctypes.data
+        self.base = (addr+class_align-1)//class_align*class_align
+
+    def ffi_construct_many(self,args,n:int)->int:
+        # constructs n objects from the (broadcasted) argument arrays, returns the index of the first one
+        assert not self._destroyed, "arena block already destroyed"
+        assert self.size+n <= self.capacity, "arena block capacity exceeded"
+        arrays, _ = ffi_typing.ffi_as_batch_arrays(args,self._cls._arena_arg_dtypes,(n,))
+        start = self.size
+        addr = self.base+start*self._cls._arena_class_size
+        self._cls._arena_construct(addr,*[a.ctypes.data for a in arrays],n)
+        self.size += n
+        return start
+
+    def ffi_construct_one(self,args)->int:
+        # constructs a single object, returns its address
+        assert not self._destroyed, "arena block already destroyed"
+        assert self.size < self.capacity, "arena block capacity exceeded"
+        assert len(args) == len(self._cls._arena_arg_ctypes), "argument number error"
+        # keep the ctypes scalars alive until the call returns
+        scalars = [t(arg) for t, arg in zip(self._cls._arena_arg_ctypes,args)]
+        addr = self.base+self.size*self._cls._arena_class_size
+        self._cls._arena_construct(addr,*[ctypes.addressof(s) for s in scalars],1)
+        self.size += 1
+        return addr
+
+    @property
+    def ptrs(self)->np.ndarray:
+        # addresses of all constructed objects, could be passed to FFIClassMethod.map
+        return self.base+np.arange(self.size,dtype=np.uint64)*np.uint64(self._cls._arena_class_size)
+
+    def view(self)->np.ndarray:
+        # zero-copy writable structured view of all constructed objects, it keeps the block alive
+        return self._cls.ffi_view_array(self.base,self.size,self)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self,index:int):
+        # handles are views into the block: they do not own their cpp objects
+        # but keep the block memory alive
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("arena block index out of range")
+        ptr = self.base+index*self._cls._arena_class_size
+        identity_map = self._cls._lib.identity_map
+        if identity_map is not None:
+            obj = identity_map.ffi_lookup(self._cls,ptr)
+        else:
+            obj = self._cls.create()
+            obj._ptr = ptr
+        obj._arena_block = self
+        return obj
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def destroy(self):
+        if not self._destroyed and self.size != 0:
+            identity_map = self._cls._lib.identity_map
+            if identity_map is not None:
+                identity_map.ffi_invalidate_range(self._cls,self.base,self.base+self.size*self._cls._arena_class_size)
+            self._cls._arena_destroy(self.base,self.size)
+        self._destroyed = True
+
+    def __del__(self):
+        self.destroy()
+
+
+class FFIArena:
+    # inside a `with lib.arena():` scope, objects of classes with registered arena functions
+    # are constructed into arena blocks instead of separate heap allocations, and all of them
+    # are destroyed in bulk when the scope exits. handles must not be used after that
+    def __init__(self,lib,chunk_size:int=1024) -> None:
+        self._lib = lib
+        self.chunk_size = chunk_size
+        self._blocks = []
+        # class -> block that single constructions are currently filling
+        self._open_blocks = {}
+
+    def __enter__(self):
+        self._lib._arena_stack.append(self)
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        assert self._lib._arena_stack[-1] is self, "arenas must be closed in reverse order"
+        self._lib._arena_stack.pop()
+        self.close()
+        return False
+
+    def ffi_create_many(self,cls:type,n:int,args)->FFIArenaBlock:
+        block = FFIArenaBlock(cls,n)
+        block.ffi_construct_many(args,n)
+        self._blocks.append(block)
+        return block
+
+    def ffi_construct(self,cls:type,args):
+        # returns the block and the address of the constructed object
+        block = self._open_blocks.get(cls)
+        if block is None or block.size == block.capacity:
+            block = FFIArenaBlock(cls,self.chunk_size)
+            self._blocks.append(block)
+            self._open_blocks[cls] = block
+        return block, block.ffi_construct_one(args)
+
+    def close(self):
+        # one native call per block, in reverse construction order
+        for block in reversed(self._blocks):
+            block.destroy()
+        self._blocks = []
+        self._open_blocks = {}
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FFIAsyncExecutor:
+    # runs native calls for asyncio code on a fixed number of worker threads, see FFICallableBase.acall.
+    # calls waiting for a worker are counted as queued and could still be cancelled,
+    # calls already running in native code could not
+    def __init__(self,max_workers:int) -> None:
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix="pyffi_async")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _run(self,fn,args,kwargs):
+        # fn, args and kwargs are referenced by the work item until the call returns,
+        # so arrays and wrapped objects passed to the call are kept alive
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            r = fn(*args,**kwargs)
+        except BaseException:
+            with self._lock:
+                self.running -= 1
+                self.failed += 1
+            raise
+        with self._lock:
+            self.running -= 1
+            self.completed += 1
+        return r
+
+    def _on_done(self,future):
+        if future.cancelled():
+            # cancelled before it started
+            with self._lock:
+                self.queued -= 1
+                self.cancelled += 1
+
+    async def ffi_run(self,fn,*args,**kwargs):
+        with self._lock:
+            self.queued += 1
+        try:
+            future = self._executor.submit(self._run,fn,args,kwargs)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(self._on_done)
+        # cancelling the awaiting task cancels the call if it is still queued
+        return await asyncio.wrap_future(future)
+
+    @property
+    def queue_depth(self)->int:
+        # calls submitted but not started yet
+        return self.queued
+
+    def ffi_stats(self)->dict:
+        with self._lock:
+            return {
+                "max_workers":self.max_workers,
+                "queued":self.queued,
+                "running":self.running,
+                "completed":self.completed,
+                "failed":self.failed,
+                "cancelled":self.cancelled
+            }
+
+    def shutdown(self,wait:bool=True):
+        self._executor.shutdown(wait=wait,cancel_futures=True)
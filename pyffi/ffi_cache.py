@@ -0,0 +1,82 @@
+import os
+import sys
+import marshal
+import hashlib
+import tempfile
+
+
+def ffi_file_sha256(path:str)->str:
+    h = hashlib.sha256()
+    with open(path,"rb") as f:
+        for chunk in iter(lambda: f.read(1<<20),b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FFIRegistryCache:
+    # bump when the layout of the cache file changes
+    version = 3
+    # marshal format is only guaranteed to be stable within a python version,
+    # it is used over json since loading it is much faster
+    python_version = "{}.{}".format(*sys.version_info[:2])
+
+    def __init__(self,cache_dir:str,lib_path:str) -> None:
+        self.cache_dir = cache_dir
+        self.lib_path = os.path.realpath(lib_path)
+        path_hash = hashlib.sha256(self.lib_path.encode("utf_8")).hexdigest()[:16]
+        lib_name = os.path.basename(self.lib_path)
+        self.cache_path = os.path.join(cache_dir,"{}.{}.pyffi_cache".format(lib_name,path_hash))
+
+    def _stat_key(self):
+        st = os.stat(self.lib_path)
+        return {
+            "path":self.lib_path,
+            "size":st.st_size,
+            "mtime_ns":st.st_mtime_ns
+        }
+
+    def _content_hash(self):
+        return ffi_file_sha256(self.lib_path)
+
+    def ffi_load(self):
+        # returns the cached registry, or None if there is no valid cache for the lib
+        try:
+            with open(self.cache_path,"rb") as f:
+                cached = marshal.loads(f.read())
+        except (OSError,ValueError,EOFError,TypeError):
+            return None
+        if not isinstance(cached,dict):
+            return None
+        if cached.get("version") != self.version or cached.get("python_version") != self.python_version:
+            return None
+        key = cached.get("key",{})
+        stat_key = self._stat_key()
+        if any(key.get(k) != v for k,v in stat_key.items()):
+            # path, size or mtime changed: the cache is still valid if the content is the same
+            # (e.g. the lib was touched or copied), otherwise the lib has been rebuilt
+            if key.get("sha256") != self._content_hash():
+                return None
+            cached["key"] = dict(stat_key,sha256=key["sha256"])
+            self._write(cached)
+        return cached["registry"]
+
+    def ffi_save(self,registry:dict):
+        cached = {
+            "version":self.version,
+            "python_version":self.python_version,
+            "key":dict(self._stat_key(),sha256=self._content_hash()),
+            "registry":registry
+        }
+        self._write(cached)
+
+    def _write(self,cached:dict):
+        os.makedirs(self.cache_dir,exist_ok=True)
+        # write to a temp file first so concurrent loaders never see a partial cache
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,suffix=".tmp")
+        try:
+            with os.fdopen(fd,"wb") as f:
+                marshal.dump(cached,f)
+            os.replace(tmp_path,self.cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
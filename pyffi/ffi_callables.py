@@ -1,185 +1,582 @@
+import time
+import operator
 import ctypes
+import functools
 from . import ffi_common
+from . import ffi_typing
+from . import ffi_arena
+from . import ffi_stream
 import numpy as np
 
+
+def _compile_call_plan(func,arg_converters,ret_converter,record=None):
+    # generates a fixed arity function calling func, with every argument
+    # conversion resolved ahead of time. arguments that need no conversion
+    # are passed to func directly.
+    # with record, the plan times every call and passes the timestamps around
+    # argument conversion, the native call and return conversion to it
+    arg_names = ["a{}".format(i) for i in range(len(arg_converters))]
+    namespace = {"_func":func,"_ret_converter":ret_converter}
+    call_args = []
+    for i,(arg_name,converter) in enumerate(zip(arg_names,arg_converters)):
+        if converter is None:
+            call_args.append(arg_name)
+        else:
+            namespace["_converter_{}".format(i)] = converter
+            call_args.append("_converter_{}({})".format(i,arg_name))
+    if record is None:
+        call_expr = "_func({})".format(", ".join(call_args))
+        if ret_converter is not None:
+            call_expr = "_ret_converter({})".format(call_expr)
+        src = "def call_plan({}):\n    return {}\n".format(", ".join(arg_names),call_expr)
+    else:
+        namespace["_clock"] = time.perf_counter_ns
+        namespace["_record"] = record
+        lines = ["def call_plan({}):".format(", ".join(arg_names)),"    t0 = _clock()"]
+        for i,call_arg in enumerate(call_args):
+            lines.append("    c{} = {}".format(i,call_arg))
+        lines.append("    t1 = _clock()")
+        lines.append("    r = _func({})".format(", ".join("c{}".format(i) for i in range(len(call_args)))))
+        lines.append("    t2 = _clock()")
+        if ret_converter is not None:
+            lines.append("    r = _ret_converter(r)")
+        lines.append("    _record(t0, t1, t2, _clock())")
+        lines.append("    return r")
+        src = "\n".join(lines)+"\n"
+    exec(src,namespace)
+    return namespace["call_plan"]
+
+
+def _compile_size_expr(expr:str,n_params:int,first:int=0,deref:bool=False):
+    # python expression of a FFI_REGISTER_OUTPUT_PARAM/FFI_REGISTER_RETURN_BUFFER size expression over the
+    # call plan argument names, parameter aN is the call plan argument a(N+first) (methods take the object first).
+    # with deref, *aN reads the first element of pointer parameter N, after the call.
+    # returns it with the indices of the call plan arguments it reads
+    indices = set()
+    def factor(f:str):
+        is_deref = f[:1] == "*"
+        name = f[1:] if is_deref else f
+        if name[:1] != "a" or not name[1:].isdigit() or int(name[1:]) >= n_params or (is_deref and not deref):
+            return None
+        index = int(name[1:])+first
+        indices.add(index)
+        return "_index(a{}[0])".format(index) if is_deref else "_index(a{})".format(index)
+    return ffi_typing.ffi_compile_size_expr(expr,factor), indices
+
+
+def _check_out(out,dtype,n:int):
+    assert memoryview(out).nbytes >= n*dtype.itemsize, "out is too small"
+    return out
+
+
+def _split_out(out,n:int):
+    if out is None:
+        return (None,)*n
+    assert isinstance(out,tuple) and len(out) == n, "out must be a tuple of every output"
+    return out
+
+
+def _compile_return_buffer_plan(call_plan,n_params:int,dtype,size:str,readonly:bool,keep_object:bool,deallocate):
+    # generates a call plan returning the address call_plan returns as an ndarray view of size elements
+    # of dtype (None for nullptr). the view keeps the object (argument a0) alive if keep_object,
+    # the memory is freed with deallocate if given
+    namespace = {"_call_plan":call_plan,"_view":ffi_typing.ffi_ndarray_view,"_index":operator.index,
+        "_dtype":dtype,"_deallocate":deallocate}
+    arg_names = ", ".join("a{}".format(i) for i in range(n_params))
+    src = (
+        "def return_buffer_plan({0}):\n"
+        "    r = _call_plan({0})\n"
+        "    if r is None:\n"
+        "        return None\n"
+        "    return _view(r, _dtype, {1}, {2}, {3}, _deallocate)\n"
+    ).format(arg_names,size,readonly,"a0" if keep_object else "None")
+    # size expressions only consist of validated constants and argument names
+    exec(src,namespace)
+    return namespace["return_buffer_plan"]
+
+
+def _compile_output_plan(call_plan,n_params:int,outputs,acquire,has_result:bool):
+    # generates call_plan(inputs..., out=None) taking only the inputs, the outputs
+    # [(parameter index, dtype, size expression)] are taken from out or acquire(dtype, n).
+    # returns the outputs, after the result if has_result
+    namespace = {"_call_plan":call_plan,"_acquire":acquire,"_index":operator.index,"_check_out":_check_out,"_split_out":_split_out}
+    output_names = {index:"o{}".format(index) for index,_,_ in outputs}
+    input_names = ["a{}".format(i) for i in range(n_params) if i not in output_names]
+    lines = ["def output_plan({}):".format(", ".join(input_names+["out=None"]))]
+    if len(outputs) == 1:
+        lines.append("    {} = out".format(output_names[outputs[0][0]]))
+    else:
+        lines.append("    {}, = _split_out(out, {})".format(", ".join(output_names.values()),len(outputs)))
+    for index, dtype, size in outputs:
+        namespace["_dtype_{}".format(index)] = dtype
+        lines.append("    o{0} = _acquire(_dtype_{0}, {1}) if o{0} is None else _check_out(o{0}, _dtype_{0}, {1})".format(index,size))
+    call_args = [output_names.get(i,"a{}".format(i)) for i in range(n_params)]
+    results = list(output_names.values())
+    if has_result:
+        lines.append("    r = _call_plan({})".format(", ".join(call_args)))
+        results = ["r"]+results
+    else:
+        lines.append("    _call_plan({})".format(", ".join(call_args)))
+    lines.append("    return {}".format(", ".join(results)))
+    # size expressions only consist of validated constants and argument names
+    exec("\n".join(lines)+"\n",namespace)
+    return namespace["output_plan"]
+
+
+_ndarray = np.ndarray
+
+
+class _FFIBoundMethod(functools.partial):
+    # foo.method of a registered class method, calls and acall take foo as the first argument.
+    # a partial keeps the call of the bound method in c
+    __slots__ = ()
+
+    def acall(self,*args,**kwargs):
+        return self.func.acall(*self.args,*args,**kwargs)
+
+    def __getattr__(self,name:str):
+        return getattr(self.func,name)
+
+
+# parallel_map does not split work below this number of elements per chunk
+_min_parallel_chunk_size = 1<<14
+
+
+def _run_batch(lib,batch_func,arrays,n:int,parallel:bool=False,chunk_size:int=None):
+    # calls batch_func(*data pointers of arrays, n). arrays are c contiguous with n
+    # elements each, if parallel they are split into chunks run on the lib's thread pool
+    addrs = [a.ctypes.data for a in arrays]
+    if not parallel or lib.ffi_in_executor():
+        batch_func(*addrs,n)
+        return
+    if chunk_size is None:
+        chunk_size = max(-(-n//lib.max_workers),_min_parallel_chunk_size)
+    if n <= chunk_size:
+        batch_func(*addrs,n)
+        return
+    itemsizes = [a.itemsize for a in arrays]
+    def run_chunk(start):
+        stop = min(start+chunk_size,n)
+        batch_func(*[addr+start*itemsize for addr,itemsize in zip(addrs,itemsizes)],stop-start)
+    # batch wrappers are CFUNCTYPE functions: the GIL is released while they run
+    for _ in lib.ffi_executor().map(run_chunk,range(0,n,chunk_size)):
+        pass
+
+
 def generate_callables(lib):
     class FFICallableBase:
         sig_elements = None
         ctypes_sig = None
         func = None
         cffi_registered_name = None
+        # call plans are generated once per callable by _init_callable
+        # _call_plan converts the return value, _raw_call_plan does not
+        _call_plan = None
+        _raw_call_plan = None
         _lib = lib
+        # ctypes releases the GIL around every call by default. holding it is cheaper for
+        # short functions, but blocks all other python threads while the function runs
+        release_gil = True
+        # callable kind shown in instrumentation reports
+        kind = None
+        # entry type of the METH_FASTCALL wrapper of the callable, see ffi_fastcall
+        _fastcall_entry_type = None
+        # methods take the object as the first parameter
+        _takes_object = False
+        # (dtype, size expression, readonly, keep object, deallocator) of the returned buffer, see _init_return_buffer
+        _return_buffer = None
         def __init__(self) -> None:
             raise NotImplementedError
+
+        def _init_callable(self,sig:str,func_ptr:int):
+            typing_manager = self._lib.typing_manager
+            self._sig = sig
+            self.sig_elements = typing_manager.ffi_split_sig_to_element(sig)
+            self.ctypes_sig = [None] * len(self.sig_elements)
+            for i, sig_element in enumerate(self.sig_elements):
+                sd = typing_manager.ffi_get_sig_element_descriptor(sig_element)
+                # buffers are passed to pointer parameters as raw addresses, see ffi_make_buffer_converter
+                self.ctypes_sig[i] = ctypes.c_void_p if i != 0 and sd.is_basic_type_pointer else sd.ctypes_type
+            self._func_ptr = func_ptr
+            self._init_return_buffer()
+            self._build_call_plans()
+            self._lib._callables.add(self)
+
+        def _init_return_buffer(self):
+            # pointers returned by functions and methods registered with FFI_REGISTER_RETURN_BUFFER
+            # are returned as ndarray views over the native memory instead of ctypes pointers
+            entry_type = ffi_common.FFIAccessEntryType.kReturnBuffer
+            entry = self._lib.ffi_find_access_entry(entry_type,self.cffi_registered_name)
+            if entry is None:
+                return
+            typing_manager = self._lib.typing_manager
+            sd = typing_manager.ffi_get_sig_element_descriptor(self.sig_elements[0])
+            dtype = None
+            if sd.indirection_level == 1:
+                if sd.is_basic_type_pointer:
+                    dtype = typing_manager.ffi_basic_type_to_dtype(sd.sig_element_removed_indirection)
+                else:
+                    dtype = typing_manager.ffi_struct_dtype(sd.sig_element_removed_indirection)
+            assert dtype is not None, "return buffers must be pointers to basic types or structs"
+            first = 1 if self._takes_object else 0
+            size, _ = _compile_size_expr(entry.sig.decode("utf_8"),len(self.sig_elements)-1-first,first,True)
+            deallocate = None
+            if entry.ptr is not None:
+                deallocate = ctypes.CFUNCTYPE(None,ctypes.c_void_p)(entry.ptr)
+            # views of memory returned by methods keep the object alive, unless the memory is handed over
+            self._return_buffer = (dtype,size,sd.is_const_pointer,self._takes_object and deallocate is None,deallocate)
+            # the plan takes the returned address as an int
+            self.ctypes_sig[0] = ctypes.c_void_p
+
+        def _build_call_plans(self):
+            # also called to switch the gil policy and instrumentation on and off,
+            # so disabled features cost nothing per call
+            typing_manager = self._lib.typing_manager
+            self.func = None
+            if self._lib.fastcall is not None and self._fastcall_entry_type is not None:
+                self.func = self._lib.fastcall.ffi_function(self._fastcall_entry_type,self.cffi_registered_name,self._sig,self.ctypes_sig,self.release_gil)
+            if self.func is None:
+                func_maker = ctypes.CFUNCTYPE(*self.ctypes_sig) if self.release_gil else ctypes.PYFUNCTYPE(*self.ctypes_sig)
+                self.func = func_maker(self._func_ptr)
+            arg_converters = [typing_manager.ffi_make_arg_converter(e) for e in self.sig_elements[1:]]
+            ret_converter = typing_manager.ffi_make_ret_converter(self.sig_elements[0])
+            record = None
+            if self._lib.instrumentation is not None:
+                record = self._lib.instrumentation.ffi_get_stats(self.cffi_registered_name,self.kind).ffi_record
+            self._call_plan = _compile_call_plan(self.func,arg_converters,ret_converter,record)
+            self._raw_call_plan = _compile_call_plan(self.func,arg_converters,None,record)
+            if self._return_buffer is not None:
+                self._call_plan = _compile_return_buffer_plan(self._raw_call_plan,len(arg_converters),*self._return_buffer)
+            if self._lib.recorder is not None:
+                # calls are recorded around the plans, see ffi_trace
+                self._call_plan = self._lib.recorder.ffi_wrap(self,self._call_plan,True)
+                self._raw_call_plan = self._lib.recorder.ffi_wrap(self,self._raw_call_plan,False)
+
+        async def acall(self,*args,**kwargs):
+            # awaitable call run on the lib's async executor, the event loop keeps running meanwhile.
+            # class methods are awaited bound, await foo.method.acall(...), or with the object as the
+            # first argument, await FooClass.method.acall(foo,...)
+            return await self._lib.ffi_async_executor().ffi_run(self,*args,**kwargs)
+
+        def ffi_set_release_gil(self,release_gil:bool):
+            # switches the gil policy of this callable only
+            self.release_gil = release_gil
+            self._build_call_plans()
                 
         def __call__(self, *args,**kwargs):
-            ctypes_accepted_args = [None]* len(args)
-            for i,arg in enumerate(args):
-                sd = self._lib.typing_manager.ffi_get_sig_element_descriptor(self.sig_elements[i+1])
-                if self._lib.typing_manager.ffi_is_basic_type(type(arg)):
-                    ctypes_accepted_args[i] = arg
-                    assert sd.is_basic_type or not sd.is_basic_type_pointer, \
-                        "passing raw pointers is prohibited"
-                else:
-                    cmp_str:str = None
-                    mapping_entry = self._lib.typing_manager.ffi_xtype_to_mapping_entry(type(arg))
-                    if isinstance(arg,np.ndarray):
-                        array_ctypes_type = np.ctypeslib.as_ctypes_type(arg.dtype) 
-                        cmp_str = "*" + self._lib.typing_manager.ffi_xtype_to_mapping_entry(array_ctypes_type).c_ffi_type_str
-                    else:  
-                        cmp_str = mapping_entry.c_ffi_type_str
-                    assert cmp_str == self.sig_elements[i+1], "argument type error"
-                    ctypes_accepted_args[i] = \
-                        mapping_entry.f_python_to_ctypes(
-                            arg
-                        )
-                    
-            ctypes_retval = self.func(*ctypes_accepted_args)
             if "rt_convert" not in kwargs or not kwargs["rt_convert"]:
-                return ctypes_retval
-            retval_sig_element = self.sig_elements[0]
-            sd = self._lib.typing_manager.ffi_get_sig_element_descriptor(retval_sig_element)
-            if sd.is_basic_type:
-                # returning basic types: i8,i32... ctypes has done the job for us
-                return ctypes_retval
-            elif sd.is_basic_type_pointer:
-                # returning basic type pointers: *i8... create ctype pointers
-                return sd.ctypes_type(ctypes_retval)
-            else:
-                # returning extended type pointers: need to instantiate its python side counterpart class
-                return self._lib.typing_manager.ffi_xtype_to_mapping_entry(retval_sig_element).f_ctypes_to_python(ctypes_retval)
+                return self._raw_call_plan(*args)
+            return self._call_plan(*args)
 
 
     class FFIGlobalFunc(FFICallableBase):
+        kind = "global_func"
+        _fastcall_entry_type = ffi_common.FFIAccessEntryType.kGlobalFuncFastcall
+        # overloads of functions registered more than once under the same name, see _init_overloads
+        _overloads = None
+        # [(parameter index, dtype, size expression)] of the output parameters, see _init_outputs
+        _outputs = None
+        _output_plan = None
         def __init__(self,cffi_registered_name:str) -> None:
             self.cffi_registered_name = cffi_registered_name
             entry_type = ffi_common.FFIAccessEntryType.kGlobalFunc
-            access_entry = self._lib.ffi_find_access_entry(entry_type,self.cffi_registered_name)
-            assert access_entry is not None, "No valid entry found"
-            self.sig_elements = self._lib.typing_manager.ffi_split_sig_to_element(access_entry.sig.decode("utf_8"))
-            self.ctypes_sig = [None] * len(self.sig_elements)
-            for i, sig_element in enumerate(self.sig_elements):
-                ctypes_type = self._lib.typing_manager.ffi_get_sig_element_descriptor(sig_element).ctypes_type
-                self.ctypes_sig[i] = ctypes_type
-            func_maker = ctypes.CFUNCTYPE(*self.ctypes_sig)
-            self.func = func_maker(access_entry.ptr)
+            access_entries = self._lib.ffi_find_access_entries(entry_type,self.cffi_registered_name)
+            assert len(access_entries) != 0, "No valid entry found"
+            if len(access_entries) > 1:
+                self._init_overloads(access_entries)
+                return
+            self._init_entry(access_entries[0],False)
+
+        def _init_entry(self,access_entry,overloaded:bool):
+            self._init_callable(access_entry.sig.decode("utf_8"),access_entry.ptr)
+            self._init_batch(overloaded)
+            self._init_outputs()
+
+        def _init_outputs(self):
+            # pointer parameters declared as outputs with FFI_REGISTER_OUTPUT_PARAM are left out by
+            # callers, they are filled into buffers from the lib's pool (or out=) which are returned.
+            # _input_params are the parameters callers pass, overloads are matched against them
+            self._input_params = self.sig_elements[1:]
+            entry_type = ffi_common.FFIAccessEntryType.kGlobalFuncOutput
+            output_entries = self._lib.ffi_find_access_entries(entry_type,self.cffi_registered_name)
+            if len(output_entries) == 0:
+                return
+            typing_manager = self._lib.typing_manager
+            params = self.sig_elements[1:]
+            outputs = []
+            for entry in sorted(output_entries,key=lambda e: e.offset):
+                index = entry.offset
+                assert index < len(params), "output parameter {} of {} does not exist".format(index,self.cffi_registered_name)
+                sd = typing_manager.ffi_get_sig_element_descriptor(params[index])
+                dtype = None
+                if not sd.is_const_pointer and sd.indirection_level == 1:
+                    if sd.is_basic_type_pointer:
+                        dtype = typing_manager.ffi_basic_type_to_dtype(sd.sig_element_removed_indirection)
+                    else:
+                        dtype = typing_manager.ffi_struct_dtype(sd.sig_element_removed_indirection)
+                assert dtype is not None, "output parameters must be non-const pointers to basic types or structs"
+                size, indices = _compile_size_expr(entry.sig.decode("utf_8"),len(params))
+                outputs.append((index,dtype,size,indices))
+            output_indices = set(o[0] for o in outputs)
+            assert len(output_indices) == len(outputs), "output parameter declared twice"
+            assert not any(o[3] & output_indices for o in outputs), "output sizes could only depend on inputs"
+            self._outputs = [o[:3] for o in outputs]
+            self._input_params = [p for i,p in enumerate(params) if i not in output_indices]
+            # call plans are rebuilt, recording (see ffi_trace) only leaves outputs out once they are known
+            self._build_call_plans()
+
+        def _build_call_plans(self):
+            super()._build_call_plans()
+            self._build_output_plan()
+
+        def _build_output_plan(self):
+            if self._outputs is not None:
+                self._output_plan = _compile_output_plan(self._call_plan,len(self.sig_elements)-1,self._outputs,
+                    self._lib.buffer_pool.ffi_acquire,self.sig_elements[0] != "void")
+
+        def _dispatch_outputs(self,*args,out=None):
+            overload = self._dispatch_cache.get(tuple([arg.dtype if type(arg) is _ndarray else type(arg) for arg in args]))
+            if overload is None:
+                overload = self._resolve(args)
+            return overload._output_plan(*args,out=out)
+
+        def _init_overloads(self,access_entries):
+            # every overload is a plain FFIGlobalFunc, calls are dispatched to one of them by the
+            # types (dtypes for ndarrays) of their arguments. the overload picked for a tuple of
+            # argument types is cached, so after the first call dispatching is a single dict lookup
+            self._overloads = []
+            for access_entry in access_entries:
+                overload = FFIGlobalFunc.__new__(FFIGlobalFunc)
+                overload.cffi_registered_name = self.cffi_registered_name
+                overload._init_entry(access_entry,True)
+                self._overloads.append(overload)
+            self._outputs = self._overloads[0]._outputs
+            self._output_plan = self._dispatch_outputs
+            self._batch_func = None
+            self._dispatch_cache = {}
+            self._call_plan = self._dispatch
+
+        def _match_overload(self,key:tuple):
+            # the overload taking the arguments with the fewest conversions,
+            # the first registered one among equally good ones
+            typing_manager = self._lib.typing_manager
+            specs = [[typing_manager.ffi_match_spec(e) for e in overload._input_params] for overload in self._overloads]
+            best = ffi_typing.ffi_match_overload(specs,key)
+            assert best is not None, "no overload of {} takes ({})".format(
+                self.cffi_registered_name,", ".join(str(k) for k in key))
+            return self._overloads[best]
+
+        def ffi_resolve(self,*args):
+            # the overload called for args, the function itself if it is not overloaded
+            if self._overloads is None:
+                return self
+            return self._resolve(args)
+
+        def _resolve(self,args):
+            # the cache is keyed by ffi_typing.ffi_dispatch_key of every argument. calls look it up with
+            # dtypes of ndarrays and types of everything else first, which is the same key unless an
+            # argument is an ndarray subclass or a generic buffer (told apart by their dtype/format too)
+            overload = self._dispatch_cache.get(tuple([arg.dtype if type(arg) is _ndarray else type(arg) for arg in args]))
+            if overload is None:
+                key = tuple([ffi_typing.ffi_dispatch_key(arg) for arg in args])
+                overload = self._dispatch_cache.get(key)
+                if overload is None:
+                    overload = self._dispatch_cache.setdefault(key,self._match_overload(key))
+            return overload
+
+        def _dispatch(self,*args):
+            overload = self._dispatch_cache.get(tuple([arg.dtype if type(arg) is _ndarray else type(arg) for arg in args]))
+            if overload is None:
+                overload = self._resolve(args)
+            return overload._call_plan(*args)
+
+        def ffi_set_release_gil(self,release_gil:bool):
+            if self._overloads is None:
+                return super().ffi_set_release_gil(release_gil)
+            self.release_gil = release_gil
+            for overload in self._overloads:
+                overload.ffi_set_release_gil(release_gil)
+
+        def _init_batch(self,overloaded:bool=False):
+            # batch wrapper generated by FFI_REGISTER_GLOBAL_FUNCTION_BATCHED, if any
+            self._batch_func = None
+            entry_type = ffi_common.FFIAccessEntryType.kGlobalFuncBatch
+            batch_entries = self._lib.ffi_find_access_entries(entry_type,self.cffi_registered_name)
+            if len(batch_entries) == 0:
+                return
+            typing_manager = self._lib.typing_manager
+            # R f(A,B) is batched as void f_batch(const A*, const B*, R*, u64)
+            expected_sig_elements = ["void"] + ["c*"+e for e in self.sig_elements[1:]] + ["*"+self.sig_elements[0],"u64"]
+            batch_entry = None
+            for e in batch_entries:
+                if typing_manager.ffi_split_sig_to_element(e.sig.decode("utf_8")) == expected_sig_elements:
+                    batch_entry = e
+                    break
+            # overloads registered without FFI_REGISTER_GLOBAL_FUNCTION_BATCHED have no batch wrapper
+            assert batch_entry is not None or overloaded, "batch wrapper does not match the function signature"
+            if batch_entry is None:
+                return
+            self._batch_arg_dtypes = [typing_manager.ffi_basic_type_to_dtype(e) for e in self.sig_elements[1:]]
+            self._batch_ret_dtype = typing_manager.ffi_basic_type_to_dtype(self.sig_elements[0])
+            # data pointers are passed as raw addresses, no ctypes arrays are created per call
+            batch_ctypes_sig = [None] + [ctypes.c_void_p] * len(self.sig_elements) + [ctypes.c_uint64]
+            self._batch_func = ctypes.CFUNCTYPE(*batch_ctypes_sig)(batch_entry.ptr)
+
+        def batch(self, *args, out:np.ndarray=None):
+            # applies the function elementwise over the broadcasted args in one native call
+            return self._batch(args,out)
+
+        def parallel_map(self, *args, out:np.ndarray=None, chunk_size:int=None):
+            # like batch, but the elements are split into chunks computed on the lib's thread pool
+            return self._batch(args,out,True,chunk_size)
+
+        def _batch(self,args,out,parallel=False,chunk_size=None):
+            if self._overloads is not None:
+                return self.ffi_resolve(*args)._batch(args,out,parallel,chunk_size)
+            assert self._batch_func is not None, "no batch wrapper registered for {}".format(self.cffi_registered_name)
+            arrays, shape = ffi_typing.ffi_as_batch_arrays(args,self._batch_arg_dtypes)
+            out = ffi_typing.ffi_make_batch_out(out,shape,self._batch_ret_dtype)
+            _run_batch(self._lib,self._batch_func,arrays+[out],out.size,parallel,chunk_size)
+            return out
             
-        def __call__(self, *args):
-            return super().__call__(*args,rt_convert=True)
+        def stream(self, source, *args, dtype=None, chunk_size:int=ffi_stream.default_chunk_size, reducer=None, initial=None, call=None):
+            # feeds source (a file path, an ndarray or an iterable of buffers) chunk by chunk to the function,
+            # see ffi_stream.ffi_stream. chunks are passed as func(chunk, len(chunk), *args), or as call(func, chunk).
+            # dtype defaults to the type the first parameter points to, for overloaded functions
+            # to the dtype of an ndarray source
+            if dtype is None and self._overloads is not None:
+                assert isinstance(source,np.ndarray), "dtype must be given for overloaded functions"
+                dtype = source.dtype
+            elif dtype is None:
+                dtype = self._pointee_dtype()
+            if call is None:
+                return ffi_stream.ffi_stream(lambda chunk: self(chunk,len(chunk),*args),source,dtype,chunk_size,reducer,initial)
+            return ffi_stream.ffi_stream(lambda chunk: call(self,chunk),source,dtype,chunk_size,reducer,initial)
+
+        def _pointee_dtype(self):
+            typing_manager = self._lib.typing_manager
+            dtype = None
+            if len(self.sig_elements) > 1:
+                sd = typing_manager.ffi_get_sig_element_descriptor(self.sig_elements[1])
+                if sd.is_basic_type_pointer:
+                    dtype = typing_manager.ffi_basic_type_to_dtype(sd.sig_element_removed_indirection)
+                elif sd.indirection_level == 1:
+                    dtype = typing_manager.ffi_struct_dtype(sd.sig_element_removed_indirection)
+            assert dtype is not None, "dtype must be given, {} takes no buffer first".format(self.cffi_registered_name)
+            return dtype
+
+        def __call__(self, *args, out:np.ndarray=None):
+            if self._outputs is not None:
+                return self._output_plan(*args,out=out)
+            if out is not None:
+                return self.batch(*args,out=out)
+            try:
+                return self._call_plan(*args)
+            except ctypes.ArgumentError:
+                # ndarrays passed for scalar parameters are dispatched to the batch wrapper like a ufunc
+                if not any(isinstance(arg,np.ndarray) for arg in args) or self.ffi_resolve(*args)._batch_func is None:
+                    raise
+                return self.batch(*args)
     
     class FFIClassMethod(FFICallableBase):
+        kind = "class_method"
+        _fastcall_entry_type = ffi_common.FFIAccessEntryType.kClassMethodFastcall
+        _takes_object = True
         def __init__(self,cls:type,cffi_registered_name:str) -> None:
             assert not self._lib.typing_manager.ffi_is_basic_type(cls), "invalid type"
             assert cffi_registered_name.startswith(cls.cffi_registered_name), "bad class method definition"
             self.cffi_registered_name = cffi_registered_name
             entry_type = ffi_common.FFIAccessEntryType.kClassMethod
             access_entry = self._lib.ffi_find_access_entry(entry_type,self.cffi_registered_name)
-            self.sig_elements = self._lib.typing_manager.ffi_split_sig_to_element(access_entry.sig.decode("utf_8"))
-            self.ctypes_sig = [None] * len(self.sig_elements)
-            for i, sig_element in enumerate(self.sig_elements):
-                ctypes_type = self._lib.typing_manager.ffi_get_sig_element_descriptor(sig_element).ctypes_type
-                self.ctypes_sig[i] = ctypes_type
-            func_maker = ctypes.CFUNCTYPE(*self.ctypes_sig)
-            self.func = func_maker(access_entry.ptr)   
+            assert access_entry is not None, "No valid entry found"
+            self._init_callable(access_entry.sig.decode("utf_8"),access_entry.ptr)
+            self._cls = cls
+            self._init_batch()
+
+        def _init_batch(self):
+            # batch wrapper generated by FFI_REGISTER_CLASS_METHOD_BATCHED, if any
+            self._batch_func = None
+            entry_type = ffi_common.FFIAccessEntryType.kClassMethodBatch
+            batch_entry = self._lib.ffi_find_access_entry(entry_type,self.cffi_registered_name)
+            if batch_entry is None:
+                return
+            typing_manager = self._lib.typing_manager
+            ret_element = self.sig_elements[0]
+            arg_elements = self.sig_elements[2:]
+            # only methods taking and returning basic types could be batched
+            if not all(typing_manager.ffi_is_basic_type(e) for e in arg_elements + [ret_element]):
+                return
+            has_out = ret_element != "void"
+            batch_sig_elements = typing_manager.ffi_split_sig_to_element(batch_entry.sig.decode("utf_8"))
+            # R Cl::f(A,B) is batched as void f_batch(const u64* objs, const A*, const B*, R*, u64)
+            assert batch_sig_elements == ["void","c*u64"] + ["c*"+e for e in arg_elements] + (["*"+ret_element] if has_out else []) + ["u64"], \
+                "batch wrapper does not match the method signature"
+            self._batch_arg_dtypes = [typing_manager.ffi_basic_type_to_dtype(e) for e in arg_elements]
+            self._batch_ret_dtype = typing_manager.ffi_basic_type_to_dtype(ret_element) if has_out else None
+            batch_ctypes_sig = [None] + [ctypes.c_void_p] * (len(batch_sig_elements) - 2) + [ctypes.c_uint64]
+            self._batch_func = ctypes.CFUNCTYPE(*batch_ctypes_sig)(batch_entry.ptr)
+
+        def map(self, objs, *args, out:np.ndarray=None):
+            # calls the method on every object of objs in one native call, the i-th call
+            # takes the i-th element of every (broadcasted) argument array.
+            # objs could also be an arena block or an ndarray of object addresses
+            return self._map(objs,args,out)
+
+        def parallel_map(self, objs, *args, out:np.ndarray=None, chunk_size:int=None):
+            # like map, but the objects are split into chunks processed on the lib's thread pool
+            return self._map(objs,args,out,True,chunk_size)
+
+        def _map(self,objs,args,out,parallel=False,chunk_size=None):
+            assert self._batch_func is not None, "no batch wrapper available for {}".format(self.cffi_registered_name)
+            if isinstance(objs,ffi_arena.FFIArenaBlock):
+                ptrs = objs.ptrs
+            elif isinstance(objs,np.ndarray):
+                ptrs = np.ascontiguousarray(objs,dtype=np.uint64).reshape(-1)
+            else:
+                assert all(isinstance(obj,self._cls) for obj in objs), "argument type error"
+                ptrs = np.fromiter((obj._ptr for obj in objs),dtype=np.uint64,count=len(objs))
+            shape = ptrs.shape
+            arrays, _ = ffi_typing.ffi_as_batch_arrays(args,self._batch_arg_dtypes,shape)
+            if self._batch_ret_dtype is None:
+                _run_batch(self._lib,self._batch_func,[ptrs]+arrays,ptrs.size,parallel,chunk_size)
+                return None
+            out = ffi_typing.ffi_make_batch_out(out,shape,self._batch_ret_dtype)
+            _run_batch(self._lib,self._batch_func,[ptrs]+arrays+[out],ptrs.size,parallel,chunk_size)
+            return out
         
         def __call__(self, *args):
-            return super().__call__(*args,rt_convert=True)
+            return self._call_plan(*args)
+
+        def __get__(self, instance, owner):
+            # methods are bound to classes, FooClass.method gives the FFIClassMethod itself
+            # while foo.method gives a bound method
+            if instance is None:
+                return self
+            return _FFIBoundMethod(self,instance)
     
     class FFIConstructor(FFICallableBase):
+        kind = "constructor"
         def __init__(self,cls:type) -> None:
             assert not self._lib.typing_manager.ffi_is_basic_type(cls), "invalid type"
             self.cffi_registered_name = cls.cffi_registered_name + "_constructor"
             class_entry = self._lib.ffi_find_class_entry(cls.cffi_registered_name)
             assert class_entry is not None, "No valid entry found"
-            self.sig_elements = self._lib.typing_manager.ffi_split_sig_to_element(class_entry.construct_func_sig.decode("utf_8"))
-            self.ctypes_sig = [None] * len(self.sig_elements)
-            for i, sig_element in enumerate(self.sig_elements):
-                ctypes_type = self._lib.typing_manager.ffi_get_sig_element_descriptor(sig_element).ctypes_type
-                self.ctypes_sig[i] = ctypes_type
-            func_maker = ctypes.CFUNCTYPE(*self.ctypes_sig)
-            self.func = func_maker(class_entry.construct_func_ptr)
+            self._init_callable(class_entry.construct_func_sig.decode("utf_8"),class_entry.construct_func_ptr)
         
         def __call__(self, *args):
-            return super().__call__(*args)
+            # constructors return the raw cpp object pointer
+            return self._raw_call_plan(*args)
 
     class FFIDestructor(FFICallableBase):
+        kind = "destructor"
         def __init__(self,cls:type) -> None:
             assert not self._lib.typing_manager.ffi_is_basic_type(cls), "invalid type"
             self.cffi_registered_name = cls.cffi_registered_name + "_destructor"
             class_entry = self._lib.ffi_find_class_entry(cls.cffi_registered_name)
             assert class_entry is not None, "No valid entry found"
-            self.sig_elements = self._lib.typing_manager.ffi_split_sig_to_element(class_entry.destroy_func_sig.decode("utf_8"))
-            self.ctypes_sig = [None] * len(self.sig_elements)
-            for i, sig_element in enumerate(self.sig_elements):
-                ctypes_type = self._lib.typing_manager.ffi_get_sig_element_descriptor(sig_element).ctypes_type
-                self.ctypes_sig[i] = ctypes_type
-            func_maker = ctypes.CFUNCTYPE(*self.ctypes_sig)
-            self.func = func_maker(class_entry.destroy_func_ptr)
+            self._init_callable(class_entry.destroy_func_sig.decode("utf_8"),class_entry.destroy_func_ptr)
         
         def __call__(self, *args):
-            return super().__call__(*args)
+            return self._raw_call_plan(*args)
         
     return FFIGlobalFunc,FFIClassMethod,FFIConstructor,FFIDestructor
-
-
-
-
-
-#class Mult(FFIGlobalFunc):
-#    def __init__(self) -> None:
-#        super().__init__("mult")
-#    
-#    def __call__(self, *args):
-#        return super().__call__(*args)    
-#            
-#mult = Mult()
-#
-#
-#class Instant(FFIGlobalFunc):
-#    def __init__(self) -> None:
-#        super().__init__("instant")
-#    
-#    def __call__(self, *args):
-#        return super().__call__(*args)    
-#            
-#instant = Instant()
-#
-#class VoidpTester(FFIGlobalFunc):
-#    def __init__(self) -> None:
-#        super().__init__("voidptester")
-#    
-#    def __call__(self, *args):
-#        return super().__call__(*args)  
-#        
-#voidptester = VoidpTester()
-#
-#class modifyarray(FFIGlobalFunc):
-#    def __init__(self) -> None:
-#        super().__init__("modify_array")
-#    
-#    def __call__(self, *args):
-#        return super().__call__(*args)  
-#        
-#modify_array = modifyarray()
-#
-#class CstrTester(FFIGlobalFunc):
-#    def __init__(self) -> None:
-#        super().__init__("cstrtester")
-#    
-#    def __call__(self, *args):
-#        return super().__call__(*args)  
-#    
-#cstrtester = CstrTester()
-   
-
-
-
-#class fo:
-#    def __init__(self) -> None:
-#        return 
-#
-#if __name__ == "__main__":
-#   # x = voidptester()
-#    y = np.array([1,2,3,4,5],dtype=np.uint32)
-#    modify_array(y)
-#    a=1
\ No newline at end of file
@@ -1,5 +1,10 @@
+import time
 import ctypes
+import pickle
+import numpy as np
 from . import ffi_common
+from . import ffi_typing
+from . import ffi_arena
 
 
 
@@ -9,6 +14,13 @@ class FFIClassFieldDescriptor:
     _sigelement_descriptor = None
     _offset = None
     _lib = None
+    # METH_FASTCALL get/set functions of basic type fields, see ffi_fastcall
+    _fast_get = None
+    _fast_set = None
+    # dtype of fields of registered struct types, they are accessed as 0-d structured views
+    _struct_dtype = None
+    # (dtype, size(object address), readonly) of pointer fields registered with FFI_REGISTER_RETURN_BUFFER
+    _buffer = None
     def __init__(self,cls:type,cffi_registered_name:str) -> None:
         self._lib = cls._lib
         assert not self._lib.typing_manager.ffi_is_basic_type(cls), "invalid type"
@@ -18,10 +30,69 @@ class FFIClassFieldDescriptor:
         access_entry = self._lib.ffi_find_access_entry(entry_type,self.cffi_registered_name)
         self._offset = access_entry.offset
         sig_element = access_entry.sig.decode("utf_8")
-        self._sigelement_descriptor = self._lib.typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        self._struct_dtype = self._lib.typing_manager.ffi_struct_dtype(sig_element)
+        if self._struct_dtype is not None:
+            self._sigelement_descriptor = ffi_typing.SigElementDescriptor(
+                0,ctypes.c_char*self._struct_dtype.itemsize,sig_element,sig_element,False,False)
+        else:
+            self._sigelement_descriptor = self._lib.typing_manager.ffi_get_sig_element_descriptor(sig_element)
         assert ctypes.sizeof(self._sigelement_descriptor.ctypes_type) == access_entry.field_size
+        self._init_buffer(cls)
+        if self._lib.fastcall is not None and self._sigelement_descriptor.is_basic_type:
+            accessors = self._lib.fastcall.ffi_field_accessors(self.cffi_registered_name)
+            if accessors is not None:
+                self._fast_get, self._fast_set = accessors
+        self._lib._field_descriptors.add(self)
+        self.ffi_set_instrumented(self._lib.instrumentation is not None)
+
+    def _init_buffer(self,cls:type):
+        # the buffer a pointer field points to is read as an ndarray view keeping the object alive,
+        # its size is an expression of constants and the other integer fields of the class by name
+        entry = self._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kReturnBuffer,self.cffi_registered_name)
+        if entry is None:
+            return
+        assert entry.ptr is None, "buffers of fields are owned by their object"
+        typing_manager = self._lib.typing_manager
+        sd = self._sigelement_descriptor
+        dtype = None
+        if sd.indirection_level == 1:
+            if sd.is_basic_type_pointer:
+                dtype = typing_manager.ffi_basic_type_to_dtype(sd.sig_element_removed_indirection)
+            else:
+                dtype = typing_manager.ffi_struct_dtype(sd.sig_element_removed_indirection)
+        assert dtype is not None, "buffer fields must be pointers to basic types or structs"
+        namespace = {}
+        def factor(name:str):
+            if not name.isidentifier():
+                return None
+            field_entry = self._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassField,cls.cffi_registered_name+"."+name)
+            if field_entry is None:
+                return None
+            field_sd = typing_manager.ffi_get_sig_element_descriptor(field_entry.sig.decode("utf_8"))
+            if not field_sd.is_basic_type or np.dtype(field_sd.ctypes_type).kind not in "iu":
+                return None
+            namespace["_" + name] = field_sd.ctypes_type
+            return "_{}.from_address(p+{}).value".format(name,field_entry.offset)
+        size = ffi_typing.ffi_compile_size_expr(entry.sig.decode("utf_8"),factor)
+        # size expressions only consist of validated constants and field offsets
+        exec("def size(p):\n    return {}\n".format(size),namespace)
+        self._buffer = (dtype,namespace["size"],sd.is_const_pointer)
+
+    def ffi_set_instrumented(self,instrumented:bool):
+        # swaps the class of the descriptor, so accesses are only timed while instrumentation is on
+        if instrumented:
+            instrumentation = self._lib.instrumentation
+            self._get_record = instrumentation.ffi_get_stats(self.cffi_registered_name+".get","field").ffi_record
+            self._set_record = instrumentation.ffi_get_stats(self.cffi_registered_name+".set","field").ffi_record
+            self.__class__ = FFIInstrumentedClassFieldDescriptor
+        elif self._fast_get is not None:
+            self.__class__ = FFIFastcallClassFieldDescriptor
+        else:
+            self.__class__ = FFIClassFieldDescriptor
     
     def __get__(self,instance,owner):
+        if instance is None:
+            return self
         assert(isinstance(instance,self._lib.FFIClassBase))
         instance_ptr = instance._ptr
         field_ptr = instance_ptr+self._offset
@@ -29,9 +100,18 @@ class FFIClassFieldDescriptor:
         if self._sigelement_descriptor.is_basic_type:
             # get value 
             return ctypes_object.value  
+        elif self._buffer is not None:
+            addr = ctypes.c_void_p.from_address(field_ptr).value
+            if addr is None:
+                return None
+            dtype, size, readonly = self._buffer
+            return ffi_typing.ffi_ndarray_view(addr,dtype,size(instance_ptr),readonly,instance)
         elif self._sigelement_descriptor.is_basic_type_pointer:
             # return ctypes pointer
             return ctypes_object
+        elif self._struct_dtype is not None:
+            # the view keeps the object alive
+            return ffi_typing.ffi_ndarray_from_address(field_ptr,self._struct_dtype,(),instance)
         else:
             # extended type pointers
             return self._lib.typing_manager.ffi_xtype_to_mapping_entry(
@@ -40,34 +120,76 @@ class FFIClassFieldDescriptor:
 
     def __set__(self,instance,value):
         assert(isinstance(instance,self._lib.FFIClassBase))
-        assert self._sigelement_descriptor.is_basic_type, "setting pointers is prohibited"
         instance_ptr = instance._ptr
         field_ptr = instance_ptr+self._offset
+        if self._struct_dtype is not None:
+            ffi_typing.ffi_ndarray_from_address(field_ptr,self._struct_dtype,())[()] = value
+            return
+        assert self._sigelement_descriptor.is_basic_type, "setting pointers is prohibited"
         ctypes_object = self._sigelement_descriptor.ctypes_type.from_address(field_ptr)
         ctypes.pointer(ctypes_object)[0] = value
             
         
 
+class FFIFastcallClassFieldDescriptor(FFIClassFieldDescriptor):
+    # basic type fields of libs with the fast call backend, accessed by its generated get/set functions
+    def __get__(self,instance,owner):
+        if instance is None:
+            return self
+        return self._fast_get(instance._ptr)
+
+    def __set__(self,instance,value):
+        self._fast_set(instance._ptr,value)
+
+
+class FFIInstrumentedClassFieldDescriptor(FFIClassFieldDescriptor):
+    # field accesses have no separate native call, the whole access is counted as native time
+    def __get__(self,instance,owner):
+        t0 = time.perf_counter_ns()
+        r = super().__get__(instance,owner)
+        t1 = time.perf_counter_ns()
+        if instance is not None:
+            self._get_record(t0,t0,t1,t1)
+        return r
+
+    def __set__(self,instance,value):
+        t0 = time.perf_counter_ns()
+        super().__set__(instance,value)
+        t1 = time.perf_counter_ns()
+        self._set_record(t0,t0,t1,t1)
+
+
+def _unpickle(cls:type,args:tuple,data):
+    # constructs the object and writes the pickled fields into it
+    obj = cls._ffi_construct(*args)
+    obj.ffi_view()[()] = np.frombuffer(data,dtype=cls.ffi_snapshot_dtype)[0]
+    return obj
+
+
 #TODO: MOVE/COPY? IMPLEMENT THEM      
 
 def generate_classbase(lib):
-    class _Method_wrapper:
-        def __init__(self,obj,mf) -> None:
-            self.mf = mf
-            self.obj = obj
-        def __call__(self, *args):
-            return self.mf(self.obj,*args)
-            
-        
     class FFIClassBase:
+        # instances only hold the object pointer, the ownership flag and the arena block
+        # they live in (see ffi_arena). methods and fields are bound to the class in __init_subclass__.
+        # subclasses could declare __slots__ = () to drop the per-instance __dict__ as well
+        __slots__ = ("_ptr","_own","_arena_block","__weakref__")
         cffi_registered_name = None
-        _ptr:int = None
         _constructor = None
         _destructor = None
         _method_callables = None
         _fields = None
         _lib = lib
-        _own = False
+        # placement construct/destroy functions registered with FFI_REGISTER_CLASS_ARENA
+        _arena_construct = None
+        _arena_destroy = None
+        # destroy_many(const u64* objs, u64 n) registered with FFI_REGISTER_CLASS_DESTROY_MANY
+        _destroy_many = None
+        # numpy structured dtype synthesized from the registered basic type and struct fields,
+        # with the class size as itemsize
+        ffi_dtype:np.dtype = None
+        # the same fields packed without padding, the records copied by pickling and ffi_snapshot()
+        ffi_snapshot_dtype:np.dtype = None
         
         # __new__的行为：
         # 
@@ -78,27 +200,182 @@ def generate_classbase(lib):
         # use new to create only a python object
         def __new__(cls,*args):
             obj = object.__new__(cls)
-            for method_name, method_f in obj._method_callables.items():
-                bind_name:str = None
-                if hasattr(obj,method_name):
-                    bind_name = "_"+method_name
-                else:
-                    bind_name = method_name
-                setattr(obj,bind_name,_Method_wrapper(obj,method_f))
-            for field_name, fd in obj._fields.items():
-                bind_name:str = None
-                if field_name in dir(obj):
-                    bind_name = "_"+field_name
-                else:
-                    bind_name = field_name
-                setattr(cls,bind_name,fd)
+            obj._ptr = None
+            obj._own = False
+            obj._arena_block = None
             return obj
         
         @classmethod
         def create(cls):
             obj = cls.__new__(cls)
             return obj
+
+        @classmethod
+        def _ffi_construct(cls,*args):
+            # constructs the cpp object without running __init__ of subclasses: unpickled and
+            # restored objects must not repeat its side effects with placeholder arguments
+            obj = cls.__new__(cls)
+            FFIClassBase.__init__(obj,*args)
+            return obj
+
+        @classmethod
+        def ffi_create_many(cls,n:int,*args):
+            # constructs n objects contiguously from the (broadcasted) argument arrays
+            # with a single native call, inside the active arena if there is one
+            arena = cls._lib.ffi_active_arena()
+            if arena is not None:
+                return arena.ffi_create_many(cls,n,args)
+            block = ffi_arena.FFIArenaBlock(cls,n)
+            block.ffi_construct_many(args,n)
+            return block
+
+        @classmethod
+        def _init_layout(cls):
+            layout_entry = cls._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassLayout,cls.cffi_registered_name)
+            names, formats, offsets = [], [], []
+            extent = 0
+            for field_name, fd in cls._fields.items():
+                sd = fd._sigelement_descriptor
+                extent = max(extent,fd._offset+ctypes.sizeof(sd.ctypes_type))
+                # pointer fields are left out as padding
+                if fd._struct_dtype is not None:
+                    formats.append(fd._struct_dtype)
+                elif sd.is_basic_type:
+                    formats.append(cls._lib.typing_manager.ffi_basic_type_to_dtype(sd.sig_element))
+                else:
+                    continue
+                names.append(field_name)
+                offsets.append(fd._offset)
+            # libs built without layout entries only know the extent of the registered fields
+            cls._class_size = layout_entry.field_size if layout_entry is not None else None
+            cls.ffi_dtype = np.dtype({
+                "names":names,
+                "formats":formats,
+                "offsets":offsets,
+                "itemsize":cls._class_size if cls._class_size is not None else extent
+            })
+            cls.ffi_snapshot_dtype = np.dtype({"names":names,"formats":formats})
+
+        @classmethod
+        def ffi_view_array(cls,ptr:int,n:int,owner=None)->np.ndarray:
+            # zero-copy writable view of n objects laid out contiguously at ptr, e.g. a std::vector<Cl>
+            assert cls._class_size is not None, "class size unknown, rebuild the lib with the current ffi_man"
+            return ffi_typing.ffi_ndarray_from_address(ptr,cls.ffi_dtype,(n,),owner)
+
+        def ffi_view(self)->np.ndarray:
+            # zero-copy writable 0-d structured view of the cpp object, it keeps self alive
+            assert self._ptr is not None, "no cpp object"
+            return ffi_typing.ffi_ndarray_from_address(self._ptr,self.ffi_dtype,(),self)
+
+        def ffi_pickle_args(self)->tuple:
+            # constructor arguments of the object created on unpickling, its registered fields are
+            # written afterwards. zeros by default, override it for other constructors
+            return type(self)._placeholder_args()
+
+        @classmethod
+        def _placeholder_args(cls)->tuple:
+            params = cls._constructor.sig_elements[1:]
+            assert all(cls._lib.typing_manager.ffi_is_basic_type(e) for e in params), \
+                "{} takes non basic constructor arguments, they must be given".format(cls.cffi_registered_name)
+            return (0,)*len(params)
+
+        def __reduce_ex__(self,protocol):
+            # registered fields are copied into a single packed buffer, which protocol 5 pickles
+            # out-of-band (see pickle.PickleBuffer) so it is not copied into the stream
+            assert self._ptr is not None, "no cpp object"
+            data = np.empty(1,dtype=self.ffi_snapshot_dtype)
+            data[0] = self.ffi_view()[()]
+            buffer = pickle.PickleBuffer(data) if protocol >= 5 else data.tobytes()
+            # __init__ is not run on unpickling, the python attributes of the object are restored instead
+            return _unpickle, (type(self),self.ffi_pickle_args(),buffer), getattr(self,"__dict__",None) or None
+
+        @classmethod
+        def _gather(cls,objs)->np.ndarray:
+            # raw copies of the cpp objects, laid out as an array of cls.ffi_dtype
+            raw = np.empty(len(objs),dtype=cls.ffi_dtype)
+            base, size = raw.ctypes.data, cls.ffi_dtype.itemsize
+            for i, obj in enumerate(objs):
+                ctypes.memmove(base+i*size,obj._ptr,size)
+            return raw
+
+        @classmethod
+        def ffi_snapshot(cls,objs)->np.ndarray:
+            # packed copies of the registered fields of objs (an arena block or a sequence of objects),
+            # a record of ffi_snapshot_dtype per object
+            raw = objs.view() if isinstance(objs,ffi_arena.FFIArenaBlock) else cls._gather(objs)
+            out = np.empty(len(raw),dtype=cls.ffi_snapshot_dtype)
+            out[...] = raw
+            return out
+
+        @classmethod
+        def ffi_restore(cls,snapshot:np.ndarray,*args):
+            # constructs an object per record of snapshot and writes its fields into it.
+            # args are the constructor arguments broadcasted over the records, zeros by default.
+            # __init__ of subclasses is not run. returns an arena block for classes with
+            # arena functions and a list of objects otherwise
+            assert snapshot.dtype == cls.ffi_snapshot_dtype, "snapshot of another class"
+            assert snapshot.ndim == 1, "snapshot must be 1-d"
+            n = len(snapshot)
+            if len(args) == 0:
+                args = cls._placeholder_args()
+            if cls._arena_construct is not None:
+                block = cls.ffi_create_many(n,*args)
+                block.view()[...] = snapshot
+                return block
+            if all(np.ndim(arg) == 0 for arg in args):
+                objs = [cls._ffi_construct(*args) for _ in range(n)]
+            else:
+                # the i-th object takes the i-th element of every argument array, as python scalars
+                columns = [np.broadcast_to(np.asarray(arg),(n,)).tolist() for arg in args]
+                objs = [cls._ffi_construct(*row) for row in zip(*columns)]
+            # fields are written into raw copies, the unregistered bytes are written back unchanged
+            raw = cls._gather(objs)
+            raw[...] = snapshot
+            base, size = raw.ctypes.data, cls.ffi_dtype.itemsize
+            for i, obj in enumerate(objs):
+                ctypes.memmove(obj._ptr,base+i*size,size)
+            return objs
+
+        @classmethod
+        def _init_arena(cls):
+            typing_manager = cls._lib.typing_manager
+            construct_entry = cls._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassArenaConstruct,cls.cffi_registered_name)
+            destroy_entry = cls._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassArenaDestroy,cls.cffi_registered_name)
+            if construct_entry is None or destroy_entry is None:
+                return
+            # void construct_n(void* mem, const A*, const B*, u64 n)
+            construct_sig_elements = typing_manager.ffi_split_sig_to_element(construct_entry.sig.decode("utf_8"))
+            arg_elements = [e[2:] for e in construct_sig_elements[2:-1]]
+            assert construct_sig_elements == ["void","*void"] + ["c*"+e for e in arg_elements] + ["u64"], "invalid arena construct function"
+            assert all(typing_manager.ffi_is_basic_type(e) for e in arg_elements), "invalid arena construct function"
+            cls._arena_arg_dtypes = [typing_manager.ffi_basic_type_to_dtype(e) for e in arg_elements]
+            cls._arena_arg_ctypes = [typing_manager.ffi_xtype_to_mapping_entry(e).ctypes_type for e in arg_elements]
+            cls._arena_class_size = construct_entry.field_size
+            cls._arena_class_align = construct_entry.offset
+            construct_ctypes_sig = [None,ctypes.c_void_p] + [ctypes.c_void_p] * len(arg_elements) + [ctypes.c_uint64]
+            cls._arena_construct = ctypes.CFUNCTYPE(*construct_ctypes_sig)(construct_entry.ptr)
+            cls._arena_destroy = ctypes.CFUNCTYPE(None,ctypes.c_void_p,ctypes.c_uint64)(destroy_entry.ptr)
         
+        @classmethod
+        def _init_destroy_many(cls):
+            entry = cls._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassDestroyMany,cls.cffi_registered_name)
+            # classes registered without FFI_REGISTER_CLASS_DESTROY_MANY are destroyed one by one
+            if entry is None:
+                return
+            sig_elements = cls._lib.typing_manager.ffi_split_sig_to_element(entry.sig.decode("utf_8"))
+            assert sig_elements == ["void","c*u64","u64"], "invalid destroy_many function"
+            cls._destroy_many = ctypes.CFUNCTYPE(None,ctypes.c_void_p,ctypes.c_uint64)(entry.ptr)
+
+        @classmethod
+        def _ffi_destroy_ptrs(cls,ptrs:list):
+            # destroys the owned cpp objects at the addresses ptrs, with a single native call if possible
+            if cls._destroy_many is None or len(ptrs) == 1:
+                for ptr in ptrs:
+                    cls._destructor(ptr)
+                return
+            addrs = np.array(ptrs,dtype=np.uint64)
+            cls._destroy_many(addrs.ctypes.data,len(addrs))
+
         def __init_subclass__(cls) -> None:
             cffi_typestr = "*"+cls.cffi_registered_name
             cls._fields = {}
@@ -106,6 +383,9 @@ def generate_classbase(lib):
             cls._lib.typing_manager.ffi_resolve_extended_type(cffi_typestr,cls)
             cls._lib.typing_manager.ffi_set_f_python_to_ctypes(cffi_typestr,lambda x:x._ptr)
             def f_ctypes_to_python(ptr):
+                identity_map = cls._lib.identity_map
+                if identity_map is not None and ptr is not None:
+                    return identity_map.ffi_lookup(cls,ptr)
                 obj = cls.create()
                 obj._ptr = ptr
                 return obj
@@ -114,31 +394,48 @@ def generate_classbase(lib):
             # init constructor and destructor
             cls._constructor = cls._lib.FFIConstructor(cls)
             cls._destructor = cls._lib.FFIDestructor(cls)
-            # init all class methods 
-            entry_num = cls._lib.ffi_get_access_entry_num()
-            for i in range(entry_num):
-                access_entry = cls._lib.ffi_get_access_entry(i)[0]
+            cls._init_arena()
+            cls._init_destroy_many()
+            # init all class methods and fields
+            for access_entry in cls._lib.ffi_find_class_member_entries(cls.cffi_registered_name):
                 if access_entry.access_type() is ffi_common.FFIAccessEntryType.kClassMethod:
                     method_cffi_registered_name = access_entry.name.decode("utf_8")
-                    if method_cffi_registered_name.startswith(cls.cffi_registered_name):
-                        method_name = method_cffi_registered_name.split(".")[-1]
-                        cls._method_callables[method_name] = \
-                            cls._lib.FFIClassMethod(cls,method_cffi_registered_name)
-            # TODO: INIT FIELDS
+                    method_name = method_cffi_registered_name.split(".")[-1]
+                    cls._method_callables[method_name] = \
+                        cls._lib.FFIClassMethod(cls,method_cffi_registered_name)
+                    # methods are bound to the class, prefixed if the name is already taken
+                    bind_name = "_"+method_name if hasattr(cls,method_name) else method_name
+                    setattr(cls,bind_name,cls._method_callables[method_name])
                 if access_entry.access_type() is ffi_common.FFIAccessEntryType.kClassField:
                     field_cffi_registered_name = access_entry.name.decode("utf_8")
-                    if field_cffi_registered_name.startswith(cls.cffi_registered_name):
-                        field_name = field_cffi_registered_name.split(".")[-1]
-                        cls._fields[field_name] = \
-                            FFIClassFieldDescriptor(cls,field_cffi_registered_name)
+                    field_name = field_cffi_registered_name.split(".")[-1]
+                    cls._fields[field_name] = \
+                        FFIClassFieldDescriptor(cls,field_cffi_registered_name)
+                    # fields are bound to the class, prefixed if the name is already taken
+                    bind_name = "_"+field_name if hasattr(cls,field_name) else field_name
+                    setattr(cls,bind_name,cls._fields[field_name])
+            cls._init_layout()
         
         #use init to create both python object and cpp object
         def __init__(self,*args) -> None:
-            self._own = True
-            self._ptr = self._constructor(*args)
+            arena = self._lib.ffi_active_arena()
+            if arena is not None and self._arena_construct is not None:
+                # the arena owns the cpp object
+                self._arena_block, self._ptr = arena.ffi_construct(type(self),args)
+            elif self._lib.finalizer is not None:
+                # the finalizer owns the cpp object, it is destroyed after the wrapper is gone
+                self._ptr = self._constructor(*args)
+                self._lib.finalizer.ffi_track(self)
+            else:
+                self._own = True
+                self._ptr = self._constructor(*args)
+            if self._lib.identity_map is not None:
+                self._lib.identity_map.ffi_register(self)
             
         def __del__(self):
             if self._ptr is not None and self._own:
+                if self._lib.identity_map is not None:
+                    self._lib.identity_map.ffi_invalidate(type(self),self._ptr)
                 self._destructor(self._ptr)
                 
     return FFIClassBase
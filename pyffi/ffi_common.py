@@ -3,4 +3,18 @@ from enum import Enum
 class FFIAccessEntryType(Enum):
     kGlobalFunc = 1
     kClassMethod = 2
-    kClassField = 3  
\ No newline at end of file
+    kClassField = 3
+    kGlobalFuncBatch = 4
+    kClassMethodBatch = 5
+    kClassArenaConstruct = 6
+    kClassArenaDestroy = 7
+    kClassLayout = 8
+    kGlobalFuncFastcall = 9
+    kClassMethodFastcall = 10
+    kClassFieldGetFastcall = 11
+    kClassFieldSetFastcall = 12
+    kStructLayout = 13
+    kStructField = 14
+    kGlobalFuncOutput = 15
+    kClassDestroyMany = 16
+    kReturnBuffer = 17
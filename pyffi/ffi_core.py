@@ -1,8 +1,23 @@
+import os
 import ctypes
+import threading
+import weakref
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from . import ffi_common
 from . import ffi_typing
 from . import ffi_callables
 from . import ffi_classes
+from . import ffi_cache
+from . import ffi_arena
+from . import ffi_identity
+from . import ffi_async
+from . import ffi_process
+from . import ffi_instrument
+from . import ffi_trace
+from . import ffi_fastcall
+from . import ffi_pool
+from . import ffi_finalize
 
 
 class FFIAccessEntry(ctypes.Structure):
@@ -28,9 +43,54 @@ class FFIClassEntry(ctypes.Structure):
     
     
 class Lib:
-    def __init__(self,lib_path:str) -> None:
+    def __init__(self,lib_path:str,cache_dir:str=None,identity_map:bool=False,max_workers:int=None,async_workers:int=None,fastcall:bool=True,buffer_pool_bytes:int=1<<26) -> None:
+        # guards the lazily built parts of the lib, e.g. registry entries loaded from the cache
+        self._lock = threading.RLock()
+        self.lib_path = os.path.abspath(lib_path)
+        self.cache_dir = cache_dir
         self.lib = ctypes.CDLL(lib_path)
+        self._init_native_prototypes()
+        # opt-in on-disk cache of the parsed registry, see ffi_cache.FFIRegistryCache
+        self.registry_cache = None
+        cached_registry = None
+        if cache_dir is not None:
+            self.registry_cache = ffi_cache.FFIRegistryCache(cache_dir,lib_path)
+            cached_registry = self.registry_cache.ffi_load()
+        if cached_registry is not None:
+            self._load_registry_index(cached_registry)
+        else:
+            self._build_registry_index()
         self.typing_manager = ffi_typing.FFITypingManager(self)
+        # opt-in call instrumentation, see ffi_enable_instrumentation.
+        # callables and field descriptors are tracked so it could be switched on and off
+        self.instrumentation = None
+        # opt-in call recording, see ffi_start_recording
+        self.recorder = None
+        self._callables = weakref.WeakSet()
+        self._field_descriptors = weakref.WeakSet()
+        if cached_registry is not None:
+            self.typing_manager.ffi_preload_sig_elements(cached_registry["sig_elements"])
+        elif self.registry_cache is not None:
+            self.registry_cache.ffi_save(self._dump_registry_index())
+        # arena scopes are per thread
+        self._arena_local = threading.local()
+        # worker threads of parallel_map, created on first use
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self._executor = None
+        self._executor_local = threading.local()
+        # worker threads of acall, created on first use
+        self.async_workers = async_workers if async_workers is not None else self.max_workers
+        self._async_executor = None
+        # opt-in: the same cpp object always gives back the same python wrapper
+        self.identity_map = ffi_identity.FFIIdentityMap() if identity_map else None
+        # opt-in deferred destruction of owned cpp objects, see ffi_enable_deferred_destructors
+        self.finalizer = None
+        # output buffers of functions registered with FFI_REGISTER_OUTPUT_PARAM
+        self.buffer_pool = ffi_pool.FFIBufferPool(buffer_pool_bytes)
+        # METH_FASTCALL wrappers of libs built with cpp/ffi_fastcall.hpp, used instead of ctypes when present
+        self.fastcall = None
+        if fastcall and ffi_fastcall.FFIFastcallBackend.ffi_has_backend(self):
+            self.fastcall = ffi_fastcall.FFIFastcallBackend(self)
         gf,cm,ct,dt = ffi_callables.generate_callables(self)
         self.FFIGlobalFunc=gf
         self.FFIClassMethod=cm
@@ -41,47 +101,359 @@ class Lib:
         #setattr(self,"FFIClassMethod",cm)
         #setattr(self,"FFIConstructor",ct)
         #setattr(self,"FFIDestructor",dt)
-        
 
-    def ffi_get_access_entry_num(self):
+    def _init_native_prototypes(self):
+        # prototypes are set once here instead of on every call
         self.lib.ffi_get_access_entry_num.restype = ctypes.c_ulong
         self.lib.ffi_get_access_entry_num.argtypes = []
-        return self.lib.ffi_get_access_entry_num()
-
-    def ffi_get_access_entry(self,index):
         self.lib.ffi_get_access_entry.restype = ctypes.POINTER(FFIAccessEntry)
         self.lib.ffi_get_access_entry.argtypes = [ctypes.c_ulong]
+        self.lib.ffi_get_class_entry_num.restype = ctypes.c_ulong
+        self.lib.ffi_get_class_entry_num.argtypes = []
+        self.lib.ffi_get_class_entry.restype = ctypes.POINTER(FFIClassEntry)
+        self.lib.ffi_get_class_entry.argtypes = [ctypes.c_ulong]
+        # libs built with an older ffi_man.cpp have no bulk export
+        self._has_entry_tables = hasattr(self.lib,"ffi_get_access_entry_table")
+        if self._has_entry_tables:
+            self.lib.ffi_get_access_entry_table.restype = ctypes.POINTER(FFIAccessEntry)
+            self.lib.ffi_get_access_entry_table.argtypes = [ctypes.POINTER(ctypes.c_uint64)]
+            self.lib.ffi_get_class_entry_table.restype = ctypes.POINTER(FFIClassEntry)
+            self.lib.ffi_get_class_entry_table.argtypes = [ctypes.POINTER(ctypes.c_uint64)]
+
+    def _read_access_entries(self):
+        if self._has_entry_tables:
+            num = ctypes.c_uint64(0)
+            table_ptr = self.lib.ffi_get_access_entry_table(ctypes.byref(num))
+            return table_ptr[:num.value]
+        return [self.lib.ffi_get_access_entry(i)[0] for i in range(self.lib.ffi_get_access_entry_num())]
+
+    def _read_class_entries(self):
+        if self._has_entry_tables:
+            num = ctypes.c_uint64(0)
+            table_ptr = self.lib.ffi_get_class_entry_table(ctypes.byref(num))
+            return table_ptr[:num.value]
+        return [self.lib.ffi_get_class_entry(i)[0] for i in range(self.lib.ffi_get_class_entry_num())]
+
+    def _build_registry_index(self):
+        # the native tables are read only once, every later lookup is a dict hit
+        access_entries = self._read_access_entries()
+        class_entries = self._read_class_entries()
+        self._access_entry_num = len(access_entries)
+        self._class_entry_num = len(class_entries)
+        # entry type value -> {registered name -> access entry}, the first entry registered under the name
+        self._access_entry_index = {t.value:{} for t in ffi_common.FFIAccessEntryType}
+        # entry type value -> {registered name -> [access entries]}, only names registered more than once
+        self._access_entry_overloads = {t.value:{} for t in ffi_common.FFIAccessEntryType}
+        # registered class/struct name -> [(entry type value, registered name)] of its methods and fields,
+        # in registration order
+        self._class_member_index = {}
+        class_member_types = (
+            ffi_common.FFIAccessEntryType.kClassMethod.value,
+            ffi_common.FFIAccessEntryType.kClassField.value,
+            ffi_common.FFIAccessEntryType.kStructField.value
+        )
+        for entry in access_entries:
+            entry_name = entry.name.decode("utf_8")
+            first = self._access_entry_index[entry.type].setdefault(entry_name,entry)
+            if first is not entry:
+                self._access_entry_overloads[entry.type].setdefault(entry_name,[first]).append(entry)
+                continue
+            if entry.type in class_member_types:
+                class_name = entry_name.split(".")[0]
+                self._class_member_index.setdefault(class_name,[]).append((entry.type,entry_name))
+        # registered class name -> class entry
+        self._class_entry_index = {}
+        for entry in class_entries:
+            self._class_entry_index[entry.class_namestr.decode("utf_8")] = entry
+
+    def _base_address(self):
+        # function addresses are cached relative to an exported symbol of the lib,
+        # so they stay valid wherever the lib gets loaded
+        return ctypes.cast(self.lib.ffi_get_manager_instance,ctypes.c_void_p).value
+
+    def _dump_registry_index(self):
+        # the cache stores the index itself, entries are kept as plain rows
+        base = self._base_address()
+        def rel(ptr):
+            return None if ptr is None else ptr - base
+        sigs = set()
+        access_entry_index = {}
+        # entries whose sig is a type string instead of a function signature
+        non_function_types = (
+            ffi_common.FFIAccessEntryType.kClassField.value,
+            ffi_common.FFIAccessEntryType.kClassLayout.value,
+            ffi_common.FFIAccessEntryType.kClassFieldGetFastcall.value,
+            ffi_common.FFIAccessEntryType.kClassFieldSetFastcall.value,
+            ffi_common.FFIAccessEntryType.kStructLayout.value,
+            ffi_common.FFIAccessEntryType.kStructField.value,
+            ffi_common.FFIAccessEntryType.kGlobalFuncOutput.value,
+            ffi_common.FFIAccessEntryType.kReturnBuffer.value
+        )
+        for entry_type, entries in self._access_entry_index.items():
+            rows = {}
+            for name, e in entries.items():
+                sig = e.sig.decode("utf_8")
+                if entry_type not in non_function_types:
+                    sigs.add(sig)
+                rows[name] = [rel(e.ptr),sig,e.offset,e.field_size]
+            access_entry_index[str(entry_type)] = rows
+        access_entry_overloads = {}
+        for entry_type, entries in self._access_entry_overloads.items():
+            overload_rows = {}
+            for name, overloads in entries.items():
+                if entry_type not in non_function_types:
+                    sigs.update(e.sig.decode("utf_8") for e in overloads)
+                overload_rows[name] = [[rel(e.ptr),e.sig.decode("utf_8"),e.offset,e.field_size] for e in overloads]
+            access_entry_overloads[str(entry_type)] = overload_rows
+        class_entry_index = {}
+        for name, e in self._class_entry_index.items():
+            construct_func_sig = e.construct_func_sig.decode("utf_8")
+            destroy_func_sig = e.destroy_func_sig.decode("utf_8")
+            sigs.add(construct_func_sig)
+            sigs.add(destroy_func_sig)
+            class_entry_index[name] = [rel(e.construct_func_ptr),construct_func_sig,rel(e.destroy_func_ptr),destroy_func_sig]
+        return {
+            "access_entry_num":self._access_entry_num,
+            "class_entry_num":self._class_entry_num,
+            "access_entry_index":access_entry_index,
+            "access_entry_overloads":access_entry_overloads,
+            "class_member_index":self._class_member_index,
+            "class_entry_index":class_entry_index,
+            "sig_elements":{sig:self.typing_manager.ffi_split_sig_to_element(sig) for sig in sigs}
+        }
+
+    def _load_registry_index(self,registry:dict):
+        # entries are left as cached rows here, ffi_find_*_entry turns them into
+        # FFIAccessEntry/FFIClassEntry on first lookup
+        self._base = self._base_address()
+        self._access_entry_num = registry["access_entry_num"]
+        self._class_entry_num = registry["class_entry_num"]
+        self._access_entry_index = {t.value:{} for t in ffi_common.FFIAccessEntryType}
+        for t, rows in registry["access_entry_index"].items():
+            self._access_entry_index[int(t)] = rows
+        self._access_entry_overloads = {t.value:{} for t in ffi_common.FFIAccessEntryType}
+        for t, overload_rows in registry["access_entry_overloads"].items():
+            self._access_entry_overloads[int(t)] = overload_rows
+        self._class_member_index = registry["class_member_index"]
+        self._class_entry_index = registry["class_entry_index"]
+
+    def _access_entry_from_row(self,entry_type:int,name:str,row:list):
+        ptr,sig,offset,field_size = row
+        return FFIAccessEntry(
+            type=entry_type,
+            ptr=None if ptr is None else ptr + self._base,
+            name=name.encode("utf_8"),
+            sig=sig.encode("utf_8"),
+            offset=offset,
+            field_size=field_size
+        )
+
+    def _class_entry_from_row(self,name:str,row:list):
+        construct_func_ptr,construct_func_sig,destroy_func_ptr,destroy_func_sig = row
+        return FFIClassEntry(
+            class_namestr=name.encode("utf_8"),
+            construct_func_ptr=construct_func_ptr + self._base,
+            construct_func_sig=construct_func_sig.encode("utf_8"),
+            destroy_func_ptr=destroy_func_ptr + self._base,
+            destroy_func_sig=destroy_func_sig.encode("utf_8")
+        )
+
+    def ffi_get_access_entry_num(self):
+        return self._access_entry_num
+
+    def ffi_get_access_entry(self,index):
         return self.lib.ffi_get_access_entry(index)
 
     def ffi_find_access_entry(self,entry_type:ffi_common.FFIAccessEntryType, cffi_registered_name:str)->FFIAccessEntry:
-        entry_count = self.ffi_get_access_entry_num()
-        for i in range(entry_count):
-            entry = self.ffi_get_access_entry(i)[0]
-            if entry.access_type() is not entry_type:
-                continue
-            entry_name = entry.name.decode("utf_8")
-            if entry_name == cffi_registered_name:
-                return entry
-        return None
+        entries = self._access_entry_index[entry_type.value]
+        entry = entries.get(cffi_registered_name)
+        if isinstance(entry,list):
+            with self._lock:
+                entry = entries[cffi_registered_name]
+                if isinstance(entry,list):
+                    entry = self._access_entry_from_row(entry_type.value,cffi_registered_name,entry)
+                    entries[cffi_registered_name] = entry
+        return entry
+
+    def ffi_find_access_entries(self,entry_type:ffi_common.FFIAccessEntryType, cffi_registered_name:str)->list:
+        # all entries registered as cffi_registered_name, in registration order
+        overloads = self._access_entry_overloads[entry_type.value].get(cffi_registered_name)
+        if overloads is None:
+            entry = self.ffi_find_access_entry(entry_type,cffi_registered_name)
+            return [] if entry is None else [entry]
+        if isinstance(overloads[-1],list):
+            with self._lock:
+                overloads = self._access_entry_overloads[entry_type.value][cffi_registered_name]
+                if isinstance(overloads[-1],list):
+                    overloads = [
+                        e if isinstance(e,FFIAccessEntry) else self._access_entry_from_row(entry_type.value,cffi_registered_name,e)
+                        for e in overloads
+                    ]
+                    self._access_entry_overloads[entry_type.value][cffi_registered_name] = overloads
+        return list(overloads)
+
+    def ffi_find_class_member_entries(self,class_registered_name:str):
+        # all class method and field entries registered as class_registered_name.xxx
+        return [
+            self.ffi_find_access_entry(ffi_common.FFIAccessEntryType(entry_type),name)
+            for entry_type,name in self._class_member_index.get(class_registered_name,[])
+        ]
+
+    def ffi_find_struct_field_entries(self,struct_registered_name:str):
+        # all field entries registered as struct_registered_name.xxx, in registration order
+        return [
+            self.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kStructField,name)
+            for entry_type,name in self._class_member_index.get(struct_registered_name,[])
+            if entry_type == ffi_common.FFIAccessEntryType.kStructField.value
+        ]
+
+    def ffi_get_struct_names(self):
+        return list(self._access_entry_index[ffi_common.FFIAccessEntryType.kStructLayout.value].keys())
+
+    def ffi_struct_dtype(self,struct_registered_name:str):
+        # numpy structured dtype of a struct registered with FFI_REGISTER_STRUCT
+        dtype = self.typing_manager.ffi_struct_dtype(struct_registered_name)
+        assert dtype is not None, "{} is not a registered struct".format(struct_registered_name)
+        return dtype
+
+    def ffi_struct_array(self,struct_registered_name:str,ptr,n:int,owner=None):
+        # zero-copy writable view of n structs at ptr, an address or an array returned for a *struct.
+        # the view does not own the memory, owner (by default the array ptr) is kept alive with it
+        dtype = self.ffi_struct_dtype(struct_registered_name)
+        if isinstance(ptr,np.ndarray):
+            assert ptr.dtype == dtype, "array of another type"
+            ptr, owner = ptr.ctypes.data, ptr if owner is None else owner
+        assert ptr is not None, "null pointer"
+        return ffi_typing.ffi_ndarray_from_address(ptr,dtype,(n,),owner)
         
     def ffi_get_class_entry_num(self):
-        self.lib.ffi_get_class_entry_num.restype = ctypes.c_ulong
-        self.lib.ffi_get_class_entry_num.argtypes = []
-        return self.lib.ffi_get_class_entry_num()
+        return self._class_entry_num
 
     def ffi_get_class_entry(self,index):
-        self.lib.ffi_get_class_entry.restype = ctypes.POINTER(FFIClassEntry)
-        self.lib.ffi_get_class_entry.argtypes = [ctypes.c_ulong]
         return self.lib.ffi_get_class_entry(index)
 
+    def ffi_get_class_names(self):
+        return list(self._class_entry_index.keys())
+
     def ffi_find_class_entry(self,cffi_registered_name:str):
-        entry_count = self.ffi_get_class_entry_num()
-        for i in range(entry_count):
-            entry = self.ffi_get_class_entry(i)[0]
-            class_name = entry.class_namestr.decode("utf_8")
-            if class_name == cffi_registered_name:
-                return entry
-        return None
+        entry = self._class_entry_index.get(cffi_registered_name)
+        if isinstance(entry,list):
+            with self._lock:
+                entry = self._class_entry_index[cffi_registered_name]
+                if isinstance(entry,list):
+                    entry = self._class_entry_from_row(cffi_registered_name,entry)
+                    self._class_entry_index[cffi_registered_name] = entry
+        return entry
+
+    def arena(self,chunk_size:int=1024)->ffi_arena.FFIArena:
+        return ffi_arena.FFIArena(self,chunk_size)
+
+    @property
+    def _arena_stack(self)->list:
+        stack = getattr(self._arena_local,"stack",None)
+        if stack is None:
+            stack = self._arena_local.stack = []
+        return stack
+
+    def process_pool(self,funcs=(),processes:int=None,mp_context=None)->ffi_process.FFIProcessPool:
+        return ffi_process.FFIProcessPool(self,funcs,processes,mp_context)
+
+    def ffi_active_arena(self)->ffi_arena.FFIArena:
+        stack = self._arena_stack
+        return stack[-1] if len(stack) != 0 else None
+
+    def _init_executor_thread(self):
+        self._executor_local.is_worker = True
+
+    def ffi_executor(self)->ThreadPoolExecutor:
+        # thread pool shared by all callables of the lib
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="pyffi",
+                        initializer=self._init_executor_thread
+                    )
+        return self._executor
+
+    def ffi_async_executor(self)->ffi_async.FFIAsyncExecutor:
+        # separate from ffi_executor, so long running awaited calls never hold up parallel_map chunks
+        if self._async_executor is None:
+            with self._lock:
+                if self._async_executor is None:
+                    self._async_executor = ffi_async.FFIAsyncExecutor(self.async_workers)
+        return self._async_executor
+
+    def ffi_in_executor(self)->bool:
+        # work submitted from inside the pool and waited on could deadlock it
+        return getattr(self._executor_local,"is_worker",False)
+
+    def ffi_enable_instrumentation(self,max_samples:int=4096)->ffi_instrument.FFIInstrumentation:
+        # call plans of all callables are rebuilt with timing, the plans used while
+        # instrumentation is off are not touched by it at all
+        with self._lock:
+            if self.instrumentation is None:
+                self.instrumentation = ffi_instrument.FFIInstrumentation(max_samples)
+                self._set_instrumented(True)
+            return self.instrumentation
+
+    def ffi_disable_instrumentation(self):
+        with self._lock:
+            if self.instrumentation is not None:
+                self.instrumentation = None
+                self._set_instrumented(False)
+
+    def _set_instrumented(self,instrumented:bool):
+        for ffi_callable in list(self._callables):
+            ffi_callable._build_call_plans()
+        for field_descriptor in list(self._field_descriptors):
+            field_descriptor.ffi_set_instrumented(instrumented)
+
+    def ffi_start_recording(self,path:str,max_array_bytes:int=1<<16,sample_size:int=1024)->ffi_trace.FFITraceRecorder:
+        # calls of global functions, class methods, constructors and destructors are written to the trace
+        # at path until ffi_stop_recording, replay it with python -m pyffi.ffi_replay, see ffi_trace
+        with self._lock:
+            assert self.recorder is None, "already recording"
+            self.recorder = ffi_trace.FFITraceRecorder(path,self,max_array_bytes,sample_size)
+            for ffi_callable in list(self._callables):
+                ffi_callable._build_call_plans()
+            return self.recorder
+
+    def ffi_stop_recording(self)->dict:
+        # completes the trace, returns the stats of the recording
+        with self._lock:
+            assert self.recorder is not None, "not recording"
+            recorder, self.recorder = self.recorder, None
+            for ffi_callable in list(self._callables):
+                ffi_callable._build_call_plans()
+            recorder.close()
+            return recorder.ffi_stats()
+
+    def ffi_enable_deferred_destructors(self,flush_threshold:int=1024,flush_interval:float=None)->ffi_finalize.FFIDeferredFinalizer:
+        # objects constructed from now on are destroyed in batches instead of in __del__,
+        # see ffi_finalize.FFIDeferredFinalizer. it could not be switched off again
+        with self._lock:
+            if self.finalizer is None:
+                self.finalizer = ffi_finalize.FFIDeferredFinalizer(flush_threshold,flush_interval)
+            return self.finalizer
+
+    def flush_destructors(self)->int:
+        # destroys all queued objects now, returns their number
+        if self.finalizer is None:
+            return 0
+        return self.finalizer.flush()
+
+    def ffi_finalizer_stats(self)->dict:
+        assert self.finalizer is not None, "deferred destructors are not enabled"
+        return self.finalizer.ffi_stats()
+
+    def ffi_buffer_pool_stats(self)->dict:
+        return self.buffer_pool.ffi_stats()
+
+    def ffi_instrumentation_report(self)->dict:
+        assert self.instrumentation is not None, "instrumentation is not enabled"
+        return self.instrumentation.ffi_report()
 
     def ffi_print_all_entries(self):
         self.lib.ffi_print_all_entries()
@@ -0,0 +1,99 @@
+import os
+import ctypes
+import types
+from . import ffi_common
+
+
+# METH_FASTCALL from methodobject.h
+_METH_FASTCALL = 0x0080
+
+
+class PyMethodDef(ctypes.Structure):
+    _fields_ = [
+        ("ml_name",ctypes.c_char_p),
+        ("ml_meth",ctypes.c_void_p),
+        ("ml_flags",ctypes.c_int),
+        ("ml_doc",ctypes.c_char_p)
+    ]
+
+
+_pycfunction_new = ctypes.pythonapi.PyCFunction_NewEx
+_pycfunction_new.restype = ctypes.py_object
+_pycfunction_new.argtypes = [ctypes.POINTER(PyMethodDef),ctypes.py_object,ctypes.py_object]
+
+# builtin functions only point to their PyMethodDef, which therefore must never be freed.
+# definitions are shared by every Lib of the same lib: (wrapper address, name) -> PyMethodDef
+_method_defs = {}
+
+# ctypes types the generated wrappers convert exactly like ctypes does, see cpp/siggen/fastcall_helper.hpp.
+# basic type pointer results are ctypes pointer objects, functions returning them stay on ctypes
+_supported_ctypes_types = frozenset([
+    None,ctypes.c_void_p,ctypes.c_char_p,
+    ctypes.c_int8,ctypes.c_uint8,ctypes.c_int16,ctypes.c_uint16,ctypes.c_int32,ctypes.c_uint32,
+    ctypes.c_int64,ctypes.c_uint64,ctypes.c_float,ctypes.c_double
+])
+
+
+def _method_def(name:str,ptr:int,doc:str)->PyMethodDef:
+    key = (ptr,name)
+    method_def = _method_defs.get(key)
+    if method_def is None:
+        method_def = _method_defs.setdefault(key,PyMethodDef(name.encode("utf_8"),ptr,_METH_FASTCALL,doc.encode("utf_8")))
+    return method_def
+
+
+class FFIFastcallBackend:
+    # METH_FASTCALL wrappers registered by libs built with cpp/ffi_fastcall.hpp.
+    # they are plain builtin functions, calling them skips ctypes' argument and result handling
+    def __init__(self,lib) -> None:
+        self._lib = lib
+        self._module = None
+
+    @staticmethod
+    def ffi_has_backend(lib)->bool:
+        return any(len(lib._access_entry_index[t.value]) != 0 for t in (
+            ffi_common.FFIAccessEntryType.kGlobalFuncFastcall,
+            ffi_common.FFIAccessEntryType.kClassMethodFastcall,
+            ffi_common.FFIAccessEntryType.kClassFieldGetFastcall
+        ))
+
+    def _new_function(self,entry,self_object):
+        return _pycfunction_new(_method_def(entry.name.decode("utf_8"),entry.ptr,entry.sig.decode("utf_8")),self_object,None)
+
+    def ffi_function(self,entry_type:ffi_common.FFIAccessEntryType,cffi_registered_name:str,sig:str,ctypes_sig,release_gil:bool=True):
+        # builtin function calling the wrapper of cffi_registered_name (of the overload with signature sig)
+        # with the gil policy release_gil, None if there is no wrapper or its conversions would differ
+        # from ctypes for ctypes_sig
+        if not all(t in _supported_ctypes_types for t in ctypes_sig):
+            return None
+        for entry in self._lib.ffi_find_access_entries(entry_type,cffi_registered_name):
+            if entry.sig.decode("utf_8") == sig:
+                return self._new_function(entry,(ctypes.ArgumentError,release_gil))
+        return None
+
+    def ffi_field_accessors(self,cffi_registered_name:str):
+        # (get(ptr), set(ptr, value)) builtin functions of a basic type field, or None
+        get_entry = self._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassFieldGetFastcall,cffi_registered_name)
+        set_entry = self._lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kClassFieldSetFastcall,cffi_registered_name)
+        if get_entry is None or set_entry is None:
+            return None
+        return self._new_function(get_entry,None), self._new_function(set_entry,None)
+
+    @property
+    def module(self)->types.ModuleType:
+        # module of all wrappers by registered name, e.g. getattr(module, "fooclass.double_speed").
+        # functions take and return raw values: objects are passed as addresses and strings as bytes
+        if self._module is None:
+            lib_name = os.path.basename(self._lib.lib_path).split(".")[0]
+            module = types.ModuleType("pyffi_fastcall_{}".format(lib_name))
+            for entry_type in (ffi_common.FFIAccessEntryType.kGlobalFuncFastcall,ffi_common.FFIAccessEntryType.kClassMethodFastcall):
+                for name in list(self._lib._access_entry_index[entry_type.value]):
+                    entry = self._lib.ffi_find_access_entry(entry_type,name)
+                    setattr(module,name,self._new_function(entry,(ctypes.ArgumentError,True)))
+            for name in list(self._lib._access_entry_index[ffi_common.FFIAccessEntryType.kClassFieldGetFastcall.value]):
+                accessors = self.ffi_field_accessors(name)
+                if accessors is not None:
+                    setattr(module,name+".get",accessors[0])
+                    setattr(module,name+".set",accessors[1])
+            self._module = module
+        return self._module
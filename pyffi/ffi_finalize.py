@@ -0,0 +1,130 @@
+import time
+import atexit
+import weakref
+import threading
+from collections import deque
+import numpy as np
+
+
+class _TrackedRef(weakref.ref):
+    # weak reference carrying the class and address of the tracked object, so tracking allocates
+    # a single gc tracked object
+    __slots__ = ("cls","ptr")
+
+
+class FFIDeferredFinalizer:
+    # opt-in replacement of the destructor call in FFIClassBase.__del__, see Lib.ffi_enable_deferred_destructors.
+    # owning wrappers are tracked with weak references whose callback queues them, so a dying wrapper
+    # costs no native call inside gc pauses or refcount drops until the queue is full.
+    # the queue is drained in bulk, one destroy_many call per class: when flush_threshold objects
+    # are queued (checked when objects are tracked and queued), every flush_interval seconds from a background
+    # thread, by flush() and at interpreter exit. drain latencies are kept over the last max_samples flushes
+    def __init__(self,flush_threshold:int=1024,flush_interval:float=None,max_samples:int=1024) -> None:
+        self.flush_threshold = flush_threshold
+        self.flush_interval = flush_interval
+        # id(weak reference) -> weak reference of the tracked objects
+        self._tracked = {}
+        # weak references of dead objects, appended by the weakref machinery itself
+        self._dead = deque()
+        # reentrant, a flush could run from a weak reference callback inside a gc pause of a flush
+        self._lock = threading.RLock()
+        self.max_queue_length = 0
+        self.flushes = 0
+        self.destroyed = 0
+        self.drain_ns = 0
+        self.max_drain_ns = 0
+        self._samples = np.zeros(max_samples,dtype=np.int64)
+        self._thread = None
+        self._stop = threading.Event()
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run,name="pyffi_finalizer",daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def ffi_track(self,obj):
+        # the cpp object of obj is destroyed after obj is gone
+        # without a threshold the append of the queue is the callback, which costs no python frame
+        ref = _TrackedRef(obj,self._dead.append if self.flush_threshold is None else self._queue)
+        ref.cls = type(obj)
+        ref.ptr = obj._ptr
+        self._tracked[id(ref)] = ref
+        if self.flush_threshold is not None and len(self._dead) >= self.flush_threshold:
+            self.flush()
+
+    def _queue(self,ref):
+        dead = self._dead
+        dead.append(ref)
+        if len(dead) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self)->int:
+        # destroys every queued object, returns their number.
+        # popping is atomic, concurrent flushes destroy disjoint objects
+        t0 = time.perf_counter_ns()
+        dead = self._dead
+        refs = []
+        try:
+            for _ in range(len(dead)):
+                refs.append(dead.popleft())
+        except IndexError:
+            # drained by a concurrent flush meanwhile
+            pass
+        tracked = self._tracked
+        queues = {}
+        for ref in refs:
+            del tracked[id(ref)]
+            queue = queues.get(ref.cls)
+            if queue is None:
+                queue = queues[ref.cls] = []
+            queue.append(ref.ptr)
+        n = 0
+        for cls, ptrs in queues.items():
+            identity_map = cls._lib.identity_map
+            if identity_map is not None:
+                # non-owning wrappers of the objects must not be handed out anymore
+                for ptr in ptrs:
+                    identity_map.ffi_invalidate(cls,ptr)
+            cls._ffi_destroy_ptrs(ptrs)
+            n += len(ptrs)
+        if n == 0:
+            return 0
+        dt = time.perf_counter_ns()-t0
+        with self._lock:
+            self._samples[self.flushes % len(self._samples)] = dt
+            self.flushes += 1
+            self.destroyed += n
+            self.drain_ns += dt
+            self.max_drain_ns = max(self.max_drain_ns,dt)
+            self.max_queue_length = max(self.max_queue_length,n)
+        return n
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        # stops the background thread and drains the queue, objects still alive are not destroyed (like with __del__)
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def __len__(self):
+        return len(self._dead)
+
+    def ffi_stats(self)->dict:
+        with self._lock:
+            samples = self._samples[:min(self.flushes,len(self._samples))]
+            p50, p99 = np.percentile(samples,[50,99]) if len(samples) != 0 else (0.0,0.0)
+            return {
+                "queue_length":len(self._dead),
+                "tracked":len(self._tracked)-len(self._dead),
+                "max_queue_length":self.max_queue_length,
+                "flushes":self.flushes,
+                "destroyed":self.destroyed,
+                "drain_ns":self.drain_ns,
+                "mean_drain_ns":self.drain_ns/self.flushes if self.flushes != 0 else 0.0,
+                "p50_drain_ns":float(p50),
+                "p99_drain_ns":float(p99),
+                "max_drain_ns":self.max_drain_ns
+            }
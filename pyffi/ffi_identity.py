@@ -0,0 +1,80 @@
+import weakref
+import threading
+
+
+class FFIIdentityMap:
+    # maps (class, address) to the live python wrapper of that cpp object, so that
+    # pointers returned from cpp give back the same wrapper instead of a new one per call.
+    # wrappers are only weakly referenced: a wrapper no one holds is dropped from the map
+    def __init__(self) -> None:
+        # class -> {address: wrapper}
+        self._maps = {}
+        # lookups and inserts must be atomic, or two threads could create two wrappers of one object.
+        # reentrant since a collection inside a lookup could run the __del__ of another wrapper
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _class_map(self,cls:type)->weakref.WeakValueDictionary:
+        class_map = self._maps.get(cls)
+        if class_map is None:
+            class_map = self._maps[cls] = weakref.WeakValueDictionary()
+        return class_map
+
+    def ffi_lookup(self,cls:type,ptr:int):
+        # returns the wrapper of the cpp object at ptr, a new non-owning one if there is none
+        with self._lock:
+            class_map = self._class_map(cls)
+            obj = class_map.get(ptr)
+            if obj is not None:
+                self.hits += 1
+                return obj
+            self.misses += 1
+            obj = cls.create()
+            obj._ptr = ptr
+            class_map[ptr] = obj
+            return obj
+
+    def ffi_register(self,obj):
+        # called for wrappers constructed from python, later lookups of their address return them
+        with self._lock:
+            self._class_map(type(obj))[obj._ptr] = obj
+
+    def ffi_invalidate(self,cls:type,ptr:int):
+        # the cpp object at ptr has been destroyed
+        with self._lock:
+            class_map = self._maps.get(cls)
+            if class_map is not None and class_map.pop(ptr,None) is not None:
+                self.invalidations += 1
+
+    def ffi_invalidate_range(self,cls:type,begin:int,end:int):
+        # all cpp objects of cls in [begin,end) have been destroyed, e.g. an arena block
+        with self._lock:
+            class_map = self._maps.get(cls)
+            if class_map is None:
+                return
+            for ptr in [p for p in class_map.keys() if begin <= p < end]:
+                if class_map.pop(ptr,None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._maps = {}
+
+    def __len__(self):
+        return sum(len(m) for m in self._maps.values())
+
+    @property
+    def hit_rate(self)->float:
+        total = self.hits+self.misses
+        return self.hits/total if total != 0 else 0.0
+
+    def ffi_stats(self)->dict:
+        return {
+            "size":len(self),
+            "hits":self.hits,
+            "misses":self.misses,
+            "invalidations":self.invalidations,
+            "hit_rate":self.hit_rate
+        }
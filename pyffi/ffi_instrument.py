@@ -0,0 +1,77 @@
+import json
+import threading
+import numpy as np
+
+
+class FFICallStats:
+    # counters of one callable. every call is split into marshalling (argument conversion),
+    # native (the ctypes call itself, including the cpp function) and return conversion.
+    # latency percentiles are computed over the last max_samples calls
+    def __init__(self,name:str,kind:str,max_samples:int) -> None:
+        self.name = name
+        self.kind = kind
+        self.count = 0
+        self.total_ns = 0
+        self.marshal_ns = 0
+        self.native_ns = 0
+        self.return_ns = 0
+        self._samples = np.zeros(max_samples,dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def ffi_record(self,t0:int,t1:int,t2:int,t3:int):
+        total = t3-t0
+        with self._lock:
+            self._samples[self.count % len(self._samples)] = total
+            self.count += 1
+            self.total_ns += total
+            self.marshal_ns += t1-t0
+            self.native_ns += t2-t1
+            self.return_ns += t3-t2
+
+    def ffi_summary(self)->dict:
+        with self._lock:
+            samples = self._samples[:min(self.count,len(self._samples))]
+            p50, p90, p99 = np.percentile(samples,[50,90,99]) if len(samples) != 0 else (0.0,0.0,0.0)
+            return {
+                "kind":self.kind,
+                "count":self.count,
+                "total_ns":self.total_ns,
+                "mean_ns":self.total_ns/self.count if self.count != 0 else 0.0,
+                "p50_ns":float(p50),
+                "p90_ns":float(p90),
+                "p99_ns":float(p99),
+                "marshal_ns":self.marshal_ns,
+                "native_ns":self.native_ns,
+                "return_ns":self.return_ns
+            }
+
+
+class FFIInstrumentation:
+    # per Lib collection of FFICallStats, see Lib.ffi_enable_instrumentation
+    def __init__(self,max_samples:int=4096) -> None:
+        self.max_samples = max_samples
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def ffi_get_stats(self,name:str,kind:str)->FFICallStats:
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = FFICallStats(name,kind,self.max_samples)
+            return stats
+
+    def ffi_report(self)->dict:
+        with self._lock:
+            stats = list(self._stats.values())
+        return {s.name:s.ffi_summary() for s in stats if s.count != 0}
+
+    def ffi_to_json(self,path:str=None)->str:
+        report = json.dumps(self.ffi_report(),indent=2)
+        if path is not None:
+            with open(path,"w") as f:
+                f.write(report)
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
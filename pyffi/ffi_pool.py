@@ -0,0 +1,118 @@
+import functools
+import threading
+import numpy as np
+from . import ffi_typing
+
+
+def _release(entry:list,addr:int):
+    # called once the last array referring to the buffer of entry is gone, see ffi_typing.ffi_ndarray_view.
+    # it could run from the garbage collector inside ffi_acquire, so it does not take the pool's lock
+    entry[2] = False
+
+
+class FFIBufferPool:
+    # per Lib pool of the output buffers of functions registered with FFI_REGISTER_OUTPUT_PARAM.
+    # buffers are bucketed by their size rounded up to a power of two bytes and handed out as
+    # arrays over a release handle, a buffer is reused once the handle is gone, i.e. when no
+    # array (or view of one) handed out for it is alive anymore.
+    # when a new buffer would exceed max_bytes, free buffers are evicted least recently used first.
+    # buffers larger than max_buffer_bytes are never pooled
+    def __init__(self,max_bytes:int=1<<26,max_buffer_bytes:int=1<<24,min_buffer_bytes:int=64) -> None:
+        self.max_bytes = max_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        self.min_buffer_bytes = min_buffer_bytes
+        # bucket size in bytes -> [[buffer, last use, in use, address]]
+        self._buckets = {}
+        self._tick = 0
+        self.pooled_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.unpooled = 0
+        self._lock = threading.Lock()
+
+    def ffi_acquire(self,dtype:np.dtype,n:int)->np.ndarray:
+        # uninitialized 1-d array of n elements of dtype, backed by a pooled buffer when possible
+        nbytes = n*dtype.itemsize
+        if nbytes > self.max_buffer_bytes:
+            with self._lock:
+                self.unpooled += 1
+            return np.empty(n,dtype=dtype)
+        # buckets are powers of two
+        size = 1<<(nbytes-1).bit_length() if nbytes > self.min_buffer_bytes else self.min_buffer_bytes
+        with self._lock:
+            self._tick += 1
+            bucket = self._buckets.get(size)
+            if bucket is None:
+                bucket = self._buckets[size] = []
+            for entry in bucket:
+                if not entry[2]:
+                    entry[1] = self._tick
+                    self.hits += 1
+                    return self._hand_out(entry,dtype,n)
+            self.misses += 1
+            buffer = np.empty(size,dtype=np.uint8)
+            if self._evict(size):
+                entry = [buffer,self._tick,False,buffer.ctypes.data]
+                bucket.append(entry)
+                self.pooled_bytes += size
+                return self._hand_out(entry,dtype,n)
+            # every pooled buffer is in use
+            self.unpooled += 1
+        return np.frombuffer(buffer,dtype,n)
+
+    def _hand_out(self,entry:list,dtype:np.dtype,n:int)->np.ndarray:
+        entry[2] = True
+        return ffi_typing.ffi_ndarray_view(entry[3],dtype,n,False,entry[0],functools.partial(_release,entry))
+
+    def _evict(self,nbytes:int)->bool:
+        # drops free buffers until nbytes more fit into max_bytes, False if they could not
+        if self.pooled_bytes+nbytes <= self.max_bytes:
+            return True
+        free = []
+        for size, bucket in self._buckets.items():
+            for entry in bucket:
+                if not entry[2]:
+                    free.append((entry[1],size,entry))
+        free.sort(key=lambda f: f[0])
+        evicted = set()
+        for _, size, entry in free:
+            if self.pooled_bytes+nbytes <= self.max_bytes:
+                break
+            evicted.add(id(entry))
+            self.pooled_bytes -= size
+            self.evictions += 1
+        # entries hold arrays, they are removed by identity
+        for size, bucket in self._buckets.items():
+            bucket[:] = [entry for entry in bucket if id(entry) not in evicted]
+        return self.pooled_bytes+nbytes <= self.max_bytes
+
+    def clear(self):
+        # drops every free buffer, buffers in use stay pooled
+        with self._lock:
+            for size, bucket in self._buckets.items():
+                in_use = [entry for entry in bucket if entry[2]]
+                self.pooled_bytes -= size*(len(bucket)-len(in_use))
+                bucket[:] = in_use
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.unpooled = 0
+
+    def ffi_stats(self)->dict:
+        with self._lock:
+            requests = self.hits+self.misses
+            buckets = {
+                size:{"buffers":len(bucket),"in_use":sum(1 for entry in bucket if entry[2])}
+                for size, bucket in sorted(self._buckets.items()) if len(bucket) != 0
+            }
+            return {
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":self.hits/requests if requests != 0 else 0.0,
+                "evictions":self.evictions,
+                "unpooled":self.unpooled,
+                "pooled_bytes":self.pooled_bytes,
+                "max_bytes":self.max_bytes,
+                "buckets":buckets
+            }
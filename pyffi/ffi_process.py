@@ -0,0 +1,250 @@
+import os
+import functools
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+import numpy as np
+
+
+# state of a pool worker process, set by _worker_init
+_worker_lib = None
+_worker_funcs = None
+
+
+def _worker_init(lib_path:str,cache_dir:str,func_names):
+    global _worker_lib, _worker_funcs
+    from .ffi_core import Lib
+    _worker_lib = Lib(lib_path,cache_dir=cache_dir)
+    _worker_funcs = {name:_worker_lib.FFIGlobalFunc(name) for name in func_names}
+
+
+def _worker_func(name:str):
+    func = _worker_funcs.get(name)
+    if func is None:
+        func = _worker_funcs[name] = _worker_lib.FFIGlobalFunc(name)
+    return func
+
+
+def _attach(segments:dict,spec)->np.ndarray:
+    _, shm_name, offset, dtype_str, n = spec
+    if shm_name not in segments:
+        segments[shm_name] = shared_memory.SharedMemory(name=shm_name)
+    return np.ndarray((n,),dtype=np.dtype(dtype_str),buffer=segments[shm_name].buf,offset=offset)
+
+
+def _worker_run(name:str,arg_specs,out_spec,start:int,stop:int):
+    # computes elements [start,stop) of a sharded call, reading and writing shared memory in place
+    segments = {}
+    try:
+        args = [_attach(segments,spec)[start:stop] if spec[0] == "shm" else spec[1] for spec in arg_specs]
+        out = _attach(segments,out_spec)[start:stop]
+        _worker_func(name).batch(*args,out=out)
+        # views have to be released before the segments could be closed
+        del args, out
+    finally:
+        for shm in segments.values():
+            shm.close()
+
+
+def _worker_run_range(name:str,spec,args,start:int,stop:int):
+    # calls func(chunk, len(chunk), *args) on elements [start,stop) of the shared buffer, returns the result
+    segments = {}
+    try:
+        chunk = _attach(segments,spec)[start:stop]
+        r = _worker_func(name)(chunk,stop-start,*args)
+        del chunk
+        return r
+    finally:
+        for shm in segments.values():
+            shm.close()
+
+
+class FFIProcessPool:
+    # runs global functions on a pool of processes, each with its own Lib of the same lib.
+    # array arguments and results live in shared memory, so the data is never pickled,
+    # and every call is sharded by index range across the workers.
+    # ffi_map only runs functions with a batch wrapper (FFI_REGISTER_GLOBAL_FUNCTION_BATCHED),
+    # pointer/length functions like count_zeros(ptr, n) are sharded by ffi_map_reduce
+    def __init__(self,lib,funcs=(),processes:int=None,mp_context=None) -> None:
+        self._lib = lib
+        self.processes = processes if processes is not None else (os.cpu_count() or 1)
+        ctx = mp_context if mp_context is not None else multiprocessing.get_context()
+        # workers have to share the resource tracker of this process, otherwise each of them
+        # tracks the segments it attaches and "cleans up" the ones we already unlinked
+        resource_tracker.ensure_running()
+        # functions are bound once per worker, others on their first call
+        self._pool = ctx.Pool(
+            self.processes,
+            initializer=_worker_init,
+            initargs=(lib.lib_path,lib.cache_dir,tuple(funcs))
+        )
+        self._funcs = {}
+        # shared memory created by ffi_shared_array, name -> (shm, base address)
+        self._shared = {}
+        self._released = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+        return False
+
+    def _func(self,name:str):
+        func = self._funcs.get(name)
+        if func is None:
+            func = self._funcs[name] = self._lib.FFIGlobalFunc(name)
+        return func
+
+    def _create_shm(self,nbytes:int):
+        # size 0 segments are not allowed
+        shm = shared_memory.SharedMemory(create=True,size=max(nbytes,1))
+        base = np.frombuffer(shm.buf,dtype=np.uint8).ctypes.data
+        return shm, base
+
+    def ffi_shared_array(self,shape,dtype)->np.ndarray:
+        # array in shared memory: passing it (or a c contiguous part of it) to ffi_map copies nothing.
+        # it stays valid until ffi_release_shared or close
+        dtype = np.dtype(dtype)
+        shape = tuple(shape) if np.ndim(shape) != 0 else (int(shape),)
+        nbytes = int(np.prod(shape,dtype=np.int64))*dtype.itemsize
+        shm, base = self._create_shm(nbytes)
+        self._shared[shm.name] = (shm,base)
+        return np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+
+    def ffi_release_shared(self,array:np.ndarray):
+        name = self._find_segment(array.__array_interface__["data"][0],array.nbytes)
+        assert name is not None, "array is not a shared array of this pool"
+        self._release(self._shared.pop(name)[0])
+
+    def _release(self,shm):
+        shm.unlink()
+        try:
+            shm.close()
+        except BufferError:
+            # arrays over the segment are still alive, the memory is freed together with them
+            self._released.append(shm)
+
+    def _find_segment(self,addr:int,nbytes:int):
+        for name, (shm,base) in self._shared.items():
+            if base <= addr and addr+nbytes <= base+shm.size:
+                return name
+        return None
+
+    def _find_shared(self,array:np.ndarray):
+        # ("shm", name, offset, dtype, n) if array is a c contiguous part of a shared array of this pool
+        if not array.flags.c_contiguous:
+            return None
+        addr = array.ctypes.data
+        name = self._find_segment(addr,array.nbytes)
+        if name is None:
+            return None
+        return ("shm",name,addr-self._shared[name][1],array.dtype.str,array.size)
+
+    def ffi_map(self,name:str,*args,out:np.ndarray=None,shards:int=None)->np.ndarray:
+        # like FFIGlobalFunc(name).batch(*args,out=out), with the elements split into shards
+        # computed by the worker processes
+        func = self._func(name)
+        assert func._overloads is None and func._batch_func is not None, \
+            "ffi_map needs a batch wrapper (FFI_REGISTER_GLOBAL_FUNCTION_BATCHED) registered for {}, " \
+            "shard pointer/length functions with ffi_map_reduce".format(name)
+        assert len(args) == len(func._batch_arg_dtypes), "argument number error"
+        shape = np.broadcast_shapes(*[np.shape(arg) for arg in args])
+        n = int(np.prod(shape,dtype=np.int64))
+        temp = []
+        def share(array:np.ndarray):
+            spec = self._find_shared(array)
+            if spec is None:
+                shm, base = self._create_shm(array.nbytes)
+                temp.append(shm)
+                np.ndarray(array.shape,dtype=array.dtype,buffer=shm.buf)[...] = array
+                spec = ("shm",shm.name,0,array.dtype.str,array.size)
+            return spec
+        try:
+            arg_specs = []
+            for arg, dtype in zip(args,func._batch_arg_dtypes):
+                if np.ndim(arg) == 0:
+                    # scalars are broadcasted by the workers
+                    arg_specs.append(("scalar",np.asarray(arg,dtype=dtype)[()]))
+                    continue
+                array = arg.astype(dtype,casting="same_kind",copy=False) if isinstance(arg,np.ndarray) else np.asarray(arg,dtype=dtype)
+                if array.shape != shape:
+                    array = np.broadcast_to(array,shape)
+                arg_specs.append(share(array))
+            if out is not None:
+                assert isinstance(out,np.ndarray), "out must be a numpy.ndarray"
+                assert out.shape == shape and out.dtype == func._batch_ret_dtype, "out has a wrong shape or dtype"
+            out_spec = self._find_shared(out) if out is not None else None
+            if out_spec is None:
+                shm, base = self._create_shm(n*func._batch_ret_dtype.itemsize)
+                temp.append(shm)
+                out_spec = ("shm",shm.name,0,func._batch_ret_dtype.str,n)
+            shards = shards if shards is not None else self.processes
+            bounds = np.linspace(0,n,max(1,min(shards,n))+1,dtype=np.int64)
+            tasks = [(name,arg_specs,out_spec,int(start),int(stop)) for start,stop in zip(bounds[:-1],bounds[1:]) if stop > start]
+            self._pool.starmap(_worker_run,tasks)
+            if out is not None and out_spec[1] in self._shared:
+                return out
+            # gather the result out of the temporary segment
+            shm = temp[-1]
+            result = np.ndarray(shape,dtype=func._batch_ret_dtype,buffer=shm.buf)
+            if out is None:
+                out = result.copy()
+            else:
+                out[...] = result
+            del result
+            return out
+        finally:
+            for shm in temp:
+                shm.close()
+                shm.unlink()
+
+    def ffi_map_reduce(self,name:str,source,*args,dtype=None,reducer=None,initial=None,shards:int=None):
+        # splits the buffer source into shards by index range, the workers call
+        # FFIGlobalFunc(name)(shard, len(shard), *args) on zero-copy views of them (like
+        # FFIGlobalFunc.stream), the results are folded with reducer(accumulated, result) starting
+        # from initial or the first result, without a reducer the list of results is returned.
+        # source is copied into shared memory unless it is a shared array of this pool, functions
+        # writing into their buffer only change the caller's data in that case.
+        # args are sent by value, so they must be picklable
+        func = self._func(name)
+        if dtype is None and func._overloads is not None:
+            assert isinstance(source,np.ndarray), "dtype must be given for overloaded functions"
+            dtype = source.dtype
+        elif dtype is None:
+            dtype = func._pointee_dtype()
+        dtype = np.dtype(dtype)
+        if not isinstance(source,np.ndarray):
+            source = np.frombuffer(source,dtype=dtype)
+        array = np.ascontiguousarray(source.astype(dtype,casting="same_kind",copy=False)).reshape(-1)
+        n = array.size
+        temp = []
+        try:
+            spec = self._find_shared(array)
+            if spec is None:
+                shm, base = self._create_shm(array.nbytes)
+                temp.append(shm)
+                np.ndarray(array.shape,dtype=dtype,buffer=shm.buf)[...] = array
+                spec = ("shm",shm.name,0,dtype.str,n)
+            shards = shards if shards is not None else self.processes
+            bounds = np.linspace(0,n,max(1,min(shards,n))+1,dtype=np.int64)
+            tasks = [(name,spec,args,int(start),int(stop)) for start,stop in zip(bounds[:-1],bounds[1:]) if stop > start]
+            results = self._pool.starmap(_worker_run_range,tasks)
+        finally:
+            for shm in temp:
+                shm.close()
+                shm.unlink()
+        if reducer is None:
+            return results
+        if len(results) == 0:
+            return initial
+        if initial is None:
+            return functools.reduce(reducer,results)
+        return functools.reduce(reducer,results,initial)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        for shm, _ in self._shared.values():
+            self._release(shm)
+        self._shared = {}
@@ -0,0 +1,230 @@
+# offline replay of call traces written by Lib.ffi_start_recording (see ffi_trace), for comparing the
+# latencies of two builds of a lib exposing the same registry, or of one build with the recording:
+#
+#   python -m pyffi.ffi_replay calls.trace ./old.so ./new.so --repeat 5 --tolerance 0.25
+#
+# every lib is replayed in its own process: template statics of two builds loaded into one process
+# would be shared (STB_GNU_UNIQUE), so one build would call into the other.
+# calls whose callables, objects or arguments are missing are skipped and reported
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from numpy.lib import format as npformat
+from . import ffi_trace
+from .ffi_core import Lib
+
+
+class _Skip(Exception):
+    # a recorded call that could not be replayed
+    pass
+
+
+class FFITraceReplayer:
+    # replays traces against the lib at lib_path in this process
+    def __init__(self,lib_path:str) -> None:
+        self._lib = Lib(lib_path)
+        self._classes = {}
+        self._dtypes = {}
+
+    def _class(self,class_name:str):
+        cls = self._classes.get(class_name)
+        if cls is None:
+            cls = self._classes[class_name] = type(class_name,(self._lib.FFIClassBase,),{"cffi_registered_name":class_name})
+        return cls
+
+    def _resolve(self,descriptor):
+        # the plan the call was recorded from, None if this lib has no such callable
+        kind, name, class_name, sig, converted = descriptor
+        try:
+            if kind == "global_func":
+                ffi_callable = self._lib.FFIGlobalFunc(name)
+                if ffi_callable._overloads is not None:
+                    ffi_callable = next((o for o in ffi_callable._overloads if o._sig == sig),None)
+            elif kind == "class_method":
+                ffi_callable = self._lib.FFIClassMethod(self._class(class_name),name)
+            elif kind == "constructor":
+                ffi_callable = self._lib.FFIConstructor(self._class(class_name))
+            else:
+                ffi_callable = self._lib.FFIDestructor(self._class(class_name))
+        except AssertionError:
+            return None
+        if ffi_callable is None or ffi_callable._sig != sig:
+            return None
+        return ffi_callable._call_plan if converted else ffi_callable._raw_call_plan
+
+    def _dtype(self,descr):
+        key = repr(descr)
+        dtype = self._dtypes.get(key)
+        if dtype is None:
+            dtype = self._dtypes[key] = npformat.descr_to_dtype(descr)
+        return dtype
+
+    def _decode(self,arg,objects:dict):
+        if type(arg) is not tuple:
+            return arg
+        tag = arg[0]
+        if tag == "o":
+            if arg[1] not in objects:
+                raise _Skip()
+            return objects[arg[1]]
+        if tag == "a":
+            return np.frombuffer(arg[3],dtype=self._dtype(arg[1])).reshape(arg[2]).copy()
+        if tag == "e":
+            return np.empty(arg[2],dtype=self._dtype(arg[1]))
+        if tag == "s":
+            sample = np.frombuffer(arg[3],dtype=self._dtype(arg[1]))
+            return np.resize(sample,int(np.prod(arg[2],dtype=np.int64))).reshape(arg[2])
+        raise _Skip()
+
+    def ffi_run(self,path:str)->dict:
+        # replays the trace at path once, returns the latencies per function like ffi_trace_summary.
+        # objects constructed by the replay and not destroyed by it are destroyed at the end
+        clock = time.perf_counter_ns
+        plans = []
+        objects = {}
+        # object id -> class name of the objects constructed by the replay
+        owned = {}
+        samples, skipped, kinds = {}, {}, {}
+        for new_callables, calls in ffi_trace.ffi_read_trace(path):
+            for descriptor in new_callables:
+                plans.append((descriptor,self._resolve(descriptor)))
+                kinds[descriptor[1]] = descriptor[0]
+            for index, encoded, object_id, _ in calls:
+                descriptor, plan = plans[index]
+                name = descriptor[1]
+                try:
+                    if plan is None:
+                        raise _Skip()
+                    args = [self._decode(arg,objects) for arg in encoded]
+                    t0 = clock()
+                    r = plan(*args)
+                    t1 = clock()
+                except Exception:
+                    skipped[name] = skipped.get(name,0)+1
+                    continue
+                samples.setdefault(name,[]).append(t1-t0)
+                if descriptor[0] == "destructor":
+                    objects.pop(encoded[0][1],None)
+                    owned.pop(encoded[0][1],None)
+                elif object_id is not None and r is not None:
+                    objects[object_id] = r if type(r) is int else r._ptr
+                    if descriptor[0] == "constructor":
+                        owned[object_id] = descriptor[2]
+        for object_id, class_name in owned.items():
+            self._lib.FFIDestructor(self._class(class_name))._raw_call_plan(objects[object_id])
+        return {name:ffi_trace.ffi_latency_summary(kinds[name],samples.get(name,[]),skipped.get(name,0)) for name in kinds}
+
+
+def _replay_in_subprocess(trace_path:str,lib_path:str,warmup:int)->dict:
+    # the result is passed in a file, libs may print to stdout
+    with tempfile.TemporaryDirectory() as d:
+        out = os.path.join(d,"replay.json")
+        env = dict(os.environ)
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join([package_dir]+([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+        subprocess.run([sys.executable,"-m","pyffi.ffi_replay",trace_path,lib_path,"--warmup",str(warmup),"--worker",out],
+            env=env,check=True,stdout=subprocess.DEVNULL)
+        with open(out) as f:
+            return json.load(f)
+
+
+def ffi_replay(trace_path:str,lib_paths:list,repeat:int=3,warmup:int=1)->dict:
+    # replays the trace against every lib, each in a fresh process, repeat times round robin.
+    # every process replays it warmup times before the measured replay.
+    # returns {lib path: latencies per function}, the best of the repeats per function
+    trace_path = os.path.abspath(trace_path)
+    runs = {lib_path:[] for lib_path in lib_paths}
+    for _ in range(repeat):
+        for lib_path in lib_paths:
+            runs[lib_path].append(_replay_in_subprocess(trace_path,os.path.abspath(lib_path),warmup))
+    results = {}
+    for lib_path, lib_runs in runs.items():
+        best = {}
+        for name in lib_runs[0]:
+            summaries = [run[name] for run in lib_runs]
+            summary = dict(summaries[0])
+            for key in ("total_ns","p50_ns","min_ns"):
+                summary[key] = min(s[key] for s in summaries)
+            summary["mean_ns"] = summary["total_ns"]/summary["calls"] if summary["calls"] != 0 else 0.0
+            best[name] = summary
+        results[lib_path] = best
+    return results
+
+
+def ffi_compare(base:dict,new:dict)->dict:
+    # per function latency deltas of new against base (relative, 0.1 is 10% slower)
+    rows = {}
+    for name, b in base.items():
+        n = new.get(name)
+        if n is None or b["calls"] == 0 or n["calls"] == 0:
+            continue
+        rows[name] = {
+            "kind":b["kind"],
+            "calls":n["calls"],
+            "base_p50_ns":b["p50_ns"],
+            "new_p50_ns":n["p50_ns"],
+            "p50_delta":n["p50_ns"]/b["p50_ns"]-1 if b["p50_ns"] != 0 else 0.0,
+            "base_mean_ns":b["mean_ns"],
+            "new_mean_ns":n["mean_ns"],
+            "mean_delta":n["mean_ns"]/b["mean_ns"]-1 if b["mean_ns"] != 0 else 0.0
+        }
+    return rows
+
+
+def _print_comparison(rows:dict,base_name:str,new_name:str):
+    print("base: {}\nnew:  {}".format(base_name,new_name))
+    print("{:<40} {:>9} {:>12} {:>12} {:>8} {:>12} {:>12} {:>8}".format(
+        "function","calls","base p50","new p50","delta","base mean","new mean","delta"))
+    for name, row in sorted(rows.items(),key=lambda r: -r[1]["base_mean_ns"]*r[1]["calls"]):
+        print("{:<40} {:>9d} {:>9.0f} ns {:>9.0f} ns {:>+7.1%} {:>9.0f} ns {:>9.0f} ns {:>+7.1%}".format(
+            name,row["calls"],row["base_p50_ns"],row["new_p50_ns"],row["p50_delta"],
+            row["base_mean_ns"],row["new_mean_ns"],row["mean_delta"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyffi.ffi_replay",
+        description="replays a pyffi call trace and compares per function latencies")
+    parser.add_argument("trace",help="trace written by Lib.ffi_start_recording")
+    parser.add_argument("libs",nargs="+",help="one lib (compared with the recorded latencies) or a base and a new lib")
+    parser.add_argument("--repeat",type=int,default=3,help="replays per lib, the best one per function is kept")
+    parser.add_argument("--warmup",type=int,default=1,help="unmeasured replays before every measured one")
+    parser.add_argument("--json",help="writes the comparison to this path")
+    parser.add_argument("--tolerance",type=float,default=None,
+        help="exit with code 1 if the p50 of any function got slower by more than this fraction")
+    parser.add_argument("--worker",help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker is not None:
+        replayer = FFITraceReplayer(args.libs[0])
+        for _ in range(args.warmup):
+            replayer.ffi_run(args.trace)
+        result = replayer.ffi_run(args.trace)
+        with open(args.worker,"w") as f:
+            json.dump(result,f)
+        return 0
+    assert len(args.libs) <= 2, "give one or two libs"
+    results = ffi_replay(args.trace,args.libs,args.repeat,args.warmup)
+    if len(args.libs) == 1:
+        base_name, base = "recorded", ffi_trace.ffi_trace_summary(args.trace)
+    else:
+        base_name, base = args.libs[0], results[args.libs[0]]
+    new_name, new = args.libs[-1], results[args.libs[-1]]
+    rows = ffi_compare(base,new)
+    _print_comparison(rows,base_name,new_name)
+    skipped = {name:s["skipped"] for name,s in new.items() if s["skipped"] != 0}
+    if len(skipped) != 0:
+        print("skipped calls: {}".format(skipped))
+    if args.json is not None:
+        with open(args.json,"w") as f:
+            json.dump({"base":base_name,"new":new_name,"functions":rows,"skipped":skipped},f,indent=2)
+    if args.tolerance is not None and any(row["p50_delta"] > args.tolerance for row in rows.values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+
+
+# default number of elements per chunk
+default_chunk_size = 1<<20
+
+
+class _BufferReader:
+    # cuts an iterable of buffers (bytes, memoryview, mmap, ndarrays...) of any sizes into chunks.
+    # ndarrays are converted to dtype first, other buffers are taken as raw bytes
+    def __init__(self,items,dtype:np.dtype) -> None:
+        self._items = iter(items)
+        self._dtype = dtype
+        self._pending = None
+        self._pos = 0
+
+    def _as_bytes(self,item)->np.ndarray:
+        if isinstance(item,np.ndarray):
+            item = np.ascontiguousarray(item.astype(self._dtype,casting="same_kind",copy=False))
+            return item.reshape(-1).view(np.uint8)
+        return np.frombuffer(item,dtype=np.uint8)
+
+    def ffi_read_into(self,buffer:np.ndarray)->int:
+        # fills buffer from the items, returns the number of elements written (0 at the end)
+        out = buffer.view(np.uint8)
+        filled = 0
+        while filled < out.size:
+            if self._pending is None or self._pos == self._pending.size:
+                item = next(self._items,None)
+                if item is None:
+                    break
+                self._pending, self._pos = self._as_bytes(item), 0
+                continue
+            n = min(out.size-filled,self._pending.size-self._pos)
+            out[filled:filled+n] = self._pending[self._pos:self._pos+n]
+            filled += n
+            self._pos += n
+        assert filled % self._dtype.itemsize == 0, "input size is not a multiple of the item size"
+        return filled // self._dtype.itemsize
+
+
+def _buffered_chunks(reader:_BufferReader,dtype:np.dtype,chunk_size:int):
+    # double buffering: the next chunk is read into one buffer on a background thread
+    # while the current one (the other buffer) is being processed
+    buffers = [np.empty(chunk_size,dtype=dtype) for _ in range(2)]
+    with ThreadPoolExecutor(max_workers=1,thread_name_prefix="pyffi_stream") as executor:
+        pending = executor.submit(reader.ffi_read_into,buffers[0])
+        try:
+            i = 0
+            while True:
+                n = pending.result()
+                if n == 0:
+                    return
+                pending = executor.submit(reader.ffi_read_into,buffers[(i+1)%2])
+                yield buffers[i%2][:n]
+                i += 1
+        finally:
+            # the reader must not outlive the stream
+            wait([pending])
+
+
+def _madvise(mm:mmap.mmap,option:str,start:int,length:int):
+    # madvise is not available everywhere, start must be page aligned
+    if not hasattr(mm,"madvise") or not hasattr(mmap,option):
+        return
+    aligned = start - start % mmap.PAGESIZE
+    length = min(length+start-aligned,len(mm)-aligned)
+    if length > 0:
+        mm.madvise(getattr(mmap,option),aligned,length)
+
+
+def _mmap_chunks(path,dtype:np.dtype,chunk_size:int):
+    # chunks are zero-copy views of a copy-on-write mapping of the file, so they are writable
+    # without changing the file. the kernel reads the next chunk ahead while the current one
+    # is processed, and processed chunks are dropped from memory
+    with open(path,"rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        assert size % dtype.itemsize == 0, "file size is not a multiple of the item size"
+        if size == 0:
+            return
+        mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_COPY)
+    n = size // dtype.itemsize
+    chunk_bytes = chunk_size*dtype.itemsize
+    for start in range(0,n,chunk_size):
+        stop = min(start+chunk_size,n)
+        _madvise(mm,"MADV_WILLNEED",stop*dtype.itemsize,chunk_bytes)
+        yield np.frombuffer(mm,dtype=dtype,count=stop-start,offset=start*dtype.itemsize)
+        _madvise(mm,"MADV_DONTNEED",start*dtype.itemsize,(stop-start)*dtype.itemsize)
+    # the mapping is closed when the last chunk is released
+
+
+def ffi_chunks(source,dtype,chunk_size:int=default_chunk_size):
+    # c contiguous 1-d ndarrays of at most chunk_size elements of dtype read from source:
+    # a file path (memory mapped), an ndarray or a single buffer (sliced without copies), or an
+    # iterable of buffers or ndarrays (converted and copied into two reused chunk buffers).
+    # chunks are only valid until the next one is taken
+    dtype = np.dtype(dtype)
+    assert chunk_size > 0, "chunk size must be positive"
+    if isinstance(source,(str,os.PathLike)):
+        return _mmap_chunks(source,dtype,chunk_size)
+    if not isinstance(source,np.ndarray):
+        try:
+            source = np.frombuffer(source,dtype=dtype)
+        except TypeError:
+            return _buffered_chunks(_BufferReader(source,dtype),dtype,chunk_size)
+    source = np.ascontiguousarray(source.astype(dtype,casting="same_kind",copy=False)).reshape(-1)
+    return (source[i:i+chunk_size] for i in range(0,source.size,chunk_size))
+
+
+def ffi_stream(call,source,dtype,chunk_size:int=default_chunk_size,reducer=None,initial=None):
+    # calls call(chunk) for every chunk of source (see ffi_chunks) and folds the results with
+    # reducer(accumulated, result), starting from initial or the first result.
+    # without a reducer the list of results is returned.
+    # peak memory is bounded by the chunk size instead of the size of source
+    results = []
+    acc = initial
+    first = initial is None
+    for chunk in ffi_chunks(source,dtype,chunk_size):
+        r = call(chunk)
+        if reducer is None:
+            results.append(r)
+        elif first:
+            acc, first = r, False
+        else:
+            acc = reducer(acc,r)
+    return results if reducer is None else acc
@@ -0,0 +1,207 @@
+# call recording: Lib.ffi_start_recording writes every call of global functions, class methods,
+# constructors and destructors of the lib into a compact trace, which ffi_replay replays against
+# other builds of the lib exposing the same registry to compare their latencies.
+#
+# a trace is a marshal header followed by chunks, every chunk a zlib compressed marshal dump of
+# (new callables, calls). callables are (kind, registered name, class name, sig, converted) in the
+# order they were bound, calls are (callable index, arguments, object id of the result, duration ns).
+# arrays of up to max_array_bytes are stored whole, larger ones as dtype, shape and sample_size evenly
+# spaced elements, which are repeated to fill the array again on replay. output parameters are stored
+# as dtype and shape only. registered objects are stored as ids, so replayed calls get the objects
+# constructed (or returned) by the replayed calls
+import os
+import time
+import zlib
+import atexit
+import marshal
+import threading
+import numpy as np
+from numpy.lib import format as npformat
+
+_version = 1
+
+
+class FFITraceRecorder:
+    # see Lib.ffi_start_recording. calls are buffered and written chunk_calls at a time
+    def __init__(self,path:str,lib,max_array_bytes:int=1<<16,sample_size:int=1024,chunk_calls:int=4096) -> None:
+        self.path = path
+        self.max_array_bytes = max_array_bytes
+        self.sample_size = sample_size
+        self.chunk_calls = chunk_calls
+        self._class_names = set(lib.ffi_get_class_names())
+        self._typing_manager = lib.typing_manager
+        # destructors run from __del__ could record from inside a recording call of the same thread
+        self._lock = threading.RLock()
+        self._file = open(path,"wb")
+        marshal.dump({"version":_version,"lib_path":lib.lib_path,"time":time.time()},self._file)
+        # callable descriptor -> index
+        self._callables = {}
+        self._new_callables = []
+        self._calls = []
+        # address -> id of the registered objects seen so far
+        self._object_ids = {}
+        self._next_object_id = 0
+        # dtype -> descr
+        self._descrs = {}
+        self.calls = 0
+        self.chunks = 0
+        atexit.register(self.close)
+
+    def _is_object(self,sig_element:str)->bool:
+        sd = self._typing_manager.ffi_get_sig_element_descriptor(sig_element)
+        return sd.indirection_level == 1 and sd.sig_element_removed_indirection in self._class_names
+
+    def ffi_wrap(self,ffi_callable,plan,converted:bool):
+        # plan recording every call into the trace. converted tells which of the plans of the
+        # callable it is, the replay calls the same one
+        name = ffi_callable.cffi_registered_name
+        kind = ffi_callable.kind
+        class_name = None
+        if kind == "class_method":
+            class_name = name.rsplit(".",1)[0]
+        elif kind in ("constructor","destructor"):
+            class_name = name[:name.rfind("_")]
+        descriptor = (kind,name,class_name,ffi_callable._sig,converted)
+        with self._lock:
+            index = self._callables.get(descriptor)
+            if index is None:
+                index = self._callables[descriptor] = len(self._callables)
+                self._new_callables.append(descriptor)
+        params = ffi_callable.sig_elements[1:]
+        encoders = [self._encode_object if self._is_object(e) else self._encode for e in params]
+        # output parameters (see FFI_REGISTER_OUTPUT_PARAM) are only written by the call
+        for output in getattr(ffi_callable,"_outputs",None) or ():
+            encoders[output[0]] = self._encode_output
+        returns_object = kind == "constructor" or self._is_object(ffi_callable.sig_elements[0])
+        destroys = kind == "destructor"
+        constructs = kind == "constructor"
+        record = self._record
+        clock = time.perf_counter_ns
+        def recording_plan(*args):
+            # arguments are taken before the call, which could write into them
+            encoded = tuple([encode(arg) for encode,arg in zip(encoders,args)])
+            t0 = clock()
+            r = plan(*args)
+            t1 = clock()
+            record(index,encoded,r if returns_object else None,t1-t0,args[0] if destroys else None,constructs)
+            return r
+        return recording_plan
+
+    def _record(self,index:int,encoded:tuple,r,duration:int,destroyed,constructs:bool):
+        with self._lock:
+            object_id = None
+            if r is not None:
+                addr = r if type(r) is int else r._ptr
+                object_id = None if constructs else self._object_ids.get(addr)
+                if object_id is None:
+                    # a new object could be at the address of a destroyed one
+                    object_id = self._object_ids[addr] = self._next_object_id
+                    self._next_object_id += 1
+            elif destroyed is not None:
+                self._object_ids.pop(destroyed if type(destroyed) is int else destroyed._ptr,None)
+            self._calls.append((index,encoded,object_id,duration))
+            self.calls += 1
+            if len(self._calls) >= self.chunk_calls:
+                self._flush()
+
+    def _encode_object(self,arg):
+        if arg is None:
+            return None
+        addr = arg if type(arg) is int else arg._ptr
+        # objects constructed before the recording are unknown to the replay
+        return ("o",self._object_ids.get(addr,-1))
+
+    def _encode(self,arg):
+        if arg is None or type(arg) in (bool,float,str,bytes):
+            return arg
+        if isinstance(arg,int):
+            return int(arg)
+        if isinstance(arg,np.generic) and arg.dtype.fields is None:
+            return arg.item()
+        if not isinstance(arg,np.ndarray):
+            try:
+                arg = np.asarray(memoryview(arg))
+            except TypeError:
+                return ("u",type(arg).__name__)
+        descr = self._descr(arg.dtype)
+        if arg.nbytes <= self.max_array_bytes:
+            return ("a",descr,arg.shape,arg.tobytes())
+        flat = arg.reshape(-1)
+        sample = flat[np.linspace(0,flat.size-1,min(self.sample_size,flat.size)).astype(np.int64)]
+        return ("s",descr,arg.shape,sample.tobytes())
+
+    def _encode_output(self,arg):
+        arg = np.asarray(arg)
+        return ("e",self._descr(arg.dtype),arg.shape)
+
+    def _descr(self,dtype:np.dtype):
+        descr = self._descrs.get(dtype)
+        if descr is None:
+            descr = self._descrs[dtype] = npformat.dtype_to_descr(dtype)
+        return descr
+
+    def _flush(self):
+        if len(self._calls) == 0 and len(self._new_callables) == 0:
+            return
+        chunk = (self._new_callables,self._calls)
+        self._new_callables, self._calls = [], []
+        marshal.dump(zlib.compress(marshal.dumps(chunk),1),self._file)
+        self.chunks += 1
+
+    def close(self):
+        # writes the buffered calls, the trace is complete afterwards
+        with self._lock:
+            if self._file.closed:
+                return
+            self._flush()
+            self._file.close()
+        atexit.unregister(self.close)
+
+    def ffi_stats(self)->dict:
+        with self._lock:
+            return {
+                "calls":self.calls,
+                "callables":len(self._callables),
+                "chunks":self.chunks,
+                "bytes":os.path.getsize(self.path) if self._file.closed else self._file.tell()
+            }
+
+
+def ffi_read_trace(path:str):
+    # yields the (new callables, calls) chunks of the trace at path
+    with open(path,"rb") as f:
+        header = marshal.load(f)
+        assert header.get("version") == _version, "unsupported trace version"
+        while True:
+            try:
+                chunk = marshal.load(f)
+            except EOFError:
+                return
+            yield marshal.loads(zlib.decompress(chunk))
+
+
+def ffi_latency_summary(kind:str,samples:list,skipped:int=0)->dict:
+    samples = np.asarray(samples,dtype=np.int64)
+    calls = len(samples)
+    return {
+        "kind":kind,
+        "calls":calls,
+        "skipped":skipped,
+        "total_ns":int(samples.sum()),
+        "mean_ns":float(samples.mean()) if calls != 0 else 0.0,
+        "p50_ns":float(np.percentile(samples,50)) if calls != 0 else 0.0,
+        "min_ns":int(samples.min()) if calls != 0 else 0
+    }
+
+
+def ffi_trace_summary(path:str)->dict:
+    # per function latencies of the trace at path as recorded
+    kinds, samples = {}, {}
+    callables = []
+    for new_callables, calls in ffi_read_trace(path):
+        callables += new_callables
+        for index, _, _, duration in calls:
+            kind, name = callables[index][:2]
+            kinds[name] = kind
+            samples.setdefault(name,[]).append(duration)
+    return {name:ffi_latency_summary(kinds[name],s) for name,s in samples.items()}
@@ -1,7 +1,13 @@
+import array
 import ctypes
+import operator
+import struct
+import sys
+import threading
 from enum import Enum
 import numpy as np
 from typing import Set
+from . import ffi_common
 
 class FFITypeMappingType(Enum):
     kBasic = 1,
@@ -104,25 +110,28 @@ class FFITypeMapping:
         
         
     ]
-    dict_cffi_to_entry = {}
-    dict_ctypes_to_entry = {} 
-    dict_pythontype_to_entry = {}
+    dict_cffi_to_entry = None
+    dict_ctypes_to_entry = None
+    dict_pythontype_to_entry = None
     cffi_basictypes:Set = None
     python_basictypes:Set = None
     lib = None
     
     def __init__(self,lib) -> None:
         self.lib = lib
+        # class pointer entries are per lib, so every mapping gets its own entry list and dicts
+        self.entries = list(FFITypeMapping.entries)
+        self.dict_cffi_to_entry = {}
+        self.dict_ctypes_to_entry = {}
+        self.dict_pythontype_to_entry = {}
         self._build_basic_types()
         self._init_class_mappings()
+        self._init_struct_mappings()
         self._update_dict()
     
     
     def _init_class_mappings(self):
-        entry_count = self.lib.ffi_get_class_entry_num()
-        for i in range(entry_count):
-            entry = self.lib.ffi_get_class_entry(i)[0]
-            class_name = entry.class_namestr.decode("utf_8")
+        for class_name in self.lib.ffi_get_class_names():
             # class names with the same name as basic types are not allowed
             assert class_name not in self.cffi_basictypes, "invalid class name"
             new_entry = FFITypeMappingEntry(
@@ -132,6 +141,18 @@ class FFITypeMapping:
                 mapping_type=FFITypeMappingType.kExtended
             )
             self.entries.append(new_entry)  
+
+    def _init_struct_mappings(self):
+        # struct pointers are converted from/to ndarrays of the struct dtype, see ffi_make_struct_converter
+        for struct_name in self.lib.ffi_get_struct_names():
+            assert struct_name not in self.cffi_basictypes, "invalid struct name"
+            for prefix in ("*","c*"):
+                self.entries.append(FFITypeMappingEntry(
+                    c_ffi_type_str=prefix+struct_name,
+                    ctypes_type=ctypes.c_void_p,
+                    python_type=None,
+                    mapping_type=FFITypeMappingType.kExtended
+                ))
     
     
     def _build_basic_types(self):
@@ -168,26 +189,38 @@ class SigElementDescriptor:
     sig_element_removed_indirection = None
     is_basic_type_pointer = None
     is_basic_type = None
+    is_const_pointer = None
     def __init__(self,
                     indirection_level,
                     ctypes_type,
                     sig_element,
                     sig_element_removed_indirection,
                     is_basic_type_pointer,
-                    is_basic_type
+                    is_basic_type,
+                    is_const_pointer = False
                     ) -> None:
         self.indirection_level = indirection_level
         self.ctypes_type = ctypes_type
         self.sig_element = sig_element
-        self.sig_element_removed_indirection = sig_element_removed_indirection,
+        self.sig_element_removed_indirection = sig_element_removed_indirection
         self.is_basic_type_pointer = is_basic_type_pointer
         self.is_basic_type = is_basic_type
+        # pointers to const basic types are marked as "c*" in sigs
+        self.is_const_pointer = is_const_pointer
 
 
 class FFITypingManager:
     def __init__(self,lib) -> None:
         self.lib = lib
         self.S_FFITypeMapping = FFITypeMapping(self.lib)
+        # sig -> split sig elements, sig element -> SigElementDescriptor.
+        # caches are filled with setdefault, so concurrent misses agree on one value
+        self._sig_elements_cache = {}
+        self._sig_element_descriptor_cache = {}
+        # struct name -> structured dtype
+        self._struct_dtype_cache = {}
+        # guards updates of the type mappings
+        self._lock = threading.RLock()
     
     
     def ffi_is_basic_type(self,ty:str|object):
@@ -200,10 +233,11 @@ class FFITypingManager:
         return False
     
     def ffi_resolve_extended_type(self,cffi_type_str:str,ty:type):
-        entry = self.ffi_xtype_to_mapping_entry(cffi_type_str)
-        assert entry.python_type is None, "resetting extend type mapping"
-        entry.python_type = ty
-        self.S_FFITypeMapping._update_dict()
+        with self._lock:
+            entry = self.ffi_xtype_to_mapping_entry(cffi_type_str)
+            assert entry.python_type is None, "resetting extend type mapping"
+            entry.python_type = ty
+            self.S_FFITypeMapping._update_dict()
         
     
     def ffi_set_f_python_to_ctypes(self,cffi_type_str:str,f_python_to_ctypes):
@@ -232,9 +266,16 @@ class FFITypingManager:
 
 
     def ffi_get_sig_element_descriptor(self,sig_element:str):
+        sd = self._sig_element_descriptor_cache.get(sig_element)
+        if sd is None:
+            sd = self._sig_element_descriptor_cache.setdefault(sig_element,self._make_sig_element_descriptor(sig_element))
+        return sd
+
+    def _make_sig_element_descriptor(self,sig_element:str):
         indirection_level = sig_element.count('*')
         assert indirection_level <= 1, "exceeded maximum allowed indirection level"
-        sige_removed_indirection = sig_element[indirection_level:]
+        is_const_pointer = sig_element.startswith("c*")
+        sige_removed_indirection = sig_element[indirection_level+is_const_pointer:]
         ri_is_basic = self.ffi_is_basic_type(sige_removed_indirection)
         if ri_is_basic:
             ctypes_type = self.ffi_xtype_to_mapping_entry(sige_removed_indirection).ctypes_type
@@ -249,23 +290,384 @@ class FFITypingManager:
             sig_element,
             sige_removed_indirection,
             indirection_level == 1 and ri_is_basic,
-            indirection_level == 0 and ri_is_basic
+            indirection_level == 0 and ri_is_basic,
+            is_const_pointer
         )
         
 
+    def ffi_basic_type_to_dtype(self,cffi_type_str:str)->np.dtype:
+        assert cffi_type_str in self.S_FFITypeMapping.cffi_basictypes and cffi_type_str != "void", \
+            "only basic types have a dtype"
+        return np.dtype(self.ffi_xtype_to_mapping_entry(cffi_type_str).ctypes_type)
+
+    def ffi_struct_dtype(self,struct_name:str)->np.dtype:
+        # numpy structured dtype of a struct registered with FFI_REGISTER_STRUCT, None for other types
+        dtype = self._struct_dtype_cache.get(struct_name)
+        if dtype is None:
+            layout_entry = self.lib.ffi_find_access_entry(ffi_common.FFIAccessEntryType.kStructLayout,struct_name)
+            if layout_entry is None:
+                return None
+            names, formats, offsets = [], [], []
+            for entry in self.lib.ffi_find_struct_field_entries(struct_name):
+                names.append(entry.name.decode("utf_8")[len(struct_name)+1:])
+                formats.append(self._struct_field_dtype(entry.sig.decode("utf_8"),entry.field_size))
+                offsets.append(entry.offset)
+            dtype = np.dtype({
+                "names":names,
+                "formats":formats,
+                "offsets":offsets,
+                "itemsize":layout_entry.field_size
+            })
+            dtype = self._struct_dtype_cache.setdefault(struct_name,dtype)
+        return dtype
+
+    def _struct_field_dtype(self,sig_element:str,field_size:int)->np.dtype:
+        if self.ffi_is_basic_type(sig_element):
+            dtype = self.ffi_basic_type_to_dtype(sig_element)
+        elif "*" in sig_element:
+            # pointer fields hold raw addresses
+            dtype = np.dtype(np.uintp)
+        else:
+            dtype = self.ffi_struct_dtype(sig_element)
+            assert dtype is not None, "struct field of unregistered type {}".format(sig_element)
+        # array fields are registered with their element type, multidimensional ones are flattened
+        count = field_size // dtype.itemsize
+        return dtype if count == 1 else np.dtype((dtype,(count,)))
+
+    def ffi_make_arg_converter(self,sig_element:str):
+        # returns a python->ctypes converter fixed for sig_element, or None if
+        # the argument could be handed to ctypes as is
+        sd = self.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type:
+            return None
+        elif sd.is_basic_type_pointer:
+            return ffi_make_buffer_converter(
+                self.ffi_xtype_to_mapping_entry(sd.sig_element_removed_indirection).ctypes_type,
+                sd.is_const_pointer
+            )
+        struct_dtype = self.ffi_struct_dtype(sd.sig_element_removed_indirection)
+        if struct_dtype is not None:
+            return ffi_make_struct_converter(struct_dtype,sd.is_const_pointer)
+        else:
+            # the entry of a class pointer is only completed when its python side class
+            # is defined, so entry attributes are read at call time
+            entry = self.ffi_xtype_to_mapping_entry(sig_element)
+            def convert_extended(arg):
+                if type(arg) is int:
+                    # raw pointers to extended types, e.g. self._ptr passed to destructors
+                    return arg
+                assert isinstance(arg,entry.python_type), "argument type error"
+                return entry.f_python_to_ctypes(arg)
+            return convert_extended
+
+    def ffi_make_ret_converter(self,sig_element:str):
+        # returns a ctypes->python converter fixed for sig_element, or None if
+        # ctypes has already done the job for us
+        sd = self.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type or sd.is_basic_type_pointer:
+            # basic types and basic type pointers: ctypes has done the job for us
+            return None
+        struct_dtype = self.ffi_struct_dtype(sd.sig_element_removed_indirection)
+        if struct_dtype is not None:
+            return ffi_make_struct_ret_converter(struct_dtype)
+        entry = self.ffi_xtype_to_mapping_entry(sig_element)
+        def convert_extended(retval):
+            return entry.f_ctypes_to_python(retval)
+        return convert_extended
+
+    def ffi_match_spec(self,sig_element:str)->tuple:
+        # what overload matching needs to know about the parameter sig_element, see ffi_match_param
+        sd = self.ffi_get_sig_element_descriptor(sig_element)
+        if sd.is_basic_type:
+            return ("b",sd.ctypes_type)
+        if sd.is_basic_type_pointer:
+            return ("p",self.ffi_xtype_to_mapping_entry(sd.sig_element_removed_indirection).ctypes_type,sd.is_const_pointer)
+        struct_dtype = self.ffi_struct_dtype(sd.sig_element_removed_indirection)
+        if struct_dtype is not None:
+            return ("s",struct_dtype)
+        return ("o",self.ffi_xtype_to_mapping_entry(sig_element).python_type)
+
+    def ffi_match_score(self,sig_element:str,key)->int:
+        return ffi_match_param(self.ffi_match_spec(sig_element),key)
+
     def ffi_generate_ctypes_type_from_sig_element(self,sig_element:str):
         sd = self.ffi_get_sig_element_descriptor(sig_element)
         return sd.ctypes_type
 
+    def ffi_preload_sig_elements(self,sig_elements:dict):
+        self._sig_elements_cache.update(sig_elements)
+
     def ffi_split_sig_to_element(self,sig:str):
+        r = self._sig_elements_cache.get(sig)
+        if r is not None:
+            return list(r)
         assert sig.count(";")!=0, "invalid sig"
         args,ret = sig.split(";")
         r = [ret]
-        if len(args)==0:
-            return r
-        else:
+        if len(args)!=0:
             for arg in args.split(":")[1:]:
                 r.append(arg)
-        return r
+        r = self._sig_elements_cache.setdefault(sig,r)
+        return list(r)
         
 
+
+def _buffer_formats(ctypes_type)->frozenset:
+    # struct module format codes of buffers that could be passed for a pointer to ctypes_type
+    size = ctypes.sizeof(ctypes_type)
+    if ctypes_type in (ctypes.c_float,ctypes.c_double):
+        codes = "fd"
+    elif ctypes_type(-1).value == -1:
+        codes = "bhilqn"
+    else:
+        codes = "BHILQN"
+    prefixes = ["","@","=","<" if sys.byteorder == "little" else ">"]
+    formats = set()
+    for p in prefixes:
+        for c in codes:
+            # "=" and "<" switch to standard sizes, e.g. "=l" has 4 byte items on LP64
+            try:
+                if struct.calcsize(p+c) == size:
+                    formats.add(p+c)
+            except struct.error:
+                # n and N only exist in native mode
+                pass
+    return frozenset(formats)
+
+
+# buffer exporters whose item type does not follow from their python type
+_formatted_buffer_types = frozenset([memoryview,array.array])
+
+
+def ffi_dispatch_key(arg):
+    # what overload resolution depends on: the dtype of ndarrays,
+    # the (type, format) of generic buffers and the type of anything else
+    t = type(arg)
+    if t is np.ndarray or isinstance(arg,np.ndarray):
+        return arg.dtype
+    if t in _formatted_buffer_types:
+        return (t,memoryview(arg).format)
+    return t
+
+
+def ffi_match_param(spec:tuple,key)->int:
+    # how well an argument with dispatch key key (see ffi_dispatch_key) fits the parameter
+    # described by spec (see TypingManager.ffi_match_spec): 2 as it is, 1 after a conversion, 0 not at all
+    kind = spec[0]
+    if kind == "b":
+        dtype = np.dtype(spec[1])
+        if isinstance(key,np.dtype):
+            # arrays passed for scalars go to the batch wrapper
+            other = key
+        elif not isinstance(key,type):
+            return 0
+        elif issubclass(key,np.generic):
+            other = np.dtype(key)
+        elif issubclass(key,int):
+            return 2 if dtype.kind in "iu" else 1
+        elif issubclass(key,float):
+            return 2 if dtype.kind == "f" else 0
+        else:
+            return 0
+        if other == dtype:
+            return 2
+        return 1 if np.can_cast(other,dtype,"same_kind") else 0
+    if kind == "p":
+        ctypes_type, is_const = spec[1], spec[2]
+        if isinstance(key,np.dtype):
+            return 2 if key == np.dtype(ctypes_type) else 0
+        if isinstance(key,tuple):
+            return 2 if key[1] in _buffer_formats(ctypes_type) else 0
+        if key is bytearray or (key is bytes and is_const):
+            return 2 if "B" in _buffer_formats(ctypes_type) else 0
+        return 1 if key is type(None) else 0
+    if kind == "s":
+        if isinstance(key,np.dtype):
+            return 2 if key == spec[1] else 0
+        return 1 if key is int or key is type(None) else 0
+    python_type = spec[1]
+    if not isinstance(key,type) or python_type is None:
+        return 0
+    if issubclass(key,python_type):
+        return 2
+    # raw addresses of objects
+    return 1 if key is int and python_type is not str else 0
+
+
+def ffi_match_overload(specs,key:tuple):
+    # index of the overload (given by the match specs of its parameters) taking arguments with the
+    # dispatch keys key with the fewest conversions, the first registered one among equally good ones.
+    # None if no overload takes them
+    best, best_score = None, 0
+    for i, params in enumerate(specs):
+        if len(params) != len(key):
+            continue
+        scores = [ffi_match_param(p,k) for p,k in zip(params,key)]
+        if 0 not in scores and sum(scores) > best_score:
+            best, best_score = i, sum(scores)
+    return best
+
+
+def ffi_resolve_overload(cache:dict,overloads,specs,name:str,args):
+    # the overload of name called for args, cached by the dispatch keys of args.
+    # used by the overload dispatchers of generated binding modules, see ffi_aot
+    key = tuple([ffi_dispatch_key(arg) for arg in args])
+    overload = cache.get(key)
+    if overload is None:
+        i = ffi_match_overload(specs,key)
+        assert i is not None, "no overload of {} takes ({})".format(name,", ".join(str(k) for k in key))
+        overload = cache.setdefault(key,overloads[i])
+    return overload
+
+
+def ffi_make_buffer_converter(ctypes_type,is_const:bool):
+    # converter of pointer arguments, it takes any c contiguous buffer exporter (numpy.ndarray,
+    # bytes, bytearray, memoryview, array.array, mmap...) whose format matches ctypes_type and
+    # hands the raw data address to ctypes. parameters are declared as c_void_p for this
+    formats = _buffer_formats(ctypes_type)
+    size = ctypes.sizeof(ctypes_type)
+    from_buffer = ctypes.c_char.from_buffer
+    addressof = ctypes.addressof
+    def convert_buffer(arg):
+        if arg is None:
+            # NULL, as for struct pointers
+            return None
+        if type(arg) is bytes and is_const and "B" in formats:
+            # ctypes passes the internal buffer of bytes objects to c_void_p parameters
+            return arg
+        try:
+            view = memoryview(arg)
+        except TypeError:
+            view = None
+        assert view is not None, "pointer arguments must support the buffer protocol"
+        assert view.format in formats, "argument type error"
+        assert view.itemsize == size, "argument type error"
+        assert view.c_contiguous, "pointer arguments must be c contiguous"
+        if view.nbytes == 0:
+            return None
+        if view.readonly:
+            assert is_const, "read-only buffer passed for a non-const pointer"
+            # ctypes could not take the address of read-only buffers
+            return np.frombuffer(view,dtype=np.uint8).ctypes.data
+        # the buffer is exported only as long as the address is taken
+        return addressof(from_buffer(view))
+    return convert_buffer
+
+
+def ffi_make_struct_converter(dtype:np.dtype,is_const:bool):
+    # converter of struct pointer arguments, it takes c contiguous ndarrays of the struct dtype
+    # (record arrays, views returned for struct pointers...) and hands their data address to ctypes
+    from_buffer = ctypes.c_char.from_buffer
+    addressof = ctypes.addressof
+    def convert_struct(arg):
+        if type(arg) is int or arg is None:
+            # raw pointers
+            return arg
+        assert isinstance(arg,np.ndarray), "struct pointer arguments must be numpy.ndarray"
+        assert arg.dtype == dtype, "argument type error"
+        assert arg.flags.c_contiguous, "pointer arguments must be c contiguous"
+        if arg.size == 0:
+            return None
+        if not arg.flags.writeable:
+            assert is_const, "read-only buffer passed for a non-const pointer"
+            return arg.ctypes.data
+        return addressof(from_buffer(arg))
+    return convert_struct
+
+
+def ffi_make_struct_ret_converter(dtype:np.dtype):
+    # returned struct pointers come back as writable 0-d views of the struct, or None.
+    # the views do not own the memory, see Lib.ffi_struct_array for views of more structs
+    def convert_struct(retval):
+        if retval is None:
+            return None
+        return ffi_ndarray_from_address(retval,dtype,())
+    return convert_struct
+
+
+def ffi_as_batch_arrays(args,dtypes,shape=None):
+    # casts args to dtypes and broadcasts them against each other, or to shape if given.
+    # broadcasted views are materialized since batch wrappers walk contiguous memory
+    assert len(args) == len(dtypes), "argument number error"
+    arrays = [
+        arg.astype(dtype,casting="same_kind",copy=False) if isinstance(arg,np.ndarray) else np.asarray(arg,dtype=dtype)
+        for arg, dtype in zip(args,dtypes)
+    ]
+    if shape is None:
+        arrays = np.broadcast_arrays(*arrays)
+        shape = arrays[0].shape if len(arrays) != 0 else ()
+    else:
+        arrays = [np.broadcast_to(a,shape) for a in arrays]
+    return [np.ascontiguousarray(a) for a in arrays], shape
+
+
+def ffi_make_batch_out(out,shape,dtype):
+    if out is None:
+        return np.empty(shape,dtype=dtype)
+    assert isinstance(out,np.ndarray), "out must be a numpy.ndarray"
+    assert out.shape == shape, "out has a wrong shape"
+    assert out.dtype == dtype, "out has a wrong dtype"
+    assert out.flags.c_contiguous and out.flags.writeable, "out must be writeable and c contiguous"
+    return out
+
+
+def ffi_ndarray_from_address(addr:int,dtype:np.dtype,shape:tuple,owner=None)->np.ndarray:
+    # zero-copy writable ndarray over native memory, owner is kept alive as long as the array
+    nbytes = int(np.prod(shape,dtype=np.int64))*dtype.itemsize
+    buffer = (ctypes.c_char*nbytes).from_address(addr)
+    buffer._owner = owner
+    return np.frombuffer(buffer,dtype=dtype).reshape(shape)
+
+
+class _FFINativeBuffer:
+    # array interface of native memory, arrays made from it keep it (and so owner) alive
+    __slots__ = ("__array_interface__","owner")
+
+
+class _FFIOwnedBuffer(_FFINativeBuffer):
+    # frees the memory once no array refers to it anymore
+    __slots__ = ("_deallocate",)
+    def __del__(self):
+        self._deallocate(self.__array_interface__["data"][0])
+
+
+def ffi_ndarray_view(addr:int,dtype:np.dtype,n:int,readonly:bool=False,owner=None,deallocate=None)->np.ndarray:
+    # zero-copy 1-d ndarray of n elements of dtype at addr, keeping owner alive.
+    # with deallocate, deallocate(addr) is called once the array and its views are gone
+    n = operator.index(n)
+    assert n >= 0, "negative buffer size {}".format(n)
+    if deallocate is None:
+        buffer = _FFINativeBuffer()
+    else:
+        buffer = _FFIOwnedBuffer()
+        buffer._deallocate = deallocate
+    buffer.owner = owner
+    if dtype.fields is None:
+        buffer.__array_interface__ = {"data":(addr,readonly),"shape":(n,),"typestr":dtype.str,"version":3}
+        return np.asarray(buffer)
+    # structured dtypes are viewed from bytes, so padding and alignment stay as registered
+    buffer.__array_interface__ = {"data":(addr,readonly),"shape":(n*dtype.itemsize,),"typestr":"|u1","version":3}
+    return np.asarray(buffer).view(dtype)
+
+
+def ffi_compile_size_expr(expr:str,factor)->str:
+    # python source of a size expression (see FFI_REGISTER_OUTPUT_PARAM/FFI_REGISTER_RETURN_BUFFER),
+    # a sum of products of integer constants and other factors like aN or *aN, which factor translates
+    # into python source or rejects with None
+    terms = []
+    for term in expr.replace(" ","").split("+"):
+        parts = term.split("*")
+        factors = []
+        i = 0
+        while i < len(parts):
+            f = parts[i]
+            # "*a0".split("*") gives ["", "a0"]
+            if f == "" and i+1 < len(parts):
+                i += 1
+                f = "*"+parts[i]
+            i += 1
+            src = f if f.isdigit() else factor(f)
+            assert src is not None, "invalid size expression {}".format(expr)
+            factors.append(src)
+        terms.append("*".join(factors))
+    return "+".join(terms)
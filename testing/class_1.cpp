@@ -31,4 +31,4 @@ void destroy_fooclass(fooclass* fc){
 
 FFI_REGISTER_CLASS(fooclass, "fooclass", create_fooclass, destroy_fooclass);
 FFI_REGISTER_CLASS_FIELD(fooclass, speed, fooclass::speed, "fooclass.speed");
-FFI_REGISTER_CLASS_METHOD(&fooclass::double_speed, "fooclass.double_speed");
+FFI_REGISTER_CLASS_METHOD_BATCHED(&fooclass::double_speed, "fooclass.double_speed");
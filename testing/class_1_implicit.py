@@ -15,3 +15,21 @@ foo.speed = 789
 print("foo's new speed is {}".format(foo.speed))
 foo.double_speed()
 print("foo's doubled new speed is {}".format(foo.speed))
+
+import asyncio
+# bound class methods are awaitable too, the call runs on the lib's async executor
+asyncio.run(foo.double_speed.acall())
+print("foo's speed doubled by acall is {}".format(foo.speed))
+foo.speed = 789
+foo.double_speed()
+
+import pickle
+# registered fields are pickled as one out-of-band buffer, the copy is
+# constructed with zero arguments (see ffi_pickle_args) before they are written
+buffers = []
+data = pickle.dumps(foo,protocol=5,buffer_callback=buffers.append)
+foo_copy = pickle.loads(data,buffers=buffers)
+print("foo_copy's speed is {}".format(foo_copy.speed)) #gives 1578.0
+snapshot = FooClass.ffi_snapshot([foo,foo_copy])
+foos = FooClass.ffi_restore(snapshot)
+print("restored speeds are {}".format([f.speed for f in foos])) #gives [1578.0, 1578.0]
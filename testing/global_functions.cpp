@@ -1,11 +1,12 @@
 #include "../cpp/ffi_man.hpp"
 #include <cstdint>
 #include <cstddef>
+#include <cstdlib>
 
 double mult(double x, double y){
     return x*y;
 }
-FFI_REGISTER_GLOBAL_FUNCTION(mult, "mult");
+FFI_REGISTER_GLOBAL_FUNCTION_BATCHED(mult, "mult");
 
 const char* cstrtester(){
     static const char* str = "good";
@@ -13,11 +14,83 @@ const char* cstrtester(){
 }
 FFI_REGISTER_GLOBAL_FUNCTION(cstrtester, "cstrtester");
 
-uint64_t count_zeros(uint32_t* array, uint64_t n){
+template <typename T>
+uint64_t count_zeros(T* array, uint64_t n){
     uint64_t count = 0;
     for (uint64_t i=0;i<n;i++){
         if (array[i]==0) count++;
     }
     return count;
 }
-FFI_REGISTER_GLOBAL_FUNCTION(count_zeros, "count_zeros");
\ No newline at end of file
+// overloads: every instantiation is registered under the same name
+FFI_REGISTER_GLOBAL_FUNCTION(count_zeros<uint32_t>, "count_zeros");
+FFI_REGISTER_GLOBAL_FUNCTION(count_zeros<float>, "count_zeros");
+FFI_REGISTER_GLOBAL_FUNCTION(count_zeros<double>, "count_zeros");
+
+uint64_t byte_sum(const uint8_t* data, uint64_t n){
+    uint64_t sum = 0;
+    for (uint64_t i=0;i<n;i++){
+        sum += data[i];
+    }
+    return sum;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(byte_sum, "byte_sum");
+
+struct Point3{
+    float x;
+    float y;
+    float z;
+};
+// the struct must be registered before the functions using it
+FFI_REGISTER_STRUCT(Point3, "Point3")
+FFI_REGISTER_STRUCT_FIELD(Point3, x, "Point3.x")
+FFI_REGISTER_STRUCT_FIELD(Point3, y, "Point3.y")
+FFI_REGISTER_STRUCT_FIELD(Point3, z, "Point3.z")
+
+void scale_points(Point3* pts, uint64_t n, float s){
+    for (uint64_t i=0;i<n;i++){
+        pts[i].x *= s;
+        pts[i].y *= s;
+        pts[i].z *= s;
+    }
+}
+FFI_REGISTER_GLOBAL_FUNCTION(scale_points, "scale_points");
+
+double sum_x(const Point3* pts, uint64_t n){
+    double sum = 0;
+    for (uint64_t i=0;i<n;i++){
+        sum += pts[i].x;
+    }
+    return sum;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(sum_x, "sum_x");
+
+Point3* unit_points(){
+    static Point3 points[3] = {{1,0,0},{0,1,0},{0,0,1}};
+    return points;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(unit_points, "unit_points");
+
+template <typename T>
+void prefix_sum(const T* x, uint64_t n, T* out){
+    T sum = 0;
+    for (uint64_t i=0;i<n;i++){
+        sum += x[i];
+        out[i] = sum;
+    }
+}
+FFI_REGISTER_GLOBAL_FUNCTION(prefix_sum<double>, "prefix_sum");
+FFI_REGISTER_GLOBAL_FUNCTION(prefix_sum<int64_t>, "prefix_sum");
+// out (parameter 2) is an output of n (parameter 1) elements: callers leave it out
+FFI_REGISTER_OUTPUT_PARAM("prefix_sum", 2, "a1");
+
+double* linspace(double start, double stop, int64_t n){
+    double* values = static_cast<double*>(std::malloc(sizeof(double)*n));
+    for (int64_t i=0;i<n;i++){
+        values[i] = n > 1 ? start+(stop-start)*i/(n-1) : start;
+    }
+    return values;
+}
+FFI_REGISTER_GLOBAL_FUNCTION(linspace, "linspace");
+// the returned buffer has n (parameter 2) elements, the caller owns it and frees it with std::free
+FFI_REGISTER_OWNED_RETURN_BUFFER("linspace", "a2", std::free);
@@ -12,6 +12,10 @@ class Mult(lib.FFIGlobalFunc):
 mult = Mult()
 result = mult(5,6) #gives 30
 print(result)
+# mult is registered with FFI_REGISTER_GLOBAL_FUNCTION_BATCHED,
+# so ndarrays are applied elementwise in a single native call
+result = mult(np.arange(5,dtype=np.float64),2) #gives [0. 2. 4. 6. 8.]
+print(result)
 
 class CstrTester(lib.FFIGlobalFunc):
     def __init__(self) -> None:
@@ -34,7 +38,52 @@ class Count_Zeros(lib.FFIGlobalFunc):
         return super().__call__(array,array.size)  
 
 count_zeros = Count_Zeros()
-# note that the dtype has to be correct
 array = np.array([1,2,3,4,5,0,0,0],dtype = np.uint32) 
 result = count_zeros(array) #gives 3
-print(result)
\ No newline at end of file
+print(result)
+# count_zeros is registered for uint32, float and double arrays,
+# the overload is picked by the dtype
+array = np.array([0.0,1.5,0.0],dtype = np.float64)
+result = count_zeros(array) #gives 2
+print(result)
+# any c contiguous buffer with a matching format could be passed for pointers,
+# read-only ones (like bytes) only for pointers to const
+byte_sum = lib.FFIGlobalFunc("byte_sum")
+data = b"\x01\x02\x03"
+result = byte_sum(data,len(data)) #gives 6
+print(result)
+# Point3 is registered with FFI_REGISTER_STRUCT, arrays of its dtype are passed without copies
+points = np.zeros(4,dtype=lib.ffi_struct_dtype("Point3"))
+points["x"] = [1,2,3,4]
+scale_points = lib.FFIGlobalFunc("scale_points")
+scale_points(points,len(points),2.0)
+print(points["x"]) #gives [2. 4. 6. 8.]
+sum_x = lib.FFIGlobalFunc("sum_x")
+result = sum_x(points,len(points)) #gives 20.0
+print(result)
+# returned struct pointers are 0-d views, ffi_struct_array views more structs behind them
+unit_points = lib.ffi_struct_array("Point3",lib.FFIGlobalFunc("unit_points")(),3)
+print(unit_points["y"]) #gives [0. 1. 0.]
+# inputs larger than memory (file paths, iterables of buffers...) are streamed in chunks
+import operator
+array = np.zeros(10,dtype=np.uint32)
+result = count_zeros.stream(array,chunk_size=4,reducer=operator.add,call=lambda f,chunk: f(chunk)) #gives 10
+print(result)
+# prefix_sum declares its third parameter as an output of n elements,
+# it is allocated from the lib's buffer pool and returned
+prefix_sum = lib.FFIGlobalFunc("prefix_sum")
+x = np.arange(5,dtype=np.float64)
+result = prefix_sum(x,len(x)) #gives [ 0.  1.  3.  6. 10.]
+print(result)
+out = np.empty(5,dtype=np.int64)
+prefix_sum(np.arange(5),5,out=out) #writes [0 1 3 6 10] into out
+print(out)
+# buffers are reused once their arrays are gone
+del result
+result = prefix_sum(x,len(x))
+print(lib.ffi_buffer_pool_stats()["hits"]) #gives 1
+# linspace returns a malloc'ed buffer of n elements as an ndarray without a copy,
+# it is freed once the array and its views are gone
+linspace = lib.FFIGlobalFunc("linspace")
+values = linspace(0.0,1.0,5)
+print(values) #gives [0.   0.25 0.5  0.75 1.  ]